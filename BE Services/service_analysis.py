@@ -3,12 +3,22 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from Data_API import database
 import time
-import pandas as pd
 from datetime import datetime, timedelta
 from sqlalchemy import desc
-from Data_API.database import SessionLocal, Earthquake, AnalysisStat
+from Data_API.database import SessionLocal, read_session, Earthquake, AnalysisStat, bump_data_version
+from Data_API.earthquake_archive import include_archived
+from Data_API.analytics_store import read_frame
 
 SLEEP_TIME = 300 # 5 phút
+# Chế độ watch: chờ change_outbox thay vì sleep-poll
+WATCH_POLL_INTERVAL = int(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_CONSUMER = "analysis"
+DEFAULT_WINDOW = timedelta(hours=24)
+
+def default_window():
+    # Cửa sổ phân tích mặc định, cùng đồng hồ UTC với earthquakes.time và span của change_outbox
+    end_date = datetime.utcnow()
+    return end_date - DEFAULT_WINDOW, end_date
 
 def run_analysis(custom_start=None, custom_end=None):
 
@@ -20,17 +30,23 @@ def run_analysis(custom_start=None, custom_end=None):
             analysis_type = "CUSTOM_RANGE"
             print(f"[{datetime.now()}] Custom range analysis: {custom_start} to {custom_end}")
         else:
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(hours=24)
+            start_date, end_date = default_window()
             analysis_type = "LAST_24H"
             print(f"[{datetime.now()}] Starting default 24h analysis...")
 
-        query = session.query(Earthquake).filter(
-            Earthquake.time >= start_date,
-            Earthquake.time <= end_date
-        )
-        
-        df = pd.read_sql(query.statement, session.bind)
+        # Đọc từ replica (nếu có), ghi AnalysisStat vào DB chính
+        read_db = read_session()
+        try:
+            query = read_db.query(Earthquake).filter(
+                Earthquake.time >= start_date,
+                Earthquake.time <= end_date
+            )
+
+            df = read_frame(query.statement, read_db, OUTBOX_CONSUMER)
+            # Khoảng thời gian cũ có thể đã chuyển sang archive
+            df = include_archived(read_db, df, start_date, end_date)
+        finally:
+            read_db.close()
         
         if df.empty:
             print(f"-> No data in range {start_date} to {end_date} to analyze.")
@@ -111,6 +127,7 @@ def run_analysis(custom_start=None, custom_end=None):
         )
         
         session.add(stat_entry)
+        bump_data_version(session)
         session.commit()
         
         print(f"-> Analysis saved: {total_events} events, Max Mag: {max_mag:.2f}")
@@ -148,6 +165,22 @@ def run_analysis_service():
         run_analysis()  # Chạy với default 24h
         time.sleep(SLEEP_TIME)
 
+def run_analysis_watch():
+
+    print("Service Analysis Started (watch mode: chạy khi có dữ liệu mới trong 24h)...")
+    cursor = database.get_outbox_cursor(OUTBOX_CONSUMER)
+    run_analysis()
+    while True:
+        changes = database.wait_for_changes(cursor, WATCH_POLL_INTERVAL)
+        cursor = changes[-1].id
+        # Phân tích mặc định chỉ nhìn 24h gần nhất -> bỏ qua batch backfill dữ liệu cũ
+        window_start, _ = default_window()
+        if any(c.span_end is None or c.span_end >= window_start for c in changes):
+            # Replica phải có batch vừa đánh thức, nếu không đọc từ DB chính
+            with database.reads_after_change(cursor):
+                run_analysis()
+        database.set_outbox_cursor(OUTBOX_CONSUMER, cursor)
+
 if __name__ == "__main__":
     import sys
     
@@ -163,10 +196,14 @@ if __name__ == "__main__":
         elif command == 'service':
             # Chạy service định kỳ
             run_analysis_service()
+        elif command == 'watch':
+            # Chạy lại khi ingestion báo thay đổi qua change_outbox
+            run_analysis_watch()
         else:
             print("Usage:")
             print("  python service_analysis.py custom 2025-01-01 2025-12-01")
             print("  python service_analysis.py service")
+            print("  python service_analysis.py watch")
     else:
         # Chạy service thường xuyên (mặc định)
         run_analysis_service()
\ No newline at end of file
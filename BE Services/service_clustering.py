@@ -3,15 +3,22 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from Data_API import database
 import time
-import pandas as pd
 import numpy as np
 from sklearn.cluster import KMeans
 from datetime import datetime
-from Data_API.database import SessionLocal, Earthquake, ClusterInfo
+from sqlalchemy import insert
+from Data_API.database import SessionLocal, read_session, Earthquake, ClusterRun, ClusterAssignment, ClusterStat
+from Data_API.analytics_store import read_frame
 
 # Chạy 1 ngày 1 lần.
 SLEEP_TIME = 86400 
 N_CLUSTERS = 5 
+# Chế độ watch: chờ change_outbox, phân cụm lại khi có event mới nhưng không quá 1 lần / CLUSTERING_MIN_INTERVAL
+WATCH_POLL_INTERVAL = int(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+CLUSTERING_MIN_INTERVAL = int(os.getenv("CLUSTERING_MIN_INTERVAL", "3600"))
+OUTBOX_CONSUMER = "clustering"
+# Số nhãn mỗi lần bulk insert vào cluster_assignments
+CLUSTER_INSERT_BATCH = int(os.getenv("CLUSTER_INSERT_BATCH", "10000"))
 
 def get_zone_name(lat, lon):
 
@@ -87,13 +94,106 @@ def get_zone_name(lat, lon):
         
         return f"{ocean} - {ns}{ew}"
 
+def read_points(query):
+    # Đọc toạ độ từ replica (nếu có); run phân cụm ghi vào DB chính
+    read_db = read_session()
+    try:
+        return read_frame(query.statement, read_db, OUTBOX_CONSUMER)
+    finally:
+        read_db.close()
+
+def cluster_risk(count_in_cluster, total, n_clusters, magnitudes):
+    if not magnitudes.empty:
+        avg_magnitude = float(magnitudes.mean())
+        max_magnitude = float(magnitudes.max())
+    else:
+        avg_magnitude = 0
+        max_magnitude = 0
+
+    is_high_count = count_in_cluster > total / n_clusters
+    is_high_magnitude = max_magnitude >= 6.0 or avg_magnitude >= 5.0
+    is_moderate_magnitude = max_magnitude >= 4.5 or avg_magnitude >= 3.5
+
+    if is_high_magnitude or (is_high_count and is_moderate_magnitude):
+        risk = "High"
+    elif is_moderate_magnitude or is_high_count:
+        risk = "Medium"
+    else:
+        risk = "Low"
+    return risk, avg_magnitude, max_magnitude
+
+def save_cluster_run(session, df, centers, n_clusters, time_range):
+    """
+    Ghi kết quả phân cụm thành 1 run mới rồi mới công bố (đổi CLUSTER_RUN_KEY).
+    Nhãn được bulk insert vào cluster_assignments, không cập nhật từng dòng earthquakes.
+    Trả về (run_id, danh sách thống kê cụm)
+    """
+    run = ClusterRun(status='running', n_clusters=n_clusters, total_events=len(df),
+                     time_range=time_range, started_at=datetime.utcnow())
+    session.add(run)
+    session.commit()
+    run_id = run.run_id
+
+    try:
+        print(f"-> Đang ghi nhãn cụm vào run {run_id}...")
+        ids = df['id'].tolist()
+        labels = df['cluster_label'].astype(int).tolist()
+        for start in range(0, len(ids), CLUSTER_INSERT_BATCH):
+            session.execute(insert(ClusterAssignment), [
+                {"run_id": run_id, "earthquake_id": eq_id, "cluster_label": label}
+                for eq_id, label in zip(ids[start:start + CLUSTER_INSERT_BATCH], labels[start:start + CLUSTER_INSERT_BATCH])
+            ])
+            session.commit()
+
+        cluster_results = []
+        for i, center in enumerate(centers):
+            cluster_earthquakes = df[df['cluster_label'] == i]
+            count_in_cluster = len(cluster_earthquakes)
+            # magnitude đọc cùng toạ độ: không query IN (hàng chục nghìn id) cho từng cụm
+            risk, avg_magnitude, max_magnitude = cluster_risk(
+                count_in_cluster, len(df), n_clusters, cluster_earthquakes['magnitude'].dropna())
+
+            zone_name = get_zone_name(center[0], center[1])
+            session.add(ClusterStat(
+                run_id=run_id,
+                cluster_id=i,
+                cluster_name=zone_name,
+                centroid_lat=float(center[0]),
+                centroid_lon=float(center[1]),
+                risk_level=risk,
+                earthquake_count=count_in_cluster,
+                avg_magnitude=avg_magnitude,
+                max_magnitude=max_magnitude,
+                updated_at=datetime.utcnow()
+            ))
+            cluster_results.append({
+                "cluster_id": i,
+                "name": zone_name,
+                "centroid": [float(center[0]), float(center[1])],
+                "risk_level": risk,
+                "earthquake_count": count_in_cluster
+            })
+        session.flush()
+
+        # Đổi run hiện tại: 1 transaction, người đọc thấy run cũ hoặc run mới trọn vẹn
+        if not database.publish_cluster_run(session, run_id):
+            print(f"-> Run {run_id} cũ hơn run hiện tại, không công bố")
+    except Exception:
+        session.rollback()
+        # Run ghi dở: xoá, không bao giờ được công bố
+        database.delete_cluster_runs(session, [run_id])
+        raise
+
+    database.prune_cluster_runs(session)
+    return run_id, cluster_results
+
 def run_clustering():
     session = SessionLocal()
     try:
         print(f"[{datetime.now()}] Bắt đầu Clustering (K-Means)...")
 
-        query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude)
-        df = pd.read_sql(query.statement, session.bind)
+        query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude, Earthquake.magnitude)
+        df = read_points(query)
         
         if len(df) < N_CLUSTERS:
             print("-> Không đủ dữ liệu để phân cụm.")
@@ -106,61 +206,8 @@ def run_clustering():
         
         df['cluster_label'] = kmeans.labels_
         
-        print("-> Đang cập nhật nhãn cụm vào Database...")
-        for index, row in df.iterrows():
-            session.query(Earthquake).filter(Earthquake.id == row['id']).update(
-                {"cluster_label": int(row['cluster_label'])}
-            )
-            
-        session.query(ClusterInfo).delete(synchronize_session=False)
-        session.commit()
-        
-        centers = kmeans.cluster_centers_ 
-        #cluster_results = []
-        for i, center in enumerate(centers):
-
-            count_in_cluster = len(df[df['cluster_label'] == i])
-
-            cluster_earthquakes = df[df['cluster_label'] == i]
-            
-            cluster_ids = cluster_earthquakes['id'].tolist()
-            cluster_magnitudes = session.query(Earthquake.magnitude).filter(
-                Earthquake.id.in_(cluster_ids),
-                Earthquake.magnitude.isnot(None)
-            ).all()
-            
-            if cluster_magnitudes:
-                magnitudes = [m.magnitude for m in cluster_magnitudes]
-                avg_magnitude = sum(magnitudes) / len(magnitudes)
-                max_magnitude = max(magnitudes)
-            else:
-                avg_magnitude = 0
-                max_magnitude = 0
-            
-            is_high_count = count_in_cluster > len(df) / N_CLUSTERS
-            is_high_magnitude = max_magnitude >= 6.0 or avg_magnitude >= 5.0
-            is_moderate_magnitude = max_magnitude >= 4.5 or avg_magnitude >= 3.5
-            
-            if is_high_magnitude or (is_high_count and is_moderate_magnitude):
-                risk = "High"
-            elif is_moderate_magnitude or is_high_count:
-                risk = "Medium"
-            else:
-                risk = "Low"
-            
-            zone_name = get_zone_name(center[0], center[1])
-            c_info = ClusterInfo(
-                cluster_id=i,
-                cluster_name=zone_name,
-                centroid_lat=float(center[0]),
-                centroid_lon=float(center[1]),
-                risk_level=risk,
-                updated_at=datetime.utcnow()
-            )
-            session.add(c_info)
-
-        session.commit()
-        print("-> Phân cụm hoàn thành & Đã lưu.")
+        run_id, _ = save_cluster_run(session, df, kmeans.cluster_centers_, N_CLUSTERS, "all_data")
+        print(f"-> Phân cụm hoàn thành & Đã lưu (run {run_id}).")
 
     except Exception as e:
         print(f"Lỗi trong quá trình phân cụm: {e}")
@@ -175,6 +222,24 @@ def run_clustering_service():
         run_clustering()
         time.sleep(SLEEP_TIME)
 
+def run_clustering_watch():
+
+    print(f"Dịch vụ Phân cụm Bắt đầu (watch mode, tối thiểu {CLUSTERING_MIN_INTERVAL}s giữa 2 lần)...")
+    cursor = database.get_outbox_cursor(OUTBOX_CONSUMER)
+    while True:
+        changes = database.wait_for_changes(cursor, WATCH_POLL_INTERVAL)
+        cursor = changes[-1].id
+        # Chỉ event mới làm thay đổi tập điểm; bản cập nhật magnitude/status không cần phân cụm lại
+        rerun = any(c.new_count for c in changes)
+        if rerun:
+            # Replica phải có batch vừa đánh thức, nếu không đọc từ DB chính
+            with database.reads_after_change(cursor):
+                run_clustering()
+        database.set_outbox_cursor(OUTBOX_CONSUMER, cursor)
+        if rerun:
+            # Các batch tới trong lúc chờ được gom vào lần chạy sau
+            time.sleep(CLUSTERING_MIN_INTERVAL)
+
 def run_clustering_with_params(custom_start=None, custom_end=None, n_clusters=None):
   
     session = SessionLocal()
@@ -188,15 +253,15 @@ def run_clustering_with_params(custom_start=None, custom_end=None, n_clusters=No
             end_date = datetime.strptime(custom_end, '%Y-%m-%d')
             
             print(f"-> Khoảng thời gian tùy chỉnh: {custom_start} đến {custom_end}")
-            query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude).filter(
+            query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude, Earthquake.magnitude).filter(
                 Earthquake.time >= start_date,
                 Earthquake.time <= end_date
             )
         else:
             print("-> Sử dụng tất cả dữ liệu có sẵn")
-            query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude)
+            query = session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude, Earthquake.magnitude)
 
-        df = pd.read_sql(query.statement, session.bind)
+        df = read_points(query)
         
         if len(df) < num_clusters:
             print(f"-> Không đủ dữ liệu để tạo {num_clusters} cụm. Có: {len(df)}")
@@ -209,77 +274,18 @@ def run_clustering_with_params(custom_start=None, custom_end=None, n_clusters=No
         kmeans.fit(X)
         
         df['cluster_label'] = kmeans.labels_
-       
-        print("-> Đang cập nhật nhãn cụm vào Database...")
-        for index, row in df.iterrows():
-            session.query(Earthquake).filter(Earthquake.id == row['id']).update(
-                {"cluster_label": int(row['cluster_label'])}
-            )
-        session.commit()    
 
-        session.query(ClusterInfo).delete(synchronize_session=False)
-        session.commit()
-        centers = kmeans.cluster_centers_
-        cluster_results = []
-        
-        for i, center in enumerate(centers):
-            count_in_cluster = len(df[df['cluster_label'] == i])
-
-            cluster_earthquakes = df[df['cluster_label'] == i]
-
-            cluster_ids = cluster_earthquakes['id'].tolist()
-            cluster_magnitudes = session.query(Earthquake.magnitude).filter(
-                Earthquake.id.in_(cluster_ids),
-                Earthquake.magnitude.isnot(None)
-            ).all()
-            
-            if cluster_magnitudes:
-                magnitudes = [m.magnitude for m in cluster_magnitudes]
-                avg_magnitude = sum(magnitudes) / len(magnitudes)
-                max_magnitude = max(magnitudes)
-            else:
-                avg_magnitude = 0
-                max_magnitude = 0
-            
-            is_high_count = count_in_cluster > len(df) / num_clusters
-            is_high_magnitude = max_magnitude >= 6.0 or avg_magnitude >= 5.0
-            is_moderate_magnitude = max_magnitude >= 4.5 or avg_magnitude >= 3.5
-            
-            if is_high_magnitude or (is_high_count and is_moderate_magnitude):
-                risk = "High"
-            elif is_moderate_magnitude or is_high_count:
-                risk = "Medium"
-            else:
-                risk = "Low"
-            
-            zone_name = get_zone_name(center[0], center[1])
-            c_info = ClusterInfo(
-                cluster_id=i,
-                cluster_name=zone_name,
-                centroid_lat=float(center[0]),
-                centroid_lon=float(center[1]),
-                risk_level=risk,
-                updated_at=datetime.utcnow()
-            )
-            session.add(c_info)
-            
-            cluster_results.append({
-                "cluster_id": i,
-                "name": zone_name,
-                "centroid": [float(center[0]), float(center[1])],
-                "risk_level": risk,
-                "earthquake_count": count_in_cluster
-            })
-
-        session.commit()
-        print(f"-> Phân cụm Tùy chỉnh hoàn thành với {num_clusters} cụm.")
+        time_range = f"{custom_start} to {custom_end}" if custom_start and custom_end else "all_data"
+        run_id, cluster_results = save_cluster_run(session, df, kmeans.cluster_centers_, num_clusters, time_range)
+        print(f"-> Phân cụm Tùy chỉnh hoàn thành với {num_clusters} cụm (run {run_id}).")
         
         return {
             "status": "success",
             "clusters": cluster_results,
             "total_earthquakes": len(df),
             "n_clusters": num_clusters,
-            "time_range": f"{custom_start} to {custom_end}" if custom_start and custom_end else "all_data"
+            "run_id": run_id,
+            "time_range": time_range
         }
 
     except Exception as e:
@@ -317,6 +323,10 @@ if __name__ == "__main__":
         elif command == 'service':
             # Chạy service định kỳ
             run_clustering_service()
+
+        elif command == 'watch':
+            # Chạy lại khi ingestion báo event mới qua change_outbox
+            run_clustering_watch()
             
         else:
             print("Usage:")
@@ -324,6 +334,7 @@ if __name__ == "__main__":
             print("  python service_clustering.py clusters 8")
             print("  python service_clustering.py run")
             print("  python service_clustering.py service")
+            print("  python service_clustering.py watch")
             print("")
             print("Examples:")
             print("  python service_clustering.py custom 2024-01-01 2024-12-01 7")
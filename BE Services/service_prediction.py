@@ -7,9 +7,14 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from sklearn.ensemble import RandomForestRegressor
-from Data_API.database import SessionLocal, Earthquake, Prediction, AnalysisStat
+from Data_API.database import SessionLocal, read_session, Earthquake, Prediction, AnalysisStat, ClusterAssignment, current_cluster_run, cluster_label_join, bump_data_version
+from Data_API.earthquake_archive import include_archived
+from Data_API.analytics_store import read_frame
 
 SLEEP_TIME = 300  # Chạy 5 phút/lần
+# Chế độ watch: chờ change_outbox, dự đoán lại khi có thay đổi nhưng không quá 1 lần / SLEEP_TIME
+WATCH_POLL_INTERVAL = int(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_CONSUMER = "prediction"
 
 def handle_missing_data(df, session):
 
@@ -228,6 +233,8 @@ def estimate_coordinates_from_place(place_string):
 
 def run_prediction():
     session = SessionLocal()
+    # Đọc dữ liệu huấn luyện từ replica (nếu có), ghi kết quả vào DB chính
+    read_db = read_session()
     try:
         print(f"[{datetime.now()}] Đang chạy mô hình dự đoán: Raw + Cluster + Analysis)...")
 
@@ -236,17 +243,19 @@ def run_prediction():
         current_activity_level = latest_stat.total_events if latest_stat else 50
         print(f"-> Mức độ hoạt động: {current_activity_level} trận/24h")
 
-        query = session.query(
+        # Nhãn cụm theo run phân cụm hiện tại
+        run_id = current_cluster_run(read_db)
+        query = read_db.query(
             Earthquake.magnitude, 
             Earthquake.depth, 
             Earthquake.latitude, 
             Earthquake.longitude,
-            Earthquake.cluster_label,
+            ClusterAssignment.cluster_label,
             Earthquake.time,
             Earthquake.place
-        ).order_by(Earthquake.time.desc()).limit(2000) 
+        ).outerjoin(ClusterAssignment, cluster_label_join(run_id)).order_by(Earthquake.time.desc()).limit(2000) 
         
-        df = pd.read_sql(query.statement, session.bind)
+        df = read_frame(query.statement, read_db, OUTBOX_CONSUMER)
         
         if len(df) < 50:
             print("-> Không đủ dữ liệu để huấn luyện mô hình.")
@@ -360,6 +369,7 @@ def run_prediction():
         session.add(pred_mag_reg)
         session.add(pred_depth_reg)
         session.add(pred_risk_class)
+        bump_data_version(session)
         session.commit()
         
         print(f"-> Enhanced Predictions Saved:")
@@ -373,6 +383,7 @@ def run_prediction():
         create_error_predictions(session, f"Model training error: {str(e)}")
         session.rollback()
     finally:
+        read_db.close()
         session.close()
 def create_error_predictions(session, error_message):
 
@@ -408,6 +419,7 @@ def create_error_predictions(session, error_message):
         session.add(error_mag)
         session.add(error_depth)
         session.add(error_risk)
+        bump_data_version(session)
         session.commit()
         
         print(f"-> ERROR PREDICTIONS created: {error_message}")
@@ -423,41 +435,61 @@ def run_prediction_service():
         run_prediction()
         time.sleep(SLEEP_TIME)
 
+def run_prediction_watch():
+
+    print("Dịch vụ Dự đoán Bắt đầu (watch mode)...")
+    cursor = database.get_outbox_cursor(OUTBOX_CONSUMER)
+    while True:
+        changes = database.wait_for_changes(cursor, WATCH_POLL_INTERVAL)
+        cursor = changes[-1].id
+        # Replica phải có batch vừa đánh thức, nếu không đọc từ DB chính
+        with database.reads_after_change(cursor):
+            run_prediction()
+        database.set_outbox_cursor(OUTBOX_CONSUMER, cursor)
+        # Các batch tới trong lúc chờ được gom vào lần chạy sau
+        time.sleep(SLEEP_TIME)
+
 def run_prediction_with_params(custom_start=None, custom_end=None, prediction_days=1, model_type="RandomForest"):
     session = SessionLocal()
+    read_db = read_session()
     try:
         print(f"[{datetime.now()}] Custom Prediction: {model_type} model, {prediction_days} days ahead")
+        run_id = current_cluster_run(read_db)
         
         if custom_start and custom_end:
             start_date = datetime.strptime(custom_start, '%Y-%m-%d')
             end_date = datetime.strptime(custom_end, '%Y-%m-%d')
             print(f"-> Khoảng thời gian dữ liệu: {custom_start} đến {custom_end}")
             
-            query = session.query(
+            query = read_db.query(
                 Earthquake.magnitude, 
                 Earthquake.depth, 
                 Earthquake.latitude, 
                 Earthquake.longitude,
-                Earthquake.cluster_label,
+                ClusterAssignment.cluster_label,
                 Earthquake.time,
                 Earthquake.place
-            ).filter(
+            ).outerjoin(ClusterAssignment, cluster_label_join(run_id)).filter(
                 Earthquake.time >= start_date,
                 Earthquake.time <= end_date
             ).order_by(Earthquake.time.desc())
         else:
             print("-> Sử dụng mặc định: 2000 bản ghi mới nhất")
-            query = session.query(
+            query = read_db.query(
                 Earthquake.magnitude, 
                 Earthquake.depth, 
                 Earthquake.latitude, 
                 Earthquake.longitude,
-                Earthquake.cluster_label,
+                ClusterAssignment.cluster_label,
                 Earthquake.time,
                 Earthquake.place
-            ).order_by(Earthquake.time.desc()).limit(2000)
+            ).outerjoin(ClusterAssignment, cluster_label_join(run_id)).order_by(Earthquake.time.desc()).limit(2000)
         
-        df = pd.read_sql(query.statement, session.bind)
+        df = read_frame(query.statement, read_db, OUTBOX_CONSUMER)
+        if custom_start and custom_end:
+            # Khoảng thời gian cũ có thể đã chuyển sang archive
+            df = include_archived(read_db, df, start_date, end_date)
+            df = df.sort_values('time', ascending=False, ignore_index=True)
         
         if len(df) < 50:
             error_msg = f"Dữ liệu huấn luyện không đủ: {len(df)} bản ghi"
@@ -586,6 +618,7 @@ def run_prediction_with_params(custom_start=None, custom_end=None, prediction_da
                 }
             })
 
+        bump_data_version(session)
         session.commit()
         
         print(f"-> Dự đoán Tùy chỉnh Hoàn thành:")
@@ -607,6 +640,7 @@ def run_prediction_with_params(custom_start=None, custom_end=None, prediction_da
         session.rollback()
         return {"error": str(e)}
     finally:
+        read_db.close()
         session.close()
         
         
@@ -648,6 +682,10 @@ if __name__ == "__main__":
         elif command == 'service':
             # Chạy service định kỳ
             run_prediction_service()
+
+        elif command == 'watch':
+            # Chạy lại khi ingestion báo thay đổi qua change_outbox
+            run_prediction_watch()
             
         else:
             print("Usage:")
@@ -656,6 +694,7 @@ if __name__ == "__main__":
             print("  python service_prediction.py days 7")
             print("  python service_prediction.py run")
             print("  python service_prediction.py service")
+            print("  python service_prediction.py watch")
             print("")
             print("Models: RandomForest, Linear, SVM")
             print("Examples:")
@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+import pandas as pd
+from sqlalchemy import select, func, DateTime, Integer, Float, Numeric
+from sqlalchemy.dialects import postgresql
+from .database import (Earthquake, ChangeOutbox, ClusterAssignment, current_cluster_run, fetch_changes, change_ids,
+                       latest_change_id, archive_boundary, OUTBOX_RESET_SOURCE)
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Bản sao dạng cột (DuckDB, nhúng trong process) của bảng earthquakes cho các truy vấn phân tích
+# quét nhiều dòng: clustering, correlation, analysis, prediction.
+# ANALYTICS_ENGINE=duckdb (cần gói duckdb) -> read_frame đồng bộ bản sao theo change_outbox rồi chạy
+# truy vấn trên DuckDB; mặc định (hoặc thiếu duckdb / DuckDB lỗi) -> pd.read_sql trên DB chính như cũ.
+# Độ mới chỉ dựa vào cursor của outbox (1 query theo PK mỗi lần đọc); so số dòng với DB chính
+# chạy mỗi ANALYTICS_CHECK_INTERVAL giây hoặc khi outbox có id bị nhảy cóc.
+# Mỗi consumer một file riêng: DuckDB chỉ cho 1 process mở file để ghi.
+# Kèm bản sao cluster_assignments của run phân cụm hiện tại (truy vấn join nhãn cụm chạy được trên DuckDB).
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sql").lower()
+ANALYTICS_DUCKDB_DIR = os.getenv(
+    "ANALYTICS_DUCKDB_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analytics_store'))
+)
+# Số dòng mỗi lần chép từ DB chính sang DuckDB
+ANALYTICS_SYNC_CHUNK = int(os.getenv("ANALYTICS_SYNC_CHUNK", "50000"))
+ID_BATCH = 1000
+# Giây giữa 2 lần so số dòng bản sao với DB chính (0 = mỗi lần đọc)
+ANALYTICS_CHECK_INTERVAL = float(os.getenv("ANALYTICS_CHECK_INTERVAL", "600"))
+COLUMNS = [column.name for column in Earthquake.__table__.columns]
+
+stores = {}
+stores_lock = threading.Lock()
+warned_missing = False
+
+def analytics_enabled():
+    global warned_missing
+    if ANALYTICS_ENGINE != 'duckdb':
+        return False
+    if duckdb is None:
+        if not warned_missing:
+            print("⚠️ ANALYTICS_ENGINE=duckdb nhưng chưa cài duckdb, đọc trực tiếp từ DB chính")
+            warned_missing = True
+        return False
+    return True
+
+def duckdb_type(column):
+    if isinstance(column.type, DateTime):
+        return 'TIMESTAMP'
+    if isinstance(column.type, Integer):
+        return 'INTEGER'
+    if isinstance(column.type, (Float, Numeric)):
+        return 'DOUBLE'
+    return 'VARCHAR'
+
+def open_store(consumer):
+    """
+    Kết nối DuckDB của consumer (mở 1 lần mỗi process). Bảng earthquakes khác cột so với model
+    (vd. sau migration) -> tạo lại, lần đồng bộ sau sẽ chép lại toàn bộ.
+    """
+    with stores_lock:
+        if consumer not in stores:
+            os.makedirs(ANALYTICS_DUCKDB_DIR, exist_ok=True)
+            con = duckdb.connect(os.path.join(ANALYTICS_DUCKDB_DIR, f"{consumer}.duckdb"))
+            con.execute("CREATE TABLE IF NOT EXISTS analytics_meta (key VARCHAR PRIMARY KEY, value VARCHAR)")
+            existing = [row[0] for row in con.execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = 'earthquakes' ORDER BY ordinal_position"
+            ).fetchall()]
+            if existing != COLUMNS:
+                columns = ', '.join(f"{column.name} {duckdb_type(column)}" for column in Earthquake.__table__.columns)
+                con.execute("DROP TABLE IF EXISTS earthquakes")
+                con.execute(f"CREATE TABLE earthquakes ({columns})")
+                con.execute("DELETE FROM analytics_meta")
+            con.execute("CREATE TABLE IF NOT EXISTS cluster_assignments "
+                        "(run_id INTEGER, earthquake_id VARCHAR, cluster_label INTEGER)")
+            stores[consumer] = {"con": con, "lock": threading.Lock(), "checked": None}
+        return stores[consumer]
+
+def get_meta(con, key):
+    row = con.execute("SELECT value FROM analytics_meta WHERE key = ?", [key]).fetchone()
+    return row[0] if row else None
+
+def set_meta(con, key, value):
+    con.execute("INSERT OR REPLACE INTO analytics_meta VALUES (?, ?)", [key, str(value)])
+
+def load_rows(con, session, statement):
+    # Chép theo từng chunk để không giữ cả bảng trong RAM: stream_results -> cursor phía server
+    # (PyMySQL SSCursor), chunksize không thì vẫn nhận hết kết quả về client trước
+    loaded = 0
+    with session.bind.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(statement, conn, chunksize=ANALYTICS_SYNC_CHUNK):
+            con.register('chunk', chunk[COLUMNS])
+            con.execute(f"INSERT INTO earthquakes SELECT {', '.join(COLUMNS)} FROM chunk")
+            con.unregister('chunk')
+            loaded += len(chunk)
+    return loaded
+
+def full_sync(con, session):
+    # Đọc cursor/version trước khi chép: thay đổi commit trong lúc chép sẽ được áp lại lần sau
+    cursor = latest_change_id(session)
+    run_id = current_cluster_run(session)
+    started = time.time()
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("DELETE FROM earthquakes")
+        rows = load_rows(con, session, select(Earthquake.__table__))
+        set_meta(con, 'outbox_cursor', cursor)
+        set_meta(con, 'archive_boundary', archive_boundary(session) or '')
+        refresh_labels(con, session, run_id)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    print(f"-> DuckDB: chép toàn bộ {rows} event trong {time.time() - started:.1f}s")
+
+def apply_changes(con, session, cursor):
+    """
+    Áp các thay đổi trong outbox sau cursor: batch có danh sách id -> chép lại các id đó,
+    batch chỉ có số lượng (import) -> chép lại khoảng time của batch, bản ghi reset -> xoá hết.
+    Trả về (cursor mới, True nếu id outbox bị nhảy cóc: batch rollback, hoặc batch id nhỏ hơn
+    chưa commit và có thể bị bỏ qua).
+    """
+    gap = False
+    while True:
+        changes = fetch_changes(session, cursor)
+        if not changes:
+            return cursor, gap
+        ids = set()
+        for change in changes:
+            gap = gap or change.id != cursor + 1
+            if change.source == OUTBOX_RESET_SOURCE:
+                con.execute("DELETE FROM earthquakes")
+                ids.clear()
+                cursor = change.id
+                continue
+            new_ids, updated_ids = change_ids(session, change.id)
+            if new_ids or updated_ids:
+                ids.update(new_ids)
+                ids.update(updated_ids)
+            elif change.span_start is not None:
+                con.execute("DELETE FROM earthquakes WHERE time BETWEEN ? AND ?", [change.span_start, change.span_end])
+                load_rows(con, session, select(Earthquake.__table__).where(
+                    Earthquake.time.between(change.span_start, change.span_end)))
+            cursor = change.id
+
+        ids = list(ids)
+        for start in range(0, len(ids), ID_BATCH):
+            batch = ids[start:start + ID_BATCH]
+            con.execute("DELETE FROM earthquakes WHERE id IN (SELECT UNNEST(?))", [batch])
+            load_rows(con, session, select(Earthquake.__table__).where(Earthquake.id.in_(batch)))
+
+def refresh_labels(con, session, run_id):
+    # Chỉ giữ nhãn của run hiện tại; run đổi -> chép lại toàn bộ nhãn của run mới
+    con.execute("DELETE FROM cluster_assignments")
+    if run_id is not None:
+        statement = select(ClusterAssignment.__table__).where(ClusterAssignment.run_id == run_id)
+        for chunk in pd.read_sql(statement, session.bind, chunksize=ANALYTICS_SYNC_CHUNK):
+            con.register('chunk', chunk)
+            con.execute("INSERT INTO cluster_assignments SELECT run_id, earthquake_id, cluster_label FROM chunk")
+            con.unregister('chunk')
+    set_meta(con, 'cluster_run', run_id or '')
+
+def sync_store(store, session):
+    """
+    Đưa bản sao về trạng thái hiện tại của DB chính theo cursor của outbox. Chép lại toàn bộ khi
+    chưa có bản sao hoặc outbox đã bị dọn qua cursor. So số dòng (lệch -> chép lại toàn bộ) mỗi
+    ANALYTICS_CHECK_INTERVAL giây hoặc khi outbox có id bị nhảy cóc.
+    """
+    con = store["con"]
+    cursor = get_meta(con, 'outbox_cursor')
+    latest = latest_change_id(session)
+    oldest = session.query(func.min(ChangeOutbox.id)).scalar()
+    gap = False
+    if cursor is None or int(cursor) > latest or (oldest is not None and oldest > int(cursor) + 1):
+        full_sync(con, session)
+        store["checked"] = time.monotonic()
+        return
+    run_id = current_cluster_run(session)
+    boundary = archive_boundary(session)
+    run_changed = str(run_id or '') != get_meta(con, 'cluster_run')
+    boundary_changed = str(boundary or '') != (get_meta(con, 'archive_boundary') or '')
+    if int(cursor) < latest or run_changed or boundary_changed:
+        con.execute("BEGIN TRANSACTION")
+        try:
+            cursor, gap = apply_changes(con, session, int(cursor))
+            set_meta(con, 'outbox_cursor', cursor)
+            if run_changed:
+                refresh_labels(con, session, run_id)
+            if boundary is not None:
+                # Tháng đã chuyển sang archive (earthquake_archive) không còn trong bảng chính
+                con.execute("DELETE FROM earthquakes WHERE time < ?", [boundary])
+            set_meta(con, 'archive_boundary', boundary or '')
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+    checked = store["checked"]
+    if not gap and checked is not None and time.monotonic() - checked < ANALYTICS_CHECK_INTERVAL:
+        return
+    store["checked"] = time.monotonic()
+    expected = session.query(func.count(Earthquake.id)).scalar()
+    actual = con.execute("SELECT count(*) FROM earthquakes").fetchone()[0]
+    if actual != expected:
+        print(f"-> DuckDB lệch số dòng ({actual} / {expected}), chép lại toàn bộ")
+        full_sync(con, session)
+
+def duckdb_sql(statement):
+    # Cú pháp DuckDB gần với PostgreSQL: render statement với giá trị tham số viết thẳng vào SQL
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+def read_frame(statement, session, consumer):
+    """
+    Thay cho pd.read_sql(statement, session.bind) với truy vấn chỉ đọc bảng earthquakes
+    (có thể outer join cluster_assignments của run hiện tại).
+    Kết quả cùng cột/kiểu như pd.read_sql (số nguyên có NULL -> float).
+    """
+    if not analytics_enabled():
+        return pd.read_sql(statement, session.bind)
+    try:
+        store = open_store(consumer)
+        with store["lock"]:
+            sync_store(store, session)
+            df = store["con"].execute(duckdb_sql(statement)).df()
+    except duckdb.Error as e:
+        print(f"⚠️ DuckDB lỗi ({e}), đọc trực tiếp từ DB chính")
+        return pd.read_sql(statement, session.bind)
+
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.Int32Dtype):
+            df[column] = df[column].astype('float64' if df[column].hasnans else 'int64')
+        elif df[column].dtype == 'int32':
+            df[column] = df[column].astype('int64')
+    return df
@@ -1,6 +1,8 @@
 from random import random
+import inspect
 from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
 from typing import List, Optional, Union
@@ -8,7 +10,13 @@ from datetime import datetime, timedelta
 import pydantic
 
 # Import từ file database.py 
-from .database import ClusterInfo, SessionLocal, Earthquake, Prediction, AnalysisStat
+from .database import read_session, ClusterRun, ClusterAssignment, ClusterStat, SessionLocal, Earthquake, Prediction, AnalysisStat, rollup_buckets, rollup_totals, clear_rollups, archive_boundary, region_filter, current_cluster_stats, cluster_labels, set_ingest_state, bump_data_version, publish_reset, CLUSTER_RUN_KEY
+from .earthquake_archive import read_archive
+from .analytics_store import read_frame
+from .db_pool import pool_prometheus_text
+from .response_cache import cached_response, clear_cache, cache_prometheus_text
+from .geocell import radius_region, haversine_km
+from .db_async import API_ASYNC_DB, get_async_db
 
 app = FastAPI(title="Earthquake Tracker API", description="API phục vụ dữ liệu động đất USGS")
 
@@ -21,12 +29,51 @@ app.add_middleware(
 )
 
 def get_db():
+    # Đọc: replica nếu có cấu hình (DATABASE_REPLICA_URL), xem database.read_session
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_primary_db():
+    # Endpoint có ghi, hoặc cần đọc ngay kết quả vừa ghi: luôn dùng DB chính
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+def read_route(path, **kwargs):
+    """
+    GET endpoint đọc (tham số db là session đọc). API_ASYNC_DB=1 -> đăng ký bản async sinh từ chính
+    endpoint này (async_endpoint), không viết lại từng endpoint.
+    """
+    def register(endpoint):
+        app.get(path, **kwargs)(async_endpoint(endpoint) if API_ASYNC_DB else endpoint)
+        return endpoint
+    return register
+
+def async_endpoint(endpoint):
+    """
+    Bản async của endpoint đọc: cùng tham số, db là AsyncSession (db_async.get_async_db) và code sync
+    (kể cả cache response) chạy qua AsyncSession.run_sync -> I/O DB qua driver async không chặn
+    event loop. Phần không phải I/O DB (vd. đọc file archive) vẫn chạy trên event loop.
+    """
+    signature = inspect.signature(endpoint)
+
+    async def wrapper(**params):
+        db = params.pop('db')
+        return await db.run_sync(lambda session: endpoint(**params, db=session))
+
+    wrapper.__name__ = f"{endpoint.__name__}_async"
+    wrapper.__doc__ = endpoint.__doc__
+    wrapper.__signature__ = signature.replace(parameters=[
+        param.replace(default=Depends(get_async_db), annotation=inspect.Parameter.empty) if param.name == 'db' else param
+        for param in signature.parameters.values()
+    ])
+    return wrapper
+
 class EarthquakeOut(pydantic.BaseModel):
     id: str
     place: Optional[str]
@@ -73,12 +120,21 @@ class CorrelationMatrix(pydantic.BaseModel):
 def read_root():
     return {"message": "Welcome to Earthquake Tracker API. Go to /docs for Swagger UI"}
 
-@app.get("/api/stats", response_model=StatsOut)
-def get_stats_summary(db: Session = Depends(get_db)):
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Số liệu connection pool (Prometheus): thời gian chờ checkout, số connection đang dùng, overflow
+    # + số lần hit/miss của cache response
+    return pool_prometheus_text() + cache_prometheus_text()
+
+@read_route("/api/stats", response_model=StatsOut)
+@cached_response
+def get_api_stats(db: Session = Depends(get_db)):
    
     try:
 
-        total_count = db.query(func.count(Earthquake.id)).scalar() or 0
+        # Đọc từ bảng rollup theo ngày (ingestion cập nhật) thay vì quét earthquakes
+        totals = rollup_totals(db)
+        total_count = totals['event_count'] or 0
         
         if total_count == 0:
             return StatsOut(
@@ -90,12 +146,13 @@ def get_stats_summary(db: Session = Depends(get_db)):
                 min_magnitude=0.0
             )
         
-        avg_mag = db.query(func.avg(Earthquake.magnitude)).scalar() or 0.0
-        avg_depth = db.query(func.avg(Earthquake.depth)).scalar() or 0.0
-        max_mag = db.query(func.max(Earthquake.magnitude)).scalar() or 0.0
-        min_mag = db.query(func.min(Earthquake.magnitude)).scalar() or 0.0
+        avg_mag = totals['mag_sum'] / totals['mag_count'] if totals['mag_count'] else 0.0
+        avg_depth = totals['depth_sum'] / totals['depth_count'] if totals['depth_count'] else 0.0
+        max_mag = totals['mag_max'] or 0.0
+        min_mag = totals['mag_min'] or 0.0
         
-        risk_zones = db.query(func.count(Earthquake.id)).filter(Earthquake.magnitude > 5.0).scalar() or 0
+        # magnitude > 5.0
+        risk_zones = (totals['mag_5_6'] or 0) + (totals['mag_6_7'] or 0) + (totals['mag_gt_7'] or 0)
         
         return StatsOut(
             total_earthquakes=total_count,
@@ -113,7 +170,7 @@ def get_stats_summary(db: Session = Depends(get_db)):
 def get_analysis_data(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_primary_db)
 ):
 
     try:
@@ -179,6 +236,7 @@ def get_analysis_data(
             )
             
             db.add(new_stat)
+            bump_data_version(db)
             db.commit()
             print("Đã lưu kết quả analysis vào database.")
         
@@ -194,7 +252,7 @@ def get_analysis_data(
         raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
 
 @app.get("/api/clustering")
-def trigger_clustering(db: Session = Depends(get_db)):
+def trigger_clustering(db: Session = Depends(get_primary_db)):
 
     try:
 
@@ -212,17 +270,10 @@ def trigger_clustering(db: Session = Depends(get_db)):
             
             if run_clustering:
   
-                try:
-                    db.query(ClusterInfo).delete()
-                    db.commit()
-                    print("Đã xóa dữ liệu clustering cũ.")
-                except Exception as e:
-                    db.rollback()
-                    raise HTTPException(status_code=500, detail=f"Lỗi khi xóa dữ liệu cũ: {str(e)}")
-
+                # Run mới chỉ thay run hiện tại khi đã ghi xong, không cần xoá kết quả cũ trước
                 run_clustering()
                 
-                clusters = db.query(ClusterInfo).order_by(ClusterInfo.updated_at.desc()).all()
+                clusters = current_cluster_stats(db)
                 
                 cluster_data = []
                 for cluster in clusters:
@@ -252,14 +303,12 @@ def trigger_clustering(db: Session = Depends(get_db)):
 def get_clustering_info(db: Session = Depends(get_db)):
    
     try:
-        clusters = db.query(ClusterInfo).order_by(ClusterInfo.updated_at.desc()).all()
+        clusters = current_cluster_stats(db)
         
         cluster_data = []
         for cluster in clusters:
             
-            earthquake_count = db.query(Earthquake).filter(
-                Earthquake.cluster_label == cluster.cluster_id
-            ).count()
+            earthquake_count = cluster.earthquake_count or 0
             
             cluster_data.append({
                 "cluster_id": cluster.cluster_id,
@@ -280,7 +329,7 @@ def get_clustering_info(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error fetching clustering info: {str(e)}")
 
 @app.post("/api/prediction/run")
-def trigger_prediction(db: Session = Depends(get_db)):
+def trigger_prediction(db: Session = Depends(get_primary_db)):
   
     try:
    
@@ -343,7 +392,7 @@ def get_prediction_status(db: Session = Depends(get_db)):
             desc(AnalysisStat.timestamp)
         ).first()
  
-        cluster_count = db.query(ClusterInfo).count()
+        cluster_count = len(current_cluster_stats(db))
         
         status = {
             "prediction_available": latest_prediction is not None,
@@ -365,15 +414,29 @@ def get_prediction_status(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error checking prediction status: {str(e)}")
 
 
-@app.get("/earthquakes", response_model=List[EarthquakeOut])
-def get_earthquakes(
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    min_magnitude: Optional[float] = 0.0,
-    limit: int = 1000,
-    db: Session = Depends(get_db)
-):
-
+def parse_region(min_lat, max_lat, min_lon, max_lon, lat, lon, radius_km):
+    """
+    Vùng lọc của /earthquakes: hình chữ nhật (min_lat..max_lon, min_lon > max_lon = vắt qua
+    kinh tuyến 180) hoặc đường tròn (lat, lon, radius_km). Trả về (region, circle) hoặc (None, None)
+    """
+    box = (min_lat, max_lat, min_lon, max_lon)
+    circle = (lat, lon, radius_km)
+    if any(value is not None for value in circle):
+        if any(value is None for value in circle):
+            raise HTTPException(status_code=400, detail="Cần đủ lat, lon, radius_km")
+        return radius_region(lat, lon, radius_km), circle
+    if any(value is not None for value in box):
+        if any(value is None for value in box):
+            raise HTTPException(status_code=400, detail="Cần đủ min_lat, max_lat, min_lon, max_lon")
+        if min_lat > max_lat:
+            raise HTTPException(status_code=400, detail="min_lat phải <= max_lat")
+        return (min_lat, min_lon, max_lat, max_lon), None
+    return None, None
+
+def query_earthquakes(db, start_date, end_date, min_magnitude, limit, region, circle):
+    """
+    Event trong earthquakes theo bộ lọc của /earthquakes, mới nhất trước, kèm nhãn cụm của run hiện tại
+    """
     query = db.query(Earthquake)
     
     if start_date:
@@ -382,13 +445,78 @@ def get_earthquakes(
         query = query.filter(Earthquake.time <= end_date)
     if min_magnitude > 0:
         query = query.filter(Earthquake.magnitude >= min_magnitude)
-
-    results = query.order_by(desc(Earthquake.time)).limit(limit).all()
+    if region:
+        # Lọc theo ô geohash (dùng index) rồi so toạ độ chính xác
+        query = query.filter(region_filter(region))
+
+    query = query.order_by(desc(Earthquake.time))
+    if circle:
+        # Hình chữ nhật bao ngoài đường tròn: đọc dần theo time, giữ event trong bán kính tới khi đủ limit
+        lat, lon, radius_km = circle
+        results = []
+        for eq in query.yield_per(1000):
+            if haversine_km(lat, lon, eq.latitude, eq.longitude) <= radius_km:
+                results.append(eq)
+                if len(results) >= limit:
+                    break
+    else:
+        results = query.limit(limit).all()
+
+    # Nhãn cụm theo run phân cụm hiện tại (cluster_assignments)
+    labels = cluster_labels(db, [eq.id for eq in results])
+    columns = list(EarthquakeOut.model_fields)
+    return [dict({column: getattr(eq, column) for column in columns}, cluster_label=labels.get(eq.id))
+            for eq in results]
+
+def needs_archive(results, limit, start_date, boundary):
+    # Chưa đủ limit và khoảng thời gian đi vào các tháng đã archive
+    return len(results) < limit and boundary and (start_date is None or start_date < boundary)
+
+def read_archived_earthquakes(start_date, end_date, min_magnitude, limit, region, circle, hot_ids):
+    """
+    Event đã archive theo bộ lọc của /earthquakes (chỉ đọc file), bỏ các id đã có trong hot_ids
+    """
+    columns = list(EarthquakeOut.model_fields)
+    archived = read_archive(start_date, end_date, columns, min_magnitude, limit=limit, region=region)
+    if circle and not archived.empty:
+        lat, lon, radius_km = circle
+        archived = archived[haversine_km(lat, lon, archived['latitude'], archived['longitude']) <= radius_km]
+    archived = archived[~archived['id'].isin(hot_ids)].sort_values('time', ascending=False)
+    return archived.head(limit)
+
+def archived_records(archived, labels):
+    archived = archived.assign(cluster_label=archived['id'].map(labels)).astype(object)
+    return archived.where(archived.notna(), None).to_dict('records')
+
+@read_route("/earthquakes", response_model=List[EarthquakeOut])
+def get_earthquakes(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_magnitude: Optional[float] = 0.0,
+    limit: int = 1000,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0, le=20000),
+    db: Session = Depends(get_db)
+):
+    region, circle = parse_region(min_lat, max_lat, min_lon, max_lon, lat, lon, radius_km)
+    results = query_earthquakes(db, start_date, end_date, min_magnitude, limit, region, circle)
+    
+    # Đọc thêm từ file archive khi cần
+    if needs_archive(results, limit, start_date, archive_boundary(db)):
+        archived = read_archived_earthquakes(start_date, end_date, min_magnitude, limit - len(results),
+                                             region, circle, {eq['id'] for eq in results})
+        results = results + archived_records(archived, cluster_labels(db, archived['id']))
     return results
 
-@app.get("/api/time-series")
+@read_route("/api/time-series")
+@cached_response
 def get_time_series(
-    period: str = Query("day", regex="^(day|week|month)$"),
+    period: str = Query("day", pattern="^(day|week|month)$"),
     days_back: int = Query(30, ge=1, le=365),
     custom_start: Optional[str] = Query(None, description="Custom start date (YYYY-MM-DD)"),
     custom_end: Optional[str] = Query(None, description="Custom end date (YYYY-MM-DD)"),
@@ -407,57 +535,57 @@ def get_time_series(
             start_date = end_date - timedelta(days=days_back)
             print(f"API: Sử dụng days_back={days_back}")
 
-        query = db.query(Earthquake).filter(
-            Earthquake.time >= start_date,
-            Earthquake.time <= end_date,
-            Earthquake.time.isnot(None)
-        ).order_by(Earthquake.time)
+        # Tổng hợp theo ngày từ bảng rollup (2 ngày lẻ ở đầu/cuối khoảng tính từ dữ liệu thô)
+        days = rollup_buckets(db, start_date, end_date, 'day')
         
-        earthquakes = query.all()
-        
-        if not earthquakes:
+        if not days:
             return []
         
         grouped_data = {}
         
-        for eq in earthquakes:
+        for day, rollup in days.items():
             if period == "day":
-                key = eq.time.strftime("%Y-%m-%d")
+                key = day.strftime("%Y-%m-%d")
                
-                date_obj = eq.time.replace(hour=0, minute=0, second=0, microsecond=0)
+                date_obj = day
             elif period == "week":
               
-                year, week, _ = eq.time.isocalendar()
+                year, week, _ = day.isocalendar()
                 key = f"{year}-W{week:02d}"
               
-                date_obj = eq.time - timedelta(days=eq.time.weekday())
-                date_obj = date_obj.replace(hour=0, minute=0, second=0, microsecond=0)
+                date_obj = day - timedelta(days=day.weekday())
             else: 
-                key = eq.time.strftime("%Y-%m")
+                key = day.strftime("%Y-%m")
 
-                date_obj = eq.time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                date_obj = day.replace(day=1)
             
             if key not in grouped_data:
                 grouped_data[key] = {
                     'count': 0,
-                    'magnitudes': [],
-                    'depths': [],
+                    'mag_count': 0,
+                    'mag_sum': 0.0,
+                    'mag_max': None,
+                    'depth_count': 0,
+                    'depth_sum': 0.0,
                     'date_obj': date_obj
                 }
             
-            grouped_data[key]['count'] += 1
-            if eq.magnitude:
-                grouped_data[key]['magnitudes'].append(eq.magnitude)
-            if eq.depth:
-                grouped_data[key]['depths'].append(eq.depth)
+            data = grouped_data[key]
+            data['count'] += rollup['event_count'] or 0
+            data['mag_count'] += rollup['mag_count'] or 0
+            data['mag_sum'] += rollup['mag_sum'] or 0.0
+            data['depth_count'] += rollup['depth_count'] or 0
+            data['depth_sum'] += rollup['depth_sum'] or 0.0
+            if rollup['mag_max'] is not None and (data['mag_max'] is None or rollup['mag_max'] > data['mag_max']):
+                data['mag_max'] = rollup['mag_max']
         
         result = []
         for date_key in sorted(grouped_data.keys()):
             data = grouped_data[date_key]
             
-            avg_mag = sum(data['magnitudes']) / len(data['magnitudes']) if data['magnitudes'] else 0
-            max_mag = max(data['magnitudes']) if data['magnitudes'] else 0
-            avg_depth = sum(data['depths']) / len(data['depths']) if data['depths'] else 0
+            avg_mag = data['mag_sum'] / data['mag_count'] if data['mag_count'] else 0
+            max_mag = data['mag_max'] or 0
+            avg_depth = data['depth_sum'] / data['depth_count'] if data['depth_count'] else 0
         
             display_date = data['date_obj'].strftime('%d/%m/%Y')
             result.append({
@@ -479,6 +607,7 @@ def get_time_series(
 
 
 @app.get("/api/correlation")
+@cached_response
 def get_correlation_matrix(db: Session = Depends(get_db)):
  
     try:
@@ -495,7 +624,8 @@ def get_correlation_matrix(db: Session = Depends(get_db)):
             Earthquake.longitude.isnot(None)
         )
         
-        data = query.all()
+        # Quét toàn bảng: ANALYTICS_ENGINE=duckdb thì đọc từ bản sao dạng cột
+        data = read_frame(query.statement, db, "api")
         
         if len(data) < 10: 
             return {
@@ -510,13 +640,7 @@ def get_correlation_matrix(db: Session = Depends(get_db)):
         
         import numpy as np
         
-        magnitudes = [float(d.magnitude) for d in data]
-        depths = [float(d.depth) for d in data]
-        latitudes = [float(d.latitude) for d in data]
-        longitudes = [float(d.longitude) for d in data]
-        
- 
-        data_matrix = np.array([magnitudes, depths, latitudes, longitudes])
+        data_matrix = data[['magnitude', 'depth', 'latitude', 'longitude']].to_numpy(dtype=float).T
         corr_matrix = np.corrcoef(data_matrix)
         
         
@@ -626,10 +750,13 @@ def get_stats_summary(db: Session = Depends(get_db)):
         }
     
 
-    last_24h = datetime.utcnow() - timedelta(hours=24)
+    now = datetime.utcnow()
+    last_24h = now - timedelta(hours=24)
     
-    count = db.query(Earthquake).filter(Earthquake.time >= last_24h).count()
-    max_mag = db.query(func.max(Earthquake.magnitude)).filter(Earthquake.time >= last_24h).scalar()
+    # 24 giờ gần nhất từ rollup theo giờ (giờ lẻ ở 2 đầu tính từ dữ liệu thô)
+    hours = rollup_buckets(db, last_24h, now, 'hour').values()
+    count = sum(hour['event_count'] or 0 for hour in hours)
+    max_mag = max((hour['mag_max'] for hour in hours if hour['mag_max'] is not None), default=None)
     
     return {
         "total_events": count,
@@ -638,7 +765,8 @@ def get_stats_summary(db: Session = Depends(get_db)):
     }
 
 
-@app.get("/predictions/latest")
+@read_route("/predictions/latest")
+@cached_response
 def get_latest_prediction(db: Session = Depends(get_db)):
 
     try:
@@ -653,7 +781,7 @@ def get_latest_prediction(db: Session = Depends(get_db)):
 
         latest_analysis = db.query(AnalysisStat).order_by(desc(AnalysisStat.timestamp)).first()
                 
-        cluster_info = db.query(ClusterInfo).all()
+        cluster_info = current_cluster_stats(db)
         
      
         predicted_magnitude = 4.0  
@@ -808,7 +936,7 @@ def get_latest_prediction(db: Session = Depends(get_db)):
 
 
 @app.delete("/api/delete/all_data", status_code=200)
-def delete_all_data(db: Session = Depends(get_db)):
+def delete_all_data(db: Session = Depends(get_primary_db)):
  
     try:
         deleted_counts = {}
@@ -817,11 +945,19 @@ def delete_all_data(db: Session = Depends(get_db)):
         
         deleted_counts["analysis_stats"] = db.query(AnalysisStat).delete()
     
-        deleted_counts["cluster_info"] = db.query(ClusterInfo).delete()
+        deleted_counts["cluster_assignments"] = db.query(ClusterAssignment).delete()
+        deleted_counts["cluster_stats"] = db.query(ClusterStat).delete()
+        deleted_counts["cluster_runs"] = db.query(ClusterRun).delete()
+        set_ingest_state(db, CLUSTER_RUN_KEY, '')
         
         deleted_counts["earthquakes"] = db.query(Earthquake).delete()
         
+        clear_rollups(db)
+        # Bản sao DuckDB (analytics_store) đọc outbox: xoá theo
+        publish_reset(db)
+        
         db.commit()
+        clear_cache()
         
         return {
             "status": "success",
@@ -0,0 +1,83 @@
+import os
+import asyncio
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import NoSuchModuleError
+from .database import (DATABASE_URL, DATABASE_REPLICA_URL, REPLICA_MAX_LAG, SQLITE_BUSY_TIMEOUT, replica_fresh,
+                       set_sqlite_pragmas)
+from .db_pool import engine_options, instrument_engine
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+except ImportError:
+    # sqlalchemy.ext.asyncio cần greenlet
+    create_async_engine = None
+
+# Engine/session async cho các endpoint đọc của API (API_ASYNC_DB=1): query chạy qua driver async
+# (aiomysql / aiosqlite / asyncpg) nên 1 worker phục vụ nhiều request đồng thời, không bị giới hạn
+# bởi threadpool. Code truy vấn dùng chung với bản sync qua AsyncSession.run_sync.
+# Thiếu greenlet hoặc driver async -> API chạy các endpoint sync như cũ.
+
+ASYNC_DRIVERS = {'mysql': 'aiomysql', 'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+def async_url(url):
+    """
+    URL cùng DB với driver async, vd. mysql+pymysql://... -> mysql+aiomysql://...
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Không có driver async cho {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+def make_async_engine(url, name='async'):
+    url = async_url(url)
+    if url.startswith('sqlite'):
+        new_engine = create_async_engine(url, echo=False, connect_args={"timeout": SQLITE_BUSY_TIMEOUT},
+                                         **engine_options(url, async_engine=True))
+        event.listen(new_engine.sync_engine, "connect", set_sqlite_pragmas)
+    else:
+        new_engine = create_async_engine(url, echo=False, **engine_options(url, async_engine=True))
+    # Số liệu pool riêng của engine async (db_pool.pool_registry), statement timeout theo DB_ROLE
+    instrument_engine(new_engine.sync_engine, name=name)
+    return new_engine
+
+def async_db_enabled():
+    if os.getenv("API_ASYNC_DB", "0").lower() not in ('1', 'true', 'yes'):
+        return False
+    if create_async_engine is None:
+        print("⚠️ API_ASYNC_DB=1 nhưng thiếu greenlet (pip install sqlalchemy[asyncio]), dùng endpoint sync")
+        return False
+    # Driver async của DB chính và replica phải import được, nếu không API không khởi động nổi
+    try:
+        for url in filter(None, (DATABASE_URL, DATABASE_REPLICA_URL)):
+            make_url(async_url(url)).get_dialect().import_dbapi()
+    except (ImportError, NoSuchModuleError, ValueError) as e:
+        print(f"⚠️ API_ASYNC_DB=1 nhưng không dùng được driver async ({e}), dùng endpoint sync")
+        return False
+    return True
+
+API_ASYNC_DB = async_db_enabled()
+if API_ASYNC_DB:
+    async_engine = make_async_engine(DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    async_replica_engine = make_async_engine(DATABASE_REPLICA_URL, 'async_replica') if DATABASE_REPLICA_URL else async_engine
+    AsyncReadSessionLocal = async_sessionmaker(async_replica_engine, autoflush=False, expire_on_commit=False)
+
+async def async_read_session():
+    """
+    Bản async của database.read_session: replica nếu có và không trễ quá REPLICA_MAX_LAG
+    """
+    if async_replica_engine is async_engine:
+        return AsyncSessionLocal()
+    # Đo độ trễ dùng engine sync (có cache), chạy ngoài event loop
+    if REPLICA_MAX_LAG and not await asyncio.to_thread(replica_fresh):
+        return AsyncSessionLocal()
+    return AsyncReadSessionLocal()
+
+async def get_async_db():
+    db = await async_read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
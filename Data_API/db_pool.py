@@ -0,0 +1,244 @@
+import os
+import time
+import threading
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# Cấu hình connection pool theo vai trò của process (DB_ROLE) + số liệu pool dạng Prometheus.
+# - api: nhiều request đồng thời -> pool lớn, chờ ngắn. Không giới hạn thời gian query mặc định:
+#   /api/clustering (run_clustering) và /api/correlation quét cả khoảng thời gian, chạy lâu hơn
+#   vài chục giây là bình thường; đặt DB_STATEMENT_TIMEOUT nếu API không phục vụ các route đó
+# - ingestion: vài thread ghi (pipeline, daemon, metrics)
+# - batch: BE Services, chủ yếu 1 lần đọc lớn -> pool nhỏ, không giới hạn thời gian query
+# Từng giá trị ghi đè được bằng DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+# DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT (giây, 0 = không giới hạn; MySQL chỉ áp dụng cho SELECT).
+
+POOL_PROFILES = {
+    'api':       {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10, 'pool_recycle': 1800, 'pool_pre_ping': True, 'statement_timeout': 0},
+    'ingestion': {'pool_size': 4,  'max_overflow': 4,  'pool_timeout': 30, 'pool_recycle': 3600, 'pool_pre_ping': True, 'statement_timeout': 0},
+    'batch':     {'pool_size': 2,  'max_overflow': 2,  'pool_timeout': 60, 'pool_recycle': 3600, 'pool_pre_ping': True, 'statement_timeout': 0},
+    'default':   {'pool_size': 5,  'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 3600, 'pool_pre_ping': True, 'statement_timeout': 0},
+}
+POOL_ENV = {
+    'pool_size': ('DB_POOL_SIZE', int),
+    'max_overflow': ('DB_MAX_OVERFLOW', int),
+    'pool_timeout': ('DB_POOL_TIMEOUT', float),
+    'pool_recycle': ('DB_POOL_RECYCLE', int),
+    'pool_pre_ping': ('DB_POOL_PRE_PING', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'statement_timeout': ('DB_STATEMENT_TIMEOUT', float),
+}
+DB_ROLE = os.getenv("DB_ROLE", "default")
+# Checkout chờ lâu hơn số giây này thì in cảnh báo kèm trạng thái pool (0 = tắt)
+DB_POOL_SLOW_CHECKOUT = float(os.getenv("DB_POOL_SLOW_CHECKOUT", "0.5"))
+
+METRIC_PREFIX = "earthquake_db_pool"
+WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10]
+
+def new_pool_stats():
+    return {
+        "checkouts": 0,
+        "wait_seconds": 0.0,
+        "wait_max": 0.0,
+        "wait_buckets": [0] * len(WAIT_BUCKETS),
+        "timeouts": 0,
+        "in_use_max": 0,
+        "connects": 0,
+        "overflow_connects": 0,
+        "invalidations": 0,
+    }
+
+# Số liệu riêng cho từng engine đã instrument (DB chính, replica, async), theo thứ tự đăng ký:
+# (name, role) -> {"engine", "role", "name", "stats"}
+pool_registry = {}
+stats_lock = threading.Lock()
+
+def pool_settings(role=None):
+    """
+    Cấu hình pool của role (mặc định DB_ROLE), đã áp các biến môi trường ghi đè
+    """
+    role = role or DB_ROLE
+    if role not in POOL_PROFILES:
+        raise ValueError(f"DB_ROLE không hợp lệ: {role} (chọn {', '.join(POOL_PROFILES)})")
+    settings = dict(POOL_PROFILES[role])
+    for key, (name, parse) in POOL_ENV.items():
+        value = os.getenv(name)
+        if value:
+            settings[key] = parse(value)
+    return settings
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool có đo thời gian chờ lấy connection (gồm cả lúc mở connection mới).
+    # stats: dict số liệu của engine (instrument_engine gán), None = không đo
+    stats = None
+
+    def connect(self):
+        # Đo ở connect (không đệ quy như _do_get): đúng cho cả thread lẫn coroutine dùng chung pool
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                with stats_lock:
+                    self.stats["timeouts"] += 1
+            raise
+        finally:
+            if self.stats is not None:
+                record_wait(self, time.perf_counter() - started)
+
+    def recreate(self):
+        # engine.dispose() thay pool mới: giữ số liệu của engine
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    # Cùng số liệu cho engine async (hàng đợi asyncio thay cho threading)
+    pass
+
+def record_wait(pool, waited):
+    stats = pool.stats
+    with stats_lock:
+        stats["checkouts"] += 1
+        stats["wait_seconds"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if waited <= bound:
+                stats["wait_buckets"][i] += 1
+                break
+    if DB_POOL_SLOW_CHECKOUT and waited >= DB_POOL_SLOW_CHECKOUT:
+        print(f"⚠️ DB pool [{DB_ROLE}]: chờ connection {waited:.2f}s ({pool.status()})")
+
+def engine_options(url, role=None, async_engine=False):
+    """
+    Tham số create_engine (create_async_engine nếu async_engine) cho pool của role.
+    SQLite in-memory giữ pool mặc định (1 connection/thread).
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite' and (parsed.database in (None, '', ':memory:') or 'mode=memory' in url):
+        return {}
+    settings = pool_settings(role)
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if async_engine else InstrumentedQueuePool,
+        "pool_size": settings['pool_size'],
+        "max_overflow": settings['max_overflow'],
+        "pool_timeout": settings['pool_timeout'],
+        "pool_recycle": settings['pool_recycle'],
+        "pool_pre_ping": settings['pool_pre_ping'],
+    }
+
+def instrument_engine(engine, role=None, name='primary'):
+    """
+    Gắn event của pool: đếm connection mới/invalidate, số connection dùng đồng thời cao nhất,
+    đặt statement timeout cho mỗi connection mới. Số liệu giữ riêng theo (name, role):
+    name phân biệt các engine của cùng process (primary, replica, async, ...)
+    """
+    role = role or DB_ROLE
+    statement_timeout = pool_settings(role)['statement_timeout']
+    dialect = engine.dialect.name
+    stats = new_pool_stats()
+    with stats_lock:
+        pool_registry[(name, role)] = {"engine": engine, "role": role, "name": name, "stats": stats}
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # Connection mới được tính vào checkedout() ngay khi mở: vượt size() -> là connection overflow
+        pool = engine.pool
+        overflow = isinstance(pool, QueuePool) and pool.checkedout() > pool.size()
+        with stats_lock:
+            stats["connects"] += 1
+            if overflow:
+                stats["overflow_connects"] += 1
+        if statement_timeout and dialect in ('mysql', 'postgresql'):
+            cursor = dbapi_connection.cursor()
+            if dialect == 'mysql':
+                cursor.execute(f"SET SESSION max_execution_time = {int(statement_timeout * 1000)}")
+            else:
+                cursor.execute(f"SET statement_timeout = {int(statement_timeout * 1000)}")
+            cursor.close()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            with stats_lock:
+                stats["in_use_max"] = max(stats["in_use_max"], pool.checkedout())
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with stats_lock:
+            stats["invalidations"] += 1
+
+def pool_status(engine, role=None):
+    """
+    Trạng thái + số liệu của engine đã instrument (đăng ký nhiều role thì lấy role, mặc định DB_ROLE)
+    """
+    role = role or DB_ROLE
+    with stats_lock:
+        entries = [entry for entry in pool_registry.values() if entry["engine"] is engine]
+        entry = next((entry for entry in entries if entry["role"] == role), entries[0] if entries else None)
+        stats = entry["stats"] if entry else new_pool_stats()
+        status = {key: (list(value) if isinstance(value, list) else value) for key, value in stats.items()}
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "max_overflow": pool_settings(entry["role"] if entry else role)['max_overflow'],
+        })
+    return status
+
+def pool_prometheus_text():
+    """
+    Số liệu pool của mọi engine đã instrument trong process, label role + engine.
+    Engine dùng chung (vd. replica_engine là engine khi không có replica) chỉ xuất 1 lần.
+    """
+    pools = []
+    seen = set()
+    with stats_lock:
+        entries = list(pool_registry.values())
+    for entry in entries:
+        if id(entry["engine"]) in seen:
+            continue
+        seen.add(id(entry["engine"]))
+        labels = f'role="{entry["role"]}",engine="{entry["name"]}"'
+        pools.append((labels, pool_status(entry["engine"], entry["role"])))
+
+    lines = []
+
+    def metric(name, kind, help_text, key):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for labels, status in pools:
+            if key in status:
+                lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {float(status[key])!r}")
+
+    if any("size" in status for _, status in pools):
+        metric("size", "gauge", "Số connection cố định của pool.", "size")
+        metric("in_use", "gauge", "Số connection đang được dùng.", "in_use")
+        metric("idle", "gauge", "Số connection rảnh trong pool.", "idle")
+        metric("overflow", "gauge", "Số connection overflow đang mở.", "overflow")
+        metric("in_use_max", "gauge", "Số connection dùng đồng thời cao nhất từ lúc khởi động.", "in_use_max")
+    metric("connects_total", "counter", "Số connection DB đã mở.", "connects")
+    metric("overflow_connects_total", "counter", "Số connection mở thêm ngoài pool_size.", "overflow_connects")
+    metric("checkout_timeouts_total", "counter", "Số lần hết pool_timeout khi chờ connection.", "timeouts")
+    metric("invalidations_total", "counter", "Số connection bị huỷ (lỗi, pre-ping thất bại).", "invalidations")
+    metric("checkout_wait_max_seconds", "gauge", "Thời gian chờ connection lâu nhất từ lúc khởi động.", "wait_max")
+
+    # Histogram thời gian chờ checkout
+    name = f"{METRIC_PREFIX}_checkout_wait_seconds"
+    lines.append(f"# HELP {name} Thời gian chờ lấy connection từ pool.")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, status in pools:
+        cumulative = 0
+        for bound, count in zip(WAIT_BUCKETS, status["wait_buckets"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {status["checkouts"]}')
+        lines.append(f"{name}_sum{{{labels}}} {status['wait_seconds']!r}")
+        lines.append(f"{name}_count{{{labels}}} {status['checkouts']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,225 @@
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import func, or_
+from .database import (engine, SessionLocal, Earthquake, ArchivedMonth, set_ingest_state, archive_boundary,
+                       bump_data_version, ARCHIVE_BOUNDARY_KEY, month_start, add_months, partition_name,
+                       earthquake_partitions, ensure_partitions)
+from .geocell import region_mask
+
+# Retention cho bảng earthquakes: các tháng cũ hơn EARTHQUAKE_RETENTION_MONTHS được ghi ra file nén
+# (Parquet nếu có pyarrow, ngược lại CSV gzip) rồi xoá khỏi bảng (MySQL: DROP PARTITION, tức thì).
+# Đọc dữ liệu: read_archive / include_archived bổ sung phần đã archive khi khoảng thời gian cần tới.
+
+# Số tháng giữ trong bảng earthquakes (0 = không archive)
+EARTHQUAKE_RETENTION_MONTHS = int(os.getenv("EARTHQUAKE_RETENTION_MONTHS", "0"))
+EARTHQUAKE_ARCHIVE_DIR = os.getenv(
+    "EARTHQUAKE_ARCHIVE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'earthquake_archive'))
+)
+ARCHIVE_DELETE_BATCH = 5000
+ARCHIVE_COLUMNS = [column.name for column in Earthquake.__table__.columns]
+DATETIME_COLUMNS = ['time', 'updated', 'created_at']
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def archive_file(month):
+    extension = 'parquet' if parquet_available() else 'csv.gz'
+    return os.path.join(EARTHQUAKE_ARCHIVE_DIR, f"{month:%Y}", f"earthquakes_{month:%Y-%m}.{extension}")
+
+def read_archive_file(path, columns=None):
+    # File archive cũ (trước khi earthquakes có thêm cột, vd. geohash) -> cột thiếu là NaN
+    wanted = columns or ARCHIVE_COLUMNS
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        available = set(pq.read_schema(path).names)
+        df = pd.read_parquet(path, columns=[col for col in wanted if col in available])
+        return df.reindex(columns=wanted)
+    df = pd.read_csv(path, usecols=lambda col: col in wanted, dtype={'id': str})
+    for col in DATETIME_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+    return df.reindex(columns=wanted)
+
+def write_archive_file(df, path):
+    # Ghi file tạm rồi rename: file archive không bao giờ ở trạng thái ghi dở
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        df.to_parquet(tmp_path, index=False, compression='zstd')
+    else:
+        df.to_csv(tmp_path, index=False, compression='gzip')
+    os.replace(tmp_path, path)
+
+def month_snapshot(session, month):
+    # (số dòng, updated lớn nhất) của 1 tháng trong earthquakes
+    month_end = add_months(month, 1)
+    return session.query(func.count(Earthquake.id), func.max(Earthquake.updated)).filter(
+        Earthquake.time >= month, Earthquake.time < month_end).one()
+
+def delete_archived_rows(session, month, hot):
+    """
+    Xoá các event đã ghi vào archive (hot: các dòng đọc ra lúc archive) khỏi earthquakes.
+    MySQL có partition riêng cho tháng -> DROP PARTITION, nhưng chỉ khi tháng không đổi từ lúc đọc
+    (cùng số dòng, cùng max(updated)); ngược lại DELETE theo id từng batch: event ghi mới hoặc
+    cập nhật vào tháng đó trong lúc archive vẫn được giữ, lần archive sau sẽ gộp vào file
+    """
+    ids = hot['id'].tolist()
+    read_updated = hot['updated'].max() if not hot.empty else None
+    read_updated = None if pd.isna(read_updated) else pd.Timestamp(read_updated).to_pydatetime()
+
+    connection = session.connection()
+    if partition_name(month) in earthquake_partitions(connection):
+        if tuple(month_snapshot(session, month)) == (len(ids), read_updated):
+            connection.exec_driver_sql(f"ALTER TABLE earthquakes DROP PARTITION {partition_name(month)}")
+            return
+        print(f"⚠️ Tháng {month:%Y-%m} có ghi mới trong lúc archive: DELETE theo id thay vì DROP PARTITION")
+    month_end = add_months(month, 1)
+    for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+        query = session.query(Earthquake).filter(
+            Earthquake.id.in_(ids[start:start + ARCHIVE_DELETE_BATCH]),
+            Earthquake.time >= month, Earthquake.time < month_end
+        )
+        if read_updated is not None:
+            query = query.filter(or_(Earthquake.updated.is_(None), Earthquake.updated <= read_updated))
+        query.delete(synchronize_session=False)
+        session.commit()
+
+def archive_month(session, month):
+    """
+    Chuyển 1 tháng sang archive. Tháng đã archive trước đó (có event cập nhật muộn ghi lại vào
+    earthquakes) được gộp với file cũ, giữ bản updated mới nhất của mỗi event. Trả về số dòng lấy ra.
+    """
+    month_end = add_months(month, 1)
+    query = session.query(Earthquake).filter(Earthquake.time >= month, Earthquake.time < month_end)
+    hot = pd.read_sql(query.statement, session.bind)
+
+    record = session.get(ArchivedMonth, month.date())
+    if not hot.empty:
+        frames = [hot]
+        if record is not None and os.path.exists(record.path):
+            frames.insert(0, read_archive_file(record.path))
+        # Sort ổn định: cùng updated thì bản trong bảng (đứng sau) được giữ
+        df = pd.concat(frames, ignore_index=True)
+        df = df.sort_values('updated', na_position='first', kind='stable').drop_duplicates('id', keep='last')
+        df = df.sort_values('time')[ARCHIVE_COLUMNS]
+
+        path = record.path if record is not None else archive_file(month)
+        write_archive_file(df, path)
+        session.merge(ArchivedMonth(
+            month=month.date(), path=path, row_count=len(df),
+            min_time=df['time'].min().to_pydatetime(), max_time=df['time'].max().to_pydatetime(),
+            archived_at=datetime.utcnow()
+        ))
+        session.commit()
+        print(f"-> Archive {month:%Y-%m}: {len(hot)} event -> {path} (tổng {len(df)})")
+
+    # Chỉ xoá sau khi file + manifest đã commit: dừng giữa chừng thì chạy lại vẫn an toàn
+    delete_archived_rows(session, month, hot)
+    session.commit()
+    return len(hot)
+
+def run_retention(retention_months=None):
+    """
+    Bảo trì lưu trữ: tạo trước partition các tháng tới (MySQL) và archive các tháng
+    cũ hơn retention_months. Trả về số event đã chuyển sang archive.
+    """
+    retention_months = EARTHQUAKE_RETENTION_MONTHS if retention_months is None else retention_months
+    with engine.begin() as conn:
+        ensure_partitions(conn)
+    if not retention_months:
+        return 0
+
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months)
+    session = SessionLocal()
+    moved = 0
+    started = time.time()
+    try:
+        oldest = session.query(Earthquake.time).filter(Earthquake.time < cutoff).order_by(Earthquake.time).first()
+        month = month_start(oldest[0]) if oldest else cutoff
+        while month < cutoff:
+            moved += archive_month(session, month)
+            month = add_months(month, 1)
+            # Tháng đã archive xong: mốc dữ liệu nóng tiến dần theo từng tháng
+            if month > (archive_boundary(session) or datetime.min):
+                set_ingest_state(session, ARCHIVE_BOUNDARY_KEY, month.isoformat())
+                bump_data_version(session)
+                session.commit()
+        if moved:
+            print(f"-> Retention: {moved} event chuyển sang archive trong {time.time() - started:.1f}s")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return moved
+
+def read_archive(start=None, end=None, columns=None, min_magnitude=None, limit=None, region=None):
+    """
+    Đọc event đã archive có time trong [start, end] (None = không giới hạn), đọc từ tháng mới nhất.
+    limit: dừng đọc thêm file khi đã đủ số dòng (kết quả vẫn có thể nhiều hơn limit)
+    region: (min_lat, min_lon, max_lat, max_lon), chỉ lấy event trong vùng
+    """
+    columns = list(columns) if columns else ARCHIVE_COLUMNS
+    read_columns = list(dict.fromkeys(columns + ['time'] + (['magnitude'] if min_magnitude else [])
+                                      + (['latitude', 'longitude'] if region else [])))
+
+    session = SessionLocal()
+    try:
+        query = session.query(ArchivedMonth).order_by(ArchivedMonth.month.desc())
+        if start is not None:
+            query = query.filter(ArchivedMonth.month >= month_start(start).date())
+        if end is not None:
+            query = query.filter(ArchivedMonth.month <= end.date())
+        records = query.all()
+    finally:
+        session.close()
+
+    frames = []
+    total = 0
+    for record in records:
+        if not os.path.exists(record.path):
+            print(f"⚠️ Thiếu file archive {record.path}")
+            continue
+        df = read_archive_file(record.path, read_columns)
+        mask = pd.Series(True, index=df.index)
+        if start is not None:
+            mask &= df['time'] >= start
+        if end is not None:
+            mask &= df['time'] <= end
+        if min_magnitude:
+            mask &= df['magnitude'] >= min_magnitude
+        if region:
+            mask &= region_mask(df['latitude'], df['longitude'], region)
+        frames.append(df.loc[mask, columns])
+        total += int(mask.sum())
+        if limit and total >= limit:
+            break
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+def include_archived(session, df, start, end, min_magnitude=None):
+    """
+    Bổ sung vào df (đọc từ earthquakes) các event đã archive trong [start, end], cùng cột với df.
+    Không đọc archive nếu khoảng thời gian chỉ nằm trong dữ liệu nóng.
+    """
+    boundary = archive_boundary(session)
+    if boundary is None or (start is not None and start >= boundary):
+        return df
+    columns = list(df.columns)
+    archived = read_archive(start, end, columns=list(dict.fromkeys(columns + ['id'])), min_magnitude=min_magnitude)
+    if archived.empty:
+        return df
+    if 'id' in df.columns:
+        # Event cập nhật muộn có bản mới trong earthquakes
+        archived = archived[~archived['id'].isin(df['id'])]
+    print(f"-> Bổ sung {len(archived)} event từ archive")
+    return pd.concat([df, archived[columns]], ignore_index=True)
@@ -0,0 +1,150 @@
+import math
+import numpy as np
+
+# Geohash cho toạ độ event: chuỗi base32, mỗi ký tự thêm vào chia ô cha thành 32 ô con,
+# nên prefix độ dài k của geohash chính là ô ở độ phân giải k (ô gần nhau có prefix chung).
+# earthquakes lưu geohash (8 ký tự, ~38m x 19m) và 2 ô thô geohash_4 (~39km x 19.5km),
+# geohash_2 (~1250km x 625km), mỗi cột index kèm time; truy vấn theo vùng chọn các ô phủ vùng
+# (cover_cells) rồi mới so toạ độ chính xác.
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+BASE32_BYTES = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+GEOHASH_PRECISION = 8
+COARSE_PRECISIONS = (4, 2)
+EARTH_RADIUS_KM = 6371.0088
+
+def bit_counts(precision):
+    # Bit chẵn (tính từ 0) là kinh độ -> kinh độ nhận phần dư khi tổng số bit lẻ
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+def cell_size(precision):
+    """
+    Kích thước ô (độ vĩ, độ kinh) ở độ phân giải precision
+    """
+    lon_bits, lat_bits = bit_counts(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def quantize(values, low, high, bits):
+    scaled = np.floor((values - low) / (high - low) * (1 << bits))
+    return np.clip(scaled, 0, (1 << bits) - 1).astype('int64')
+
+def encode_array(latitudes, longitudes, precision=GEOHASH_PRECISION):
+    """
+    Geohash cho mảng toạ độ (1 phép tính cho cả batch). Thiếu toạ độ (NaN/None) -> None
+    """
+    latitudes = np.asarray(latitudes, dtype='float64')
+    longitudes = np.asarray(longitudes, dtype='float64')
+    valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    lon_bits, lat_bits = bit_counts(precision)
+    lat_q = quantize(latitudes[valid], -90.0, 90.0, lat_bits)
+    lon_q = quantize(longitudes[valid], -180.0, 180.0, lon_bits)
+
+    # Xen kẽ bit kinh độ / vĩ độ, bit cao nhất trước
+    code = np.zeros(len(lat_q), dtype='int64')
+    lon_i, lat_i = lon_bits, lat_bits
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_i -= 1
+            code = (code << 1) | ((lon_q >> lon_i) & 1)
+        else:
+            lat_i -= 1
+            code = (code << 1) | ((lat_q >> lat_i) & 1)
+
+    shifts = np.arange(precision - 1, -1, -1, dtype='int64') * 5
+    chars = BASE32_BYTES[(code[:, None] >> shifts) & 31]
+    hashes = chars.view(f'S{precision}').ravel().astype(str).tolist() if len(chars) else []
+
+    result = [None] * len(latitudes)
+    for i, value in zip(np.flatnonzero(valid), hashes):
+        result[i] = value
+    return result
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    return encode_array([np.nan if latitude is None else latitude],
+                        [np.nan if longitude is None else longitude], precision)[0]
+
+def geohash_columns(latitudes, longitudes):
+    """
+    Giá trị các cột geohash, geohash_4, geohash_2 của earthquakes cho mảng toạ độ
+    """
+    full = encode_array(latitudes, longitudes, GEOHASH_PRECISION)
+    columns = {'geohash': full}
+    for precision in COARSE_PRECISIONS:
+        columns[f'geohash_{precision}'] = [value[:precision] if value else None for value in full]
+    return columns
+
+def split_antimeridian(min_lat, min_lon, max_lat, max_lon):
+    # Vùng vắt qua kinh tuyến 180 (min_lon > max_lon) -> 2 hình chữ nhật
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+def count_cells(region, precision):
+    lat_size, lon_size = cell_size(precision)
+    total = 0
+    for min_lat, min_lon, max_lat, max_lon in split_antimeridian(*region):
+        rows = math.floor((max_lat + 90.0) / lat_size) - math.floor((min_lat + 90.0) / lat_size) + 1
+        cols = math.floor((max_lon + 180.0) / lon_size) - math.floor((min_lon + 180.0) / lon_size) + 1
+        total += rows * cols
+    return total
+
+def cover_cells(region, precision):
+    """
+    Các ô geohash độ phân giải precision phủ kín vùng region = (min_lat, min_lon, max_lat, max_lon)
+    """
+    lat_size, lon_size = cell_size(precision)
+    cells = set()
+    for min_lat, min_lon, max_lat, max_lon in split_antimeridian(*region):
+        first_row = math.floor((min_lat + 90.0) / lat_size)
+        last_row = min(math.floor((max_lat + 90.0) / lat_size), round(180.0 / lat_size) - 1)
+        first_col = math.floor((min_lon + 180.0) / lon_size)
+        last_col = min(math.floor((max_lon + 180.0) / lon_size), round(360.0 / lon_size) - 1)
+        # Tâm của từng ô trong lưới
+        lats = -90.0 + (np.arange(first_row, last_row + 1) + 0.5) * lat_size
+        lons = -180.0 + (np.arange(first_col, last_col + 1) + 0.5) * lon_size
+        grid_lat, grid_lon = np.meshgrid(lats, lons, indexing='ij')
+        cells.update(encode_array(grid_lat.ravel(), grid_lon.ravel(), precision))
+    return sorted(cells)
+
+def choose_precision(region, max_cells):
+    """
+    Độ phân giải mịn nhất mà số ô phủ vùng không vượt quá max_cells (tối thiểu 1)
+    """
+    for precision in range(GEOHASH_PRECISION, 1, -1):
+        if count_cells(region, precision) <= max_cells:
+            return precision
+    return 1
+
+def radius_region(latitude, longitude, radius_km):
+    """
+    Hình chữ nhật (min_lat, min_lon, max_lat, max_lon) bao đường tròn bán kính radius_km
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = latitude - lat_delta, latitude + lat_delta
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # Chứa cực: mọi kinh độ
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    lon_delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    if lon_delta >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon = (longitude - lon_delta + 540.0) % 360.0 - 180.0
+    max_lon = (longitude + lon_delta + 540.0) % 360.0 - 180.0
+    return min_lat, min_lon, max_lat, max_lon
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype='float64')) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def region_mask(latitudes, longitudes, region):
+    """
+    Mask các toạ độ nằm trong region (xét cả vùng vắt qua kinh tuyến 180)
+    """
+    latitudes = np.asarray(latitudes, dtype='float64')
+    longitudes = np.asarray(longitudes, dtype='float64')
+    mask = np.zeros(len(latitudes), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for min_lat, min_lon, max_lat, max_lon in split_antimeridian(*region):
+            mask |= (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+    return mask
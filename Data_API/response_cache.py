@@ -0,0 +1,164 @@
+import os
+import time
+import pickle
+import sqlite3
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from .database import get_data_version
+
+# Cache response của các endpoint đọc tổng hợp (/api/stats, /api/correlation, /api/time-series,
+# /predictions/latest): mỗi lần tải dashboard đều gọi lại, trong khi dữ liệu chỉ đổi khi
+# ingestion / BE Services commit.
+# - Key: tên endpoint + tham số (đã áp giá trị mặc định). Entry gắn với data_version lúc tính
+#   (database.get_data_version: bộ đếm DATA_VERSION_KEY + batch change_outbox mới nhất),
+#   data_version đổi -> tính lại.
+# - data_version đọc lại tối đa mỗi RESPONSE_CACHE_VERSION_INTERVAL giây; giữa 2 lần đọc, cache hit
+#   trả thẳng từ bộ nhớ không chạm DB.
+# - RESPONSE_CACHE_TTL: entry hết hạn kể cả khi dữ liệu không đổi (endpoint tính theo ngày hiện tại).
+# - RESPONSE_CACHE_FILE (tuỳ chọn): file SQLite dùng chung cho các worker uvicorn trên cùng máy,
+#   response 1 worker đã tính thì worker khác đọc lại thay vì tính lại.
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))   # giây, 0 = tắt cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))  # số entry tối đa trong bộ nhớ (LRU)
+RESPONSE_CACHE_VERSION_INTERVAL = float(os.getenv("RESPONSE_CACHE_VERSION_INTERVAL", "2"))
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "")
+
+METRIC_PREFIX = "earthquake_response_cache"
+MISSING = object()
+
+entries = OrderedDict()   # key -> (data_version, expires_at, response)
+cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "shared_hits": 0, "misses": 0}
+version_state = {"value": None, "checked": None}
+shared_local = threading.local()
+
+def current_version(session):
+    # Giá trị đọc được dùng lại trong RESPONSE_CACHE_VERSION_INTERVAL giây
+    now = time.monotonic()
+    checked = version_state["checked"]
+    if checked is None or now - checked >= RESPONSE_CACHE_VERSION_INTERVAL:
+        version_state.update(value=get_data_version(session), checked=now)
+    return version_state["value"]
+
+def count(name):
+    with cache_lock:
+        cache_stats[name] += 1
+
+def memory_get(key, version):
+    with cache_lock:
+        entry = entries.get(key)
+        if entry is None:
+            return MISSING
+        entry_version, expires_at, response = entry
+        if entry_version != version or expires_at <= time.time():
+            del entries[key]
+            return MISSING
+        entries.move_to_end(key)
+        return response
+
+def memory_put(key, version, expires_at, response):
+    with cache_lock:
+        entries[key] = (version, expires_at, response)
+        entries.move_to_end(key)
+        while len(entries) > RESPONSE_CACHE_SIZE:
+            entries.popitem(last=False)
+
+def shared_connection():
+    # 1 connection sqlite3 mỗi thread (threadpool của FastAPI)
+    con = getattr(shared_local, 'con', None)
+    if con is None:
+        con = sqlite3.connect(RESPONSE_CACHE_FILE, timeout=1)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS response_cache "
+                    "(key TEXT PRIMARY KEY, data_version TEXT, expires_at REAL, response BLOB)")
+        shared_local.con = con
+    return con
+
+def shared_get(key, version):
+    try:
+        row = shared_connection().execute(
+            "SELECT response, expires_at FROM response_cache WHERE key = ? AND data_version = ? AND expires_at > ?",
+            (key, version, time.time())
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"⚠️ Không đọc được cache dùng chung ({e})")
+        return MISSING, None
+    if row is None:
+        return MISSING, None
+    return pickle.loads(row[0]), row[1]
+
+def shared_put(key, version, expires_at, response):
+    try:
+        con = shared_connection()
+        with con:
+            con.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+            con.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                        (key, version, expires_at, pickle.dumps(response)))
+    except sqlite3.Error as e:
+        print(f"⚠️ Không ghi được cache dùng chung ({e})")
+
+def cache_get(key, version):
+    response = memory_get(key, version)
+    if response is not MISSING:
+        count("hits")
+        return response
+    if RESPONSE_CACHE_FILE:
+        response, expires_at = shared_get(key, version)
+        if response is not MISSING:
+            count("shared_hits")
+            # Giữ hạn của entry do worker khác ghi
+            memory_put(key, version, expires_at, response)
+            return response
+    count("misses")
+    return MISSING
+
+def cache_put(key, version, response):
+    expires_at = time.time() + RESPONSE_CACHE_TTL
+    memory_put(key, version, expires_at, response)
+    if RESPONSE_CACHE_FILE:
+        shared_put(key, version, expires_at, response)
+
+def cached_response(endpoint):
+    """
+    Cache kết quả của endpoint đọc có tham số db (session đọc); các tham số còn lại tạo thành key.
+    Endpoint ném lỗi (HTTPException, ...) thì không cache.
+    """
+    signature = inspect.signature(endpoint)
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        if not RESPONSE_CACHE_TTL:
+            return endpoint(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = sorted((name, value) for name, value in bound.arguments.items() if name != 'db')
+        key = repr((endpoint.__name__, params))
+        version = current_version(bound.arguments['db'])
+        response = cache_get(key, version)
+        if response is MISSING:
+            response = endpoint(*args, **kwargs)
+            cache_put(key, version, response)
+        return response
+    return wrapper
+
+def clear_cache():
+    with cache_lock:
+        entries.clear()
+    version_state.update(value=None, checked=None)
+
+def cache_prometheus_text():
+    with cache_lock:
+        stats = dict(cache_stats, size=len(entries))
+    lines = []
+    for name, kind, help_text, value in [
+        ("hits_total", "counter", "Số request trả từ cache trong bộ nhớ.", stats["hits"]),
+        ("shared_hits_total", "counter", "Số request trả từ cache dùng chung giữa các worker.", stats["shared_hits"]),
+        ("misses_total", "counter", "Số request phải tính lại response.", stats["misses"]),
+        ("entries", "gauge", "Số entry đang giữ trong bộ nhớ.", stats["size"]),
+    ]:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        lines.append(f"{METRIC_PREFIX}_{name} {float(value)!r}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import socket
+import resource
+import tempfile
+import subprocess
+import statistics
+from datetime import timedelta
+
+# Benchmark ingestion với server giả lập (usgs_standin.py), không gọi USGS thật.
+# Chạy: python benchmark_ingestion.py [feed|stream|backfill|cycle|all] [events_per_day] [backfill_days] [delay_giây] [tỉ_lệ_lỗi_5xx]
+# delay / tỉ lệ lỗi truyền cho stand-in để đo cả nhánh retry + backoff (HTTP_MAX_RETRIES đặt số lần retry).
+# DB mặc định là 1 file SQLite tạm; đặt BENCH_DATABASE_URL để đo trên MySQL (KHÔNG dùng DB production).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ['feed', 'stream', 'backfill', 'cycle']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_standin(events_per_day, delay=0.0, error_rate=0.0):
+    """
+    Chạy usgs_standin.py ở process riêng để RSS đo được chỉ là của ingestion
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'usgs_standin.py'), str(port), str(events_per_day), str(delay), str(error_rate)],
+        stdout=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Không khởi động được usgs_standin.py")
+
+def peak_rss_mb():
+    # Linux: ru_maxrss tính theo KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def run_scenario(name, ingestion, backfill_days):
+    """
+    Chạy 1 kịch bản, trả về (số event, thời gian, danh sách latency ghi DB mỗi batch, số lần fetch lỗi, số lần retry HTTP)
+    """
+    latencies = []
+    retries = []
+    original_upsert = ingestion.upsert_batch
+    original_record = ingestion.ingest_metrics.record
+
+    def timed_upsert(session, rows):
+        started = time.perf_counter()
+        result = original_upsert(session, rows)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    def counting_record(field, value):
+        # http_get ghi 1 lần 'retries' mỗi lần retry (503 / timeout của stand-in)
+        if field == 'retries':
+            retries.append(value)
+        original_record(field, value)
+
+    ingestion.upsert_batch = timed_upsert
+    ingestion.ingest_metrics.record = counting_record
+    started = time.perf_counter()
+    events = 0
+    failed = 0
+    try:
+        if name == 'feed':
+            # Lần 1: DB trống (insert), lần 2: cùng feed (đi qua nhánh bỏ qua event không đổi)
+            for _ in range(2):
+                ingestion.forget_validators(ingestion.USGS_API_URL)
+                data = ingestion.fetch_usgs_data()
+                if data is None:
+                    # Stand-in trả lỗi / timeout (error_rate): đếm và bỏ qua lần này
+                    failed += 1
+                    continue
+                ingestion.process_and_save(data)
+                events += len(data.get('features', []))
+        elif name == 'stream':
+            ingestion.forget_validators(ingestion.USGS_API_URL)
+            result = ingestion.save_feature_stream(ingestion.stream_features(ingestion.USGS_API_URL))
+            events += result['fetched']
+        elif name == 'backfill':
+            from usgs_standin import EPOCH_START
+            start = EPOCH_START + timedelta(days=365)
+            result = ingestion.run_backfill(start, start + timedelta(days=backfill_days))
+            events += result['fetched']
+            failed += len(result['failed'])
+        elif name == 'cycle':
+            # 1 chu kỳ full + 3 chu kỳ incremental theo watermark
+            for _ in range(4):
+                result = ingestion.run_ingest_cycle() or {}
+                events += sum(result.get(key) or 0 for key in ('inserted', 'updated', 'unchanged'))
+    finally:
+        ingestion.upsert_batch = original_upsert
+        ingestion.ingest_metrics.record = original_record
+
+    return events, time.perf_counter() - started, latencies, failed, len(retries)
+
+def main():
+    scenario = sys.argv[1] if len(sys.argv) >= 2 else 'all'
+    events_per_day = float(sys.argv[2]) if len(sys.argv) >= 3 else 400
+    backfill_days = float(sys.argv[3]) if len(sys.argv) >= 4 else 60
+    delay = float(sys.argv[4]) if len(sys.argv) >= 5 else 0.0
+    error_rate = float(sys.argv[5]) if len(sys.argv) >= 6 else 0.0
+
+    names = SCENARIOS if scenario == 'all' else [scenario]
+    if any(name not in SCENARIOS for name in names):
+        print(f"Scenario không hợp lệ: {scenario}. Chọn: {', '.join(SCENARIOS)}, all")
+        return
+
+    standin, base_url = start_standin(events_per_day, delay, error_rate)
+    db_file = None
+    if not os.getenv("BENCH_DATABASE_URL"):
+        db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+
+    # Phải đặt biến môi trường trước khi import data_ingestion / database
+    os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{db_file}"
+    os.environ["USGS_BASE_URL"] = base_url
+    sys.path.insert(0, HERE)
+    import data_ingestion as ingestion
+
+    results = []
+    try:
+        ingestion.init_db()
+        print(f"=== Ingestion benchmark: {base_url}, {events_per_day:.0f} events/day, "
+              f"delay {delay}s, lỗi 503 {error_rate:.0%}, DB {os.environ['DATABASE_URL']} ===")
+        for name in names:
+            events, elapsed, latencies, failed, retries = run_scenario(name, ingestion, backfill_days)
+            results.append((name, events, elapsed, latencies, peak_rss_mb(), failed, retries))
+    finally:
+        standin.terminate()
+        if db_file:
+            os.remove(db_file)
+
+    print("")
+    print(f"{'scenario':<10}{'events':>10}{'seconds':>10}{'events/s':>12}"
+          f"{'batches':>9}{'write p50':>11}{'write p95':>11}{'write max':>11}{'peak RSS':>11}{'fetch lỗi':>11}{'retries':>9}")
+    for name, events, elapsed, latencies, rss, failed, retries in results:
+        rate = events / elapsed if elapsed > 0 else 0
+        print(f"{name:<10}{events:>10}{elapsed:>10.2f}{rate:>12.0f}{len(latencies):>9}"
+              f"{percentile(latencies, 50) * 1000:>9.1f}ms{percentile(latencies, 95) * 1000:>9.1f}ms"
+              f"{(max(latencies) if latencies else 0) * 1000:>9.1f}ms{rss:>9.0f}MB{failed:>11}{retries:>9}")
+    if results:
+        print(f"\nMean write latency/batch: "
+              f"{statistics.mean([l for r in results for l in r[3]] or [0]) * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
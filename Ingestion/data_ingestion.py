@@ -4,33 +4,731 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from Data_API import database
 import requests
 import time
-from datetime import datetime, timedelta
-from Data_API.database import SessionLocal, init_db, Earthquake
+import re
+import json
+import codecs
+import random
+import threading
+import gzip
+import glob
+import itertools
+import tempfile
+import uuid
+import numpy as np
+import pandas as pd
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta, timezone
+from Data_API.database import DATABASE_URL, engine, SessionLocal, init_db, Earthquake, BackfillCheckpoint, get_ingest_state, set_ingest_state, publish_change, prune_outbox, refresh_rollups, rebuild_rollups
+from sqlalchemy import update, delete, tuple_, func, text, create_engine, MetaData, Table, Column, String, Float, Integer, DateTime, DECIMAL
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
+from ingest_pipeline import run_pipeline
+import ingest_metrics
+from Data_API import earthquake_archive
+from Data_API.geocell import geohash_columns, encode
 
-# URL API của USGS
-USGS_API_URL = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson"
+# URL API của USGS (đổi USGS_BASE_URL để trỏ tới server giả lập, xem usgs_standin.py)
+USGS_BASE_URL = os.getenv("USGS_BASE_URL", "https://earthquake.usgs.gov").rstrip('/')
+SUMMARY_FEED_URL = USGS_BASE_URL + "/earthquakes/feed/v1.0/summary/{}.geojson"
+USGS_API_URL = SUMMARY_FEED_URL.format("all_month")
 SLEEP_TIME = 300  # 5 phút (300 giây)
+FDSN_QUERY_URL = USGS_BASE_URL + "/fdsnws/event/1/query"
+
+# Nguồn cho các chu kỳ incremental: 'fdsn' (updatedafter) hoặc feed nhỏ 'all_hour' / 'all_day'
+INGEST_INCREMENTAL_SOURCE = os.getenv("INGEST_INCREMENTAL_SOURCE", "fdsn")
+SUMMARY_FEEDS = {
+    'all_hour': (SUMMARY_FEED_URL.format("all_hour"), timedelta(hours=1)),
+    'all_day': (SUMMARY_FEED_URL.format("all_day"), timedelta(days=1)),
+}
+# Chu kỳ đồng bộ lại toàn bộ all_month (mặc định 1 ngày/lần)
+FULL_RECONCILE_INTERVAL = int(os.getenv("FULL_RECONCILE_INTERVAL", "86400"))
+# Lùi watermark một chút để không bỏ sót event cập nhật cùng thời điểm
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+# Backfill song song: số worker fetch, độ dài mỗi chunk ban đầu
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+BACKFILL_CHUNK_DAYS = float(os.getenv("BACKFILL_CHUNK_DAYS", "7"))
+BACKFILL_MIN_MAGNITUDE = float(os.getenv("BACKFILL_MIN_MAGNITUDE", "1.0"))
+# Pipeline fetch -> decode -> validate -> write: số worker mỗi stage (fetch dùng BACKFILL_WORKERS).
+# Ghi DB mặc định 1 worker để giữ thứ tự ghi và tránh lock SQLite
+INGEST_DECODE_WORKERS = int(os.getenv("INGEST_DECODE_WORKERS", "1"))
+INGEST_VALIDATE_WORKERS = int(os.getenv("INGEST_VALIDATE_WORKERS", "1"))
+INGEST_WRITE_WORKERS = int(os.getenv("INGEST_WRITE_WORKERS", "1"))
+# Không chia nhỏ chunk dưới mức này dù vẫn chạm giới hạn
+BACKFILL_MIN_CHUNK = timedelta(minutes=30)
+FDSN_MAX_EVENTS = 20000  # FDSN trả tối đa 20.000 event mỗi request
+FDSN_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Parse GeoJSON dạng stream: đọc body theo từng khối, không giữ toàn bộ feature list trong RAM
+INGEST_STREAMING = os.getenv("INGEST_STREAMING", "0") == "1"
+STREAM_READ_SIZE = 64 * 1024
+FEATURES_KEY_PATTERN = re.compile(r'"features"\s*:\s*\[')
+
+# HTTP client dùng chung: timeout (connect, read), retry với backoff có jitter
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")), float(os.getenv("HTTP_READ_TIMEOUT", "120")))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = 1.0   # giây, nhân đôi sau mỗi lần retry
+HTTP_BACKOFF_MAX = 60.0
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+HTTP_POOL_SIZE = max(BACKFILL_WORKERS, 4)
+
+# Lưu trữ body gốc của mỗi lần fetch (gzip, chia thư mục theo ngày UTC) để replay offline.
+# Để trống = tắt.
+INGEST_ARCHIVE_DIR = os.getenv("INGEST_ARCHIVE_DIR", "")
+
+WATERMARK_KEY = "updated_watermark"
+LAST_FULL_SYNC_KEY = "last_full_sync"
+
+# Chế độ ghi: 'bulk' = INSERT nhiều dòng theo batch, 'merge' = session.merge từng dòng (cách cũ)
+INGEST_WRITE_MODE = os.getenv("INGEST_WRITE_MODE", "bulk")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+
+# Các cột được ghi đè khi event đã tồn tại (không đụng tới cluster_label, created_at)
+UPSERT_COLUMNS = [
+    'place', 'magnitude', 'mag_type', 'time', 'updated', 'url',
+    'status', 'tsunami', 'latitude', 'longitude', 'depth',
+    'geohash', 'geohash_4', 'geohash_2'
+]
+
+# Outbox báo thay đổi cho BE Services (xem change_outbox trong database.py)
+OUTBOX_SOURCE = "ingestion"
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# Import catalog ComCat (CSV / Parquet) số lượng lớn
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "100000"))
+# Tiền tố tên bảng staging: mỗi lần import dùng 1 bảng riêng (xem new_staging_table)
+IMPORT_STAGING_TABLE = "earthquakes_import_staging"
+COMCAT_EVENT_URL = "https://earthquake.usgs.gov/earthquakes/eventpage/{}"
+IMPORT_COLUMNS = ['id'] + UPSERT_COLUMNS
+
+def new_staging_table():
+    """
+    Bảng staging tạm của 1 lần import (metadata riêng, init_db không tạo bảng này).
+    Tên riêng theo pid + uuid: 2 lần import chạy song song không xoá/merge dòng của nhau.
+    Không dùng TEMPORARY TABLE vì session trả connection về pool sau mỗi commit.
+    """
+    return Table(
+        f"{IMPORT_STAGING_TABLE}_{os.getpid()}_{uuid.uuid4().hex[:8]}", MetaData(),
+        Column('id', String(50), primary_key=True),
+        Column('place', String(255)),
+        Column('magnitude', Float),
+        Column('mag_type', String(20)),
+        Column('time', DateTime),
+        Column('updated', DateTime),
+        Column('url', String(255)),
+        Column('status', String(50)),
+        Column('tsunami', Integer),
+        Column('latitude', DECIMAL(10, 6)),
+        Column('longitude', DECIMAL(11, 6)),
+        Column('depth', Float),
+        Column('geohash', String(8)),
+        Column('geohash_4', String(4)),
+        Column('geohash_2', String(2)),
+    )
+
+# MySQL cần bật local_infile phía client cho LOAD DATA LOCAL INFILE
+if engine.dialect.name == 'mysql':
+    import_engine = create_engine(DATABASE_URL, connect_args={"local_infile": True})
+else:
+    import_engine = engine
+ImportSession = sessionmaker(autocommit=False, autoflush=False, bind=import_engine)
+
+http_session = None
+http_session_lock = threading.Lock()
+# ETag / Last-Modified của các summary feed, để gửi conditional request lần sau
+feed_validators = {}
+
+def get_http_session():
+    """
+    requests.Session dùng chung (giữ kết nối keep-alive) cho toàn bộ ingestion
+    """
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                'Accept-Encoding': 'gzip, deflate',
+                'User-Agent': 'EarthquakeTracker-Ingestion'
+            })
+            http_session = session
+    return http_session
+
+def http_get(url, params=None, stream=False, conditional=False):
+    """
+    GET qua session dùng chung, có timeout, retry lỗi tạm thời (mất kết nối,
+    timeout, 429, 5xx) với exponential backoff + jitter.
+    conditional=True: gửi If-None-Match / If-Modified-Since, feed không đổi sẽ trả 304
+    (caller gọi remember_validators sau khi đã parse xong body 200).
+    Raise lỗi kết nối cuối cùng nếu hết lượt retry.
+    """
+    headers = {}
+    if conditional:
+        headers.update(feed_validators.get(url, {}))
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        error = None
+        response = None
+        try:
+            with ingest_metrics.timed('http_seconds'):
+                response = get_http_session().get(url, params=params, headers=headers,
+                                                  timeout=HTTP_TIMEOUT, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        if response is not None and response.status_code not in HTTP_RETRY_STATUS:
+            return response
+
+        if attempt == HTTP_MAX_RETRIES:
+            break
+
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, min(HTTP_BACKOFF_MAX, float(retry_after)))
+            reason = f"Status {response.status_code}"
+            response.close()
+        else:
+            reason = str(error)
+        print(f"-> Retry {attempt + 1}/{HTTP_MAX_RETRIES} sau {delay:.1f}s ({reason}): {url}")
+        ingest_metrics.record('retries', 1)
+        time.sleep(delay)
+
+    if response is not None:
+        return response
+    raise error
+
+def remember_validators(url, response):
+    # Chỉ lưu ETag / Last-Modified khi body 200 đã đọc + parse thành công: body lỗi (bị cắt, JSON hỏng)
+    # thì lần sau vẫn tải lại đầy đủ thay vì nhận 304 và coi như không có gì thay đổi
+    validators = {}
+    if response.headers.get('ETag'):
+        validators['If-None-Match'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators['If-Modified-Since'] = response.headers['Last-Modified']
+    feed_validators[url] = validators
+
+def forget_validators(url):
+    # Gọi khi xử lý feed thất bại để lần sau tải lại đầy đủ thay vì nhận 304
+    feed_validators.pop(url, None)
+
+def archive_path(url):
+    """
+    Đường dẫn file archive cho 1 payload: ARCHIVE_DIR/YYYY/MM/DD/HHMMSS_micro_<feed>.geojson.gz
+    """
+    now = datetime.utcnow()
+    label = os.path.basename(urlparse(url).path).replace('.geojson', '') or 'feed'
+    folder = os.path.join(INGEST_ARCHIVE_DIR, now.strftime('%Y'), now.strftime('%m'), now.strftime('%d'))
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{now.strftime('%H%M%S_%f')}_{label}.geojson.gz")
+
+def archive_payload(url, body):
+    if not INGEST_ARCHIVE_DIR:
+        return
+    try:
+        with gzip.open(archive_path(url), 'wb') as f:
+            f.write(body)
+    except OSError as e:
+        print(f"Lỗi khi lưu archive: {e}")
+
+def response_json(response):
+    # Lưu body gốc vào archive (nếu bật) trước khi parse
+    body = response.content
+    ingest_metrics.record('http_bytes', len(body))
+    archive_payload(response.url, body)
+    with ingest_metrics.timed('parse_seconds'):
+        return json.loads(body)
 
 def fetch_usgs_data():
     try:
         print(f"[{datetime.now()}] Fetching data from USGS...")
-        response = requests.get(USGS_API_URL)
+        response = http_get(USGS_API_URL, conditional=True)
         if response.status_code == 200:
-            return response.json()
+            data = response_json(response)
+            remember_validators(USGS_API_URL, response)
+            return data
+        if response.status_code == 304:
+            print("-> Feed không thay đổi (304)")
+            return {'features': []}
         else:
             print(f"Error fetching data: Status {response.status_code}")
             return None
     except Exception as e:
         print(f"Exception during fetch: {e}")
         return None
+def updated_since_params(since_dt):
+    # Watermark là updated của event (UTC, giống earthquakes.time)
+    since_utc = since_dt - WATERMARK_OVERLAP
+    return {
+        'format': 'geojson',
+        'updatedafter': since_utc.strftime('%Y-%m-%dT%H:%M:%S'),
+        # Giữ cùng cửa sổ 30 ngày với all_month.geojson
+        'starttime': (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def fetch_updated_since(since_dt):
+    """
+    Lấy các event được USGS cập nhật sau thời điểm since_dt (FDSN updatedafter)
+    """
+    params = updated_since_params(since_dt)
+
+    try:
+        print(f"[{datetime.now()}] Fetching events updated after {params['updatedafter']} UTC...")
+        response = http_get(FDSN_QUERY_URL, params=params)
+        if response.status_code == 200:
+            return response_json(response)
+        # 204: không có event nào thay đổi
+        if response.status_code == 204:
+            return {'features': []}
+        print(f"Error fetching data: Status {response.status_code}")
+    except Exception as e:
+        print(f"Exception during fetch: {e}")
+
+    return None
+
+def fetch_summary_feed(url):
+    try:
+        print(f"[{datetime.now()}] Fetching {url}...")
+        response = http_get(url, conditional=True)
+        if response.status_code == 200:
+            data = response_json(response)
+            remember_validators(url, response)
+            return data
+        if response.status_code == 304:
+            print("-> Feed không thay đổi (304)")
+            return {'features': []}
+        print(f"Error fetching data: Status {response.status_code}")
+    except Exception as e:
+        print(f"Exception during fetch: {e}")
+    return None
+
+def iter_geojson_features(chunks):
+    """
+    Parse tăng dần 1 FeatureCollection GeoJSON từ các khối text,
+    yield từng feature mà không cần giữ toàn bộ body trong bộ nhớ
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+
+    # Tìm tới đầu mảng "features"
+    while True:
+        match = FEATURES_KEY_PATTERN.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        # Giữ lại đuôi buffer phòng khi key bị cắt giữa 2 khối
+        buffer = buffer[-32:] + chunk
+
+    pos = 0
+    eof = False
+    while True:
+        # Bỏ qua khoảng trắng và dấu phẩy giữa các feature
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        feature = None
+        if pos < len(buffer):
+            try:
+                feature, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Feature bị cắt giữa 2 khối -> đọc thêm rồi parse lại
+                if eof:
+                    raise
+
+        if feature is not None:
+            yield feature
+            pos = end
+            continue
+
+        if eof:
+            raise ValueError("GeoJSON bị cắt giữa chừng")
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+def stream_features(url, params=None):
+    """
+    Tải GeoJSON dạng stream và yield từng feature.
+    Raise lỗi nếu request thất bại để phía ghi không coi là "không có dữ liệu".
+    """
+    print(f"[{datetime.now()}] Streaming {url}...")
+    # Chỉ summary feed (không có params) mới dùng conditional request
+    with http_get(url, params=params, stream=True, conditional=params is None) as response:
+        if response.status_code in (204, 304):
+            return
+        response.raise_for_status()
+
+        archive = gzip.open(archive_path(response.url), 'wb') if INGEST_ARCHIVE_DIR else None
+        # Thời gian chờ mạng (tee_chunks) tính riêng khỏi thời gian parse
+        network = [0.0]
+        parse_seconds = 0.0
+        try:
+            utf8 = codecs.getincrementaldecoder('utf-8')()
+            text_chunks = (
+                utf8.decode(chunk)
+                for chunk in tee_chunks(response.iter_content(chunk_size=STREAM_READ_SIZE), archive, network)
+            )
+            features = iter_geojson_features(text_chunks)
+            while True:
+                started, waited = time.time(), network[0]
+                feature = next(features, None)
+                parse_seconds += time.time() - started - (network[0] - waited)
+                if feature is None:
+                    break
+                yield feature
+            if params is None:
+                # Đã parse hết body
+                remember_validators(url, response)
+        finally:
+            ingest_metrics.record('parse_seconds', parse_seconds)
+            if archive:
+                archive.close()
+
+def tee_chunks(chunks, archive, network=None):
+    # Ghi song song các khối bytes vào archive khi đang stream; đếm byte và thời gian chờ mạng
+    chunks = iter(chunks)
+    while True:
+        started = time.time()
+        chunk = next(chunks, None)
+        waited = time.time() - started
+        ingest_metrics.record('http_seconds', waited)
+        if network is not None:
+            network[0] += waited
+        if chunk is None:
+            return
+        ingest_metrics.record('http_bytes', len(chunk))
+        if archive:
+            archive.write(chunk)
+        yield chunk
+
+def list_archive_files(start_date=None, end_date=None):
+    """
+    Các file archive theo thứ tự thời gian fetch, lọc theo ngày (YYYY-MM-DD, bao gồm 2 đầu)
+    """
+    files = sorted(glob.glob(os.path.join(INGEST_ARCHIVE_DIR, '*', '*', '*', '*.geojson.gz')))
+    selected = []
+    for path in files:
+        day = '-'.join(path.split(os.sep)[-4:-1])
+        if (start_date and day < start_date) or (end_date and day > end_date):
+            continue
+        selected.append(path)
+    return selected
+
+def archive_features(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        yield from iter_geojson_features(iter(lambda: f.read(STREAM_READ_SIZE), ''))
+
+def replay_archive(start_date=None, end_date=None, batch_size=None):
+    """
+    Ingest lại từ archive local (không cần mạng), theo đúng thứ tự fetch
+    """
+    if not INGEST_ARCHIVE_DIR:
+        print("INGEST_ARCHIVE_DIR chưa được cấu hình")
+        return None
+
+    init_db()
+    files = list_archive_files(start_date, end_date)
+    print(f"=== REPLAY {len(files)} payloads từ {INGEST_ARCHIVE_DIR} ===")
+    started = time.time()
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "max_updated": None, "ok": True, "fetched": 0}
+
+    # 1 pipeline cho toàn bộ archive: đọc file kế tiếp trong lúc batch trước đang được ghi
+    features = itertools.chain.from_iterable(archive_features(path) for path in files)
+    result = save_feature_stream(features, batch_size)
+    add_result(totals, result)
+    totals["fetched"] += result["fetched"]
+
+    elapsed = time.time() - started
+    rate = totals["fetched"] / elapsed if elapsed > 0 else 0
+    print(f"-> Replay xong: {totals['fetched']} events, {elapsed:.1f}s ({rate:.0f} events/s)")
+    return totals
+
+def comcat_time_ms(values):
+    """
+    Cột thời gian ComCat -> mảng epoch ms (NaN = thiếu).
+    CSV dùng chuỗi ISO 8601 UTC, một số bản Parquet lưu sẵn epoch ms.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype='float64', na_value=np.nan)
+    times = pd.to_datetime(values, utc=True, errors='coerce', format='ISO8601')
+    return ((times - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(milliseconds=1)).to_numpy(dtype='float64', na_value=np.nan)
+
+def catalog_frame_to_columns(df):
+    """
+    1 chunk catalog ComCat (CSV/Parquet) -> batch dạng cột giống decode_features
+    """
+    # File catalog có thể lặp id (tải chồng lấn khoảng thời gian) -> giữ dòng cuối
+    df = df.drop_duplicates('id', keep='last')
+    size = len(df)
+
+    def text(name):
+        if name not in df:
+            return [None] * size
+        return [None if value is None or value != value else str(value) for value in df[name].tolist()]
+
+    def number(name):
+        if name not in df:
+            return np.full(size, np.nan)
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    ids = text('id')
+    time_ms = comcat_time_ms(df['time'])
+    updated_ms = comcat_time_ms(df['updated']) if 'updated' in df else time_ms
+
+    return {
+        'id': ids,
+        'place': text('place'),
+        'magnitude': number('mag'),
+        'mag_type': text('magType'),
+        # CSV của ComCat không có url / tsunami
+        'url': text('url') if 'url' in df else [COMCAT_EVENT_URL.format(event_id) if event_id else None for event_id in ids],
+        'status': text('status'),
+        'tsunami': np.nan_to_num(number('tsunami')).astype('int64').tolist(),
+        'longitude': number('longitude'),
+        'latitude': number('latitude'),
+        'depth': number('depth'),
+        'time_ms': time_ms,
+        'updated_ms': updated_ms,
+        'time': epoch_ms_to_datetimes(time_ms),
+        'updated': epoch_ms_to_datetimes(updated_ms),
+    }
+
+def read_catalog_chunks(path, chunk_rows):
+    """
+    Đọc file catalog theo từng chunk DataFrame, không load cả file vào RAM.
+    Hỗ trợ .csv (kể cả .csv.gz) và .parquet (cần pyarrow)
+    """
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Đọc Parquet cần cài pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        text_columns = {name: str for name in ('id', 'place', 'magType', 'status', 'time', 'updated')}
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=text_columns, keep_default_na=False, na_values=[''])
+
+def datetime_strings(values):
+    # datetime64 -> 'YYYY-MM-DD HH:MM:SS.ffffff' (đúng định dạng SQLAlchemy lưu DateTime trên SQLite)
+    return [None if value == 'NaT' else value.replace('T', ' ')
+            for value in np.datetime_as_string(values, unit='us').tolist()]
+
+def staging_values(columns):
+    """
+    Batch dạng cột -> list tuple theo thứ tự IMPORT_COLUMNS, truyền thẳng cho driver
+    (bỏ qua bước xử lý tham số từng dòng của SQLAlchemy)
+    """
+    values = {
+        'id': columns['id'],
+        'place': columns['place'],
+        'magnitude': float_list(columns['magnitude']),
+        'mag_type': columns['mag_type'],
+        'time': datetime_strings(columns['time']),
+        'updated': datetime_strings(columns['updated']),
+        'url': columns['url'],
+        'status': columns['status'],
+        'tsunami': columns['tsunami'],
+        'latitude': float_list(columns['latitude']),
+        'longitude': float_list(columns['longitude']),
+        'depth': float_list(columns['depth']),
+        **geohash_columns(columns['latitude'], columns['longitude']),
+    }
+    return list(zip(*(values[col] for col in IMPORT_COLUMNS)))
+
+def load_data_field(value):
+    # Định dạng 1 giá trị cho LOAD DATA (FIELDS TERMINATED BY '\t' ESCAPED BY '\\')
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+def stage_with_load_data(session, table, values):
+    """
+    MySQL: ghi chunk ra file TSV tạm rồi LOAD DATA LOCAL INFILE vào bảng staging
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8', newline='\n') as f:
+        for row in values:
+            f.write('\t'.join(load_data_field(value) for value in row))
+            f.write('\n')
+        path = f.name
+    try:
+        session.execute(text(
+            f"LOAD DATA LOCAL INFILE :path INTO TABLE {table} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(IMPORT_COLUMNS)})"
+        ), {"path": path})
+    finally:
+        os.remove(path)
+
+def stage_with_executemany(session, table, values):
+    marker = '?' if import_engine.dialect.paramstyle == 'qmark' else '%s'
+    session.connection().exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(IMPORT_COLUMNS)}) "
+        f"VALUES ({', '.join([marker] * len(IMPORT_COLUMNS))})",
+        values
+    )
+
+def merge_staging_sql(dialect, table):
+    """
+    INSERT ... SELECT từ staging vào earthquakes; event đã có chỉ được ghi đè
+    khi bản import mới hơn (updated lớn hơn)
+    """
+    columns = ', '.join(IMPORT_COLUMNS)
+    if dialect == 'mysql':
+        # Ghi rõ tên bảng: staging có cùng tên cột -> tránh lỗi "column is ambiguous"
+        newer = "(VALUES(updated) > earthquakes.updated OR earthquakes.updated IS NULL)"
+        # MySQL gán lần lượt từ trái sang phải -> cột updated phải đứng cuối
+        assignments = [f"earthquakes.{col} = IF({newer}, VALUES({col}), earthquakes.{col})"
+                       for col in UPSERT_COLUMNS if col != 'updated']
+        assignments.append(f"earthquakes.updated = IF({newer}, VALUES(updated), earthquakes.updated)")
+        # PK (id, time): bỏ các dòng mà bản trong DB có time khác (bản cũ hơn đã bị xoá trước
+        # ở import_catalog_chunk, còn lại là bản trong DB mới hơn) để id không bị trùng
+        return (f"INSERT INTO earthquakes ({columns}, created_at) "
+                f"SELECT {', '.join('s.' + col for col in IMPORT_COLUMNS)}, UTC_TIMESTAMP() FROM {table} s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM earthquakes e WHERE e.id = s.id AND e.time <> s.time) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(assignments)}")
+    assignments = ', '.join(f"{col} = excluded.{col}" for col in UPSERT_COLUMNS)
+    # "WHERE true" bắt buộc với INSERT ... SELECT ... ON CONFLICT của SQLite
+    return (f"INSERT INTO earthquakes ({columns}, created_at) "
+            f"SELECT {columns}, CURRENT_TIMESTAMP FROM {table} WHERE true "
+            f"ON CONFLICT(id) DO UPDATE SET {assignments} "
+            f"WHERE excluded.updated > earthquakes.updated OR earthquakes.updated IS NULL")
+
+def import_catalog_chunk(session, dialect, columns, state):
+    """
+    Nạp 1 chunk: staging -> đếm mới/cập nhật -> merge vào earthquakes (+ outbox) trong 1 transaction.
+    Trả về (inserted, updated)
+    """
+    values = staging_values(columns)
+    if not values:
+        return 0, 0
+
+    table = state['table'].name
+    session.execute(text(f"{'TRUNCATE TABLE' if dialect == 'mysql' else 'DELETE FROM'} {table}"))
+    session.commit()
+
+    if dialect == 'mysql' and state['load_data']:
+        try:
+            stage_with_load_data(session, table, values)
+        except SQLAlchemyError as e:
+            # Server/driver tắt local_infile -> chuyển sang INSERT nhiều dòng vào staging
+            session.rollback()
+            state['load_data'] = False
+            print(f"⚠️ LOAD DATA LOCAL INFILE không dùng được ({e.__class__.__name__}), chuyển sang executemany")
+    if dialect != 'mysql' or not state['load_data']:
+        stage_with_executemany(session, table, values)
+    session.commit()
+
+    staged, existing, newer = session.execute(text(
+        f"SELECT COUNT(*), COUNT(e.id), "
+        f"SUM(CASE WHEN e.id IS NOT NULL AND (s.updated > e.updated OR e.updated IS NULL) THEN 1 ELSE 0 END) "
+        f"FROM {table} s LEFT JOIN earthquakes e ON e.id = s.id"
+    )).one()
+    # Event đổi time và bản import mới hơn: time cũ để tính lại rollup của giờ cũ
+    moved_condition = (f"FROM earthquakes e JOIN {table} s ON e.id = s.id "
+                       f"WHERE e.time <> s.time AND (s.updated > e.updated OR e.updated IS NULL)")
+    old_times = [row[0] for row in session.execute(
+        text(f"SELECT DISTINCT e.time {moved_condition}").columns(time=DateTime))]
+    if dialect == 'mysql' and old_times:
+        # Xoá dòng cũ (PK (id, time), xem merge_staging_sql)
+        session.execute(text(f"DELETE e {moved_condition}"))
+    session.execute(text(merge_staging_sql(dialect, table)))
+
+    inserted, updated = staged - existing, int(newer or 0)
+    times = columns['time'][~np.isnat(columns['time'])]
+    span = (times.min().tolist(), times.max().tolist()) if len(times) else (None, None)
+    publish_change(session, OUTBOX_SOURCE, [], [], *span, new_count=inserted, updated_count=updated)
+    if inserted or updated:
+        # Các giờ có mặt trong chunk (import lại file cũ không đổi gì -> bỏ qua)
+        refresh_rollups(session, np.unique(times.astype('datetime64[h]')).tolist() + old_times)
+    session.commit()
+    return inserted, updated
+
+def import_catalog(paths, chunk_rows=None):
+    """
+    Import catalog ComCat từ file CSV / Parquet (seed môi trường mới với hàng triệu event).
+    MySQL: LOAD DATA LOCAL INFILE vào bảng staging rồi INSERT ... SELECT ... ON DUPLICATE KEY UPDATE;
+    SQLite: executemany vào staging rồi INSERT ... SELECT ... ON CONFLICT;
+    dialect khác: bulk writer thông thường.
+    """
+    init_db()
+    chunk_rows = chunk_rows or IMPORT_CHUNK_ROWS
+    dialect = import_engine.dialect.name
+    totals = {"rows": 0, "inserted": 0, "updated": 0, "rejected": 0, "ok": True}
+    state = {'load_data': dialect == 'mysql'}
+
+    use_staging = dialect in ('mysql', 'sqlite')
+    if use_staging:
+        state['table'] = new_staging_table()
+        state['table'].create(import_engine)
+    session = ImportSession()
+    if dialect == 'sqlite':
+        # Import là thao tác chạy lại được -> bỏ fsync mỗi commit
+        session.execute(text("PRAGMA synchronous = OFF"))
+
+    print(f"=== IMPORT {len(paths)} file, chunk {chunk_rows} dòng, DB {dialect} ===")
+    started = time.time()
+    try:
+        for path in paths:
+            file_rows = 0
+            for df in read_catalog_chunks(path, chunk_rows):
+                columns, _ = validate_columns(catalog_frame_to_columns(df))
+                if use_staging:
+                    inserted, updated = import_catalog_chunk(session, dialect, columns, state)
+                else:
+                    result = bulk_save_rows(columns_to_rows(columns))
+                    inserted, updated = result['inserted'], result['updated']
+                    totals['ok'] = totals['ok'] and result['ok']
+
+                file_rows += len(df)
+                totals["rows"] += len(df)
+                totals["inserted"] += inserted
+                totals["updated"] += updated
+                # Dòng bị loại: không hợp lệ hoặc trùng id trong chunk
+                totals["rejected"] += len(df) - len(columns['id'])
+                elapsed = time.time() - started
+                print(f"-> {os.path.basename(path)}: {file_rows} dòng | tổng {totals['rows']} "
+                      f"({totals['rows'] / elapsed if elapsed > 0 else 0:.0f} dòng/s), "
+                      f"mới {totals['inserted']}, cập nhật {totals['updated']}, bỏ {totals['rejected']}")
+    except (SQLAlchemyError, RuntimeError, OSError, ValueError) as e:
+        session.rollback()
+        totals["ok"] = False
+        print(f"Lỗi khi import: {e}")
+    finally:
+        if dialect == 'sqlite':
+            session.execute(text("PRAGMA synchronous = FULL"))
+        session.close()
+        if use_staging:
+            state['table'].drop(import_engine, checkfirst=True)
+
+    elapsed = time.time() - started
+    print(f"-> Import xong: {totals['rows']} dòng trong {elapsed:.1f}s "
+          f"({totals['rows'] / elapsed if elapsed > 0 else 0:.0f} dòng/s)")
+    return totals
+
 def fetch_historical_data():
     """
     Lấy dữ liệu lịch sử từ nhiều nguồn USGS để có đủ dữ liệu phân tích
     """
     urls = [
-        "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_week.geojson",
-        "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson"
+        SUMMARY_FEED_URL.format("all_week"),
+        SUMMARY_FEED_URL.format("all_month")
     ]
     
     all_data = []
@@ -38,9 +736,9 @@ def fetch_historical_data():
     for url in urls:
         try:
             print(f"[{datetime.now()}] Đang lấy dữ liệu từ {url}...")
-            response = requests.get(url)
+            response = http_get(url)
             if response.status_code == 200:
-                data = response.json()
+                data = response_json(response)
                 if data and 'features' in data:
                     all_data.extend(data['features'])
                     print(f"-> Lấy được {len(data['features'])} records")
@@ -54,7 +752,7 @@ def fetch_custom_range_data(start_date="2025-01-01", end_date="2025-12-01"):
     Lấy dữ liệu trong khoảng thời gian tùy chỉnh từ USGS
     """
     # USGS Query API với custom date range
-    query_url = "https://earthquake.usgs.gov/fdsnws/event/1/query"
+    query_url = FDSN_QUERY_URL
     params = {
         'format': 'geojson',
         'starttime': start_date,
@@ -65,9 +763,9 @@ def fetch_custom_range_data(start_date="2025-01-01", end_date="2025-12-01"):
     
     try:
         print(f"[{datetime.now()}] Đang lấy dữ liệu khoảng thời gian tùy chỉnh: {start_date} đến {end_date}")
-        response = requests.get(query_url, params=params)
+        response = http_get(query_url, params=params)
         if response.status_code == 200:
-            data = response.json()
+            data = response_json(response)
             print(f"-> Lấy được {len(data.get('features', []))} records cho khoảng thời gian tùy chỉnh")
             return data
         else:
@@ -82,78 +780,663 @@ def load_specific_year_data():
     Load dữ liệu từ 1/1/2025 đến 1/12/2025 (11 tháng đầu năm)
     """
     print("=== ĐANG TẢI DỮ LIỆU NĂM 2025 (Tháng 1 đến Tháng 11) ===")
-    init_db()
-    
-    # Chia nhỏ thành các tháng để tránh timeout và lấy tất cả dữ liệu
-    months = [
-        ("2025-01-01", "2025-02-01"),
-        ("2025-02-01", "2025-03-01"), 
-        ("2025-03-01", "2025-04-01"),
-        ("2025-04-01", "2025-05-01"),
-        ("2025-05-01", "2025-06-01"),
-        ("2025-06-01", "2025-07-01"),
-        ("2025-07-01", "2025-08-01"),
-        ("2025-08-01", "2025-09-01"),
-        ("2025-09-01", "2025-10-01"),
-        ("2025-10-01", "2025-11-01"),
-        ("2025-11-01", "2025-12-01")
-    ]
-    
-    total_records = 0
-    for start, end in months:
-        print(f"\n--- Loading {start} to {end} ---")
-        data = fetch_custom_range_data(start, end)
-        if data:
-            process_and_save(data)
-            total_records += len(data.get('features', []))
-        time.sleep(2)  # Tránh spam USGS API
-    
-    print(f"✅ Đã tải {total_records} records từ 1/1/2025 đến 1/12/2025")
-    
-def process_and_save(data):
-    if not data or 'features' not in data:
+    result = run_backfill(datetime(2025, 1, 1), datetime(2025, 12, 1))
+    print(f"✅ Đã tải {result['fetched']} records từ 1/1/2025 đến 1/12/2025")
+
+def split_range(start, end, step):
+    chunks = []
+    current = start
+    while current < end:
+        chunk_end = min(current + step, end)
+        chunks.append((current, chunk_end))
+        current = chunk_end
+    return chunks
+
+def fetch_range_chunk(start, end, min_magnitude=None):
+    """
+    Lấy 1 chunk thời gian từ FDSN. Trả về (data, capped):
+    capped = True nếu kết quả chạm giới hạn FDSN_MAX_EVENTS (cần chia nhỏ chunk).
+    data = None nếu lỗi.
+    """
+    params = {
+        'format': 'geojson',
+        'starttime': start.strftime(FDSN_TIME_FORMAT),
+        'endtime': end.strftime(FDSN_TIME_FORMAT),
+        'minmagnitude': BACKFILL_MIN_MAGNITUDE if min_magnitude is None else min_magnitude,
+        'limit': FDSN_MAX_EVENTS
+    }
+
+    try:
+        response = http_get(FDSN_QUERY_URL, params=params)
+        if response.status_code == 200:
+            data = response_json(response)
+            return data, len(data.get('features', [])) >= FDSN_MAX_EVENTS
+        if response.status_code == 204:
+            return {'features': []}, False
+        # FDSN trả 400 khi số event vượt quá giới hạn tìm kiếm
+        if response.status_code == 400 and 'limit' in response.text.lower():
+            return {'features': []}, True
+        print(f"Lỗi chunk {params['starttime']} -> {params['endtime']}: Status {response.status_code}")
+    except Exception as e:
+        print(f"Lỗi chunk {params['starttime']} -> {params['endtime']}: {e}")
+
+    return None, False
+
+def fetch_chunk_timed(start, end):
+    started = time.time()
+    data, capped = fetch_range_chunk(start, end)
+    return data, capped, time.time() - started
+
+def load_done_ranges(start, end, min_magnitude):
+    """
+    Các khoảng thời gian đã backfill xong (status 'done') giao với [start, end)
+    """
+    session = SessionLocal()
+    try:
+        query = session.query(BackfillCheckpoint.range_start, BackfillCheckpoint.range_end).filter(
+            BackfillCheckpoint.status == 'done',
+            BackfillCheckpoint.min_magnitude == min_magnitude,
+            BackfillCheckpoint.range_end > start,
+            BackfillCheckpoint.range_start < end
+        ).order_by(BackfillCheckpoint.range_start)
+        return [(s, e) for s, e in query]
+    finally:
+        session.close()
+
+def is_range_covered(done_ranges, start, end):
+    # done_ranges đã sắp xếp theo range_start
+    covered_until = start
+    for range_start, range_end in done_ranges:
+        if range_start > covered_until:
+            break
+        covered_until = max(covered_until, range_end)
+        if covered_until >= end:
+            return True
+    return covered_until >= end
+
+def record_checkpoint(start, end, min_magnitude, status, row_count=0, duration=None, error=None):
+    session = SessionLocal()
+    try:
+        checkpoint = session.query(BackfillCheckpoint).filter(
+            BackfillCheckpoint.range_start == start,
+            BackfillCheckpoint.range_end == end,
+            BackfillCheckpoint.min_magnitude == min_magnitude
+        ).first()
+        if checkpoint is None:
+            checkpoint = BackfillCheckpoint(range_start=start, range_end=end, min_magnitude=min_magnitude)
+            session.add(checkpoint)
+        checkpoint.status = status
+        checkpoint.row_count = row_count
+        checkpoint.duration = duration
+        checkpoint.error = error
+        checkpoint.updated_at = datetime.utcnow()
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi lưu checkpoint: {e}")
+    finally:
+        session.close()
+
+def fetch_stage(item, done_ranges):
+    """
+    Stage fetch: tải 1 chunk; chạm giới hạn 20.000 event thì tự chia đôi và tải
+    tiếp 2 nửa, yield từng chunk đã tải xong cho stage decode
+    """
+    chunk_start, chunk_end = item['start'], item['end']
+    data, capped, fetch_seconds = fetch_chunk_timed(chunk_start, chunk_end)
+
+    if data is not None and capped and chunk_end - chunk_start > BACKFILL_MIN_CHUNK:
+        half = timedelta(seconds=int((chunk_end - chunk_start).total_seconds() // 2))
+        middle = chunk_start + half
+        print(f"-> Chunk {chunk_start} -> {chunk_end} chạm giới hạn {FDSN_MAX_EVENTS}, chia đôi")
+        for sub_start, sub_end in ((chunk_start, middle), (middle, chunk_end)):
+            if not is_range_covered(done_ranges, sub_start, sub_end):
+                yield from fetch_stage({'start': sub_start, 'end': sub_end}, done_ranges)
         return
 
+    if capped:
+        print(f"⚠️ Chunk {chunk_start} -> {chunk_end} vẫn chạm giới hạn, có thể thiếu dữ liệu")
+    features = data.get('features', []) if data is not None else []
+    yield {
+        'start': chunk_start, 'end': chunk_end, 'features': features, 'count': len(features),
+        'seconds': fetch_seconds, 'error': None if data is not None else "fetch failed"
+    }
+
+def decode_stage(item):
+    # Stage decode: feature GeoJSON -> dạng cột, bỏ list feature gốc để giải phóng RAM.
+    # Lỗi (vd. geometry null, mag không phải số) -> đánh dấu item lỗi như fetch, write ghi checkpoint 'failed'
+    started = time.time()
+    if not item.get('error'):
+        try:
+            item['columns'] = decode_features(item.pop('features'))
+        except Exception as e:
+            item['error'] = f"decode failed: {e}"
+    item['seconds'] = item.get('seconds', 0) + time.time() - started
+    yield item
+
+def validate_stage(item):
+    started = time.time()
+    if not item.get('error'):
+        try:
+            item['columns'], item['rejected'] = validate_columns(item['columns'])
+        except Exception as e:
+            item['error'] = f"validate failed: {e}"
+    item['seconds'] = item.get('seconds', 0) + time.time() - started
+    yield item
+
+def pipeline_size(item):
+    return item.get('count', 0)
+
+def run_backfill(start, end, chunk_days=None, workers=None):
+    """
+    Backfill khoảng [start, end) qua pipeline fetch -> decode -> validate -> write
+    (queue có giới hạn giữa các stage: DB chậm thì fetch tự chậm lại).
+    Fetch song song theo chunk, chia đôi các chunk chạm giới hạn 20.000 event.
+    Mỗi chunk được ghi checkpoint, chạy lại cùng lệnh sẽ bỏ qua các chunk đã xong.
+    """
+    init_db()
+    chunk = timedelta(days=chunk_days or BACKFILL_CHUNK_DAYS)
+    workers = workers or BACKFILL_WORKERS
+    min_magnitude = BACKFILL_MIN_MAGNITUDE
+
+    done_ranges = load_done_ranges(start, end, min_magnitude)
+    all_chunks = split_range(start, end, chunk)
+    chunks = [(s, e) for s, e in all_chunks if not is_range_covered(done_ranges, s, e)]
+
+    print(f"=== BACKFILL {start} -> {end}: {len(chunks)} chunks "
+          f"({len(all_chunks) - len(chunks)} đã xong, bỏ qua), {workers} fetch workers ===")
+    started = time.time()
+    totals = {"fetched": 0, "inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0, "chunks": 0,
+              "skipped": len(all_chunks) - len(chunks), "failed": []}
+    totals_lock = threading.Lock()
+    cycle = ingest_metrics.start_cycle('backfill')
+
+    def write_stage(item):
+        chunk_start, chunk_end = item['start'], item['end']
+        if item.get('error'):
+            with totals_lock:
+                totals["failed"].append((chunk_start, chunk_end))
+            record_checkpoint(chunk_start, chunk_end, min_magnitude, 'failed',
+                              duration=item['seconds'], error=item['error'])
+            return
+
+        write_started = time.time()
+        columns = item['columns']
+        result = save_columns(columns) if columns['id'] else {"ok": True}
+        duration = item['seconds'] + (time.time() - write_started)
+
+        if not result.get('ok'):
+            with totals_lock:
+                totals["failed"].append((chunk_start, chunk_end))
+            record_checkpoint(chunk_start, chunk_end, min_magnitude, 'failed',
+                              row_count=item['count'], duration=duration, error="write failed")
+            return
+
+        with totals_lock:
+            totals["fetched"] += item['count']
+            totals["rejected"] += item.get('rejected', 0)
+            totals["chunks"] += 1
+            for key in ("inserted", "updated", "unchanged"):
+                totals[key] += result.get(key) or 0
+        record_checkpoint(chunk_start, chunk_end, min_magnitude, 'done',
+                          row_count=item['count'], duration=duration)
+        yield from ()
+
+    totals["stages"] = run_pipeline(
+        ({'start': s, 'end': e} for s, e in chunks),
+        [
+            ('fetch', lambda item: fetch_stage(item, done_ranges), workers),
+            ('decode', decode_stage, INGEST_DECODE_WORKERS),
+            ('validate', validate_stage, INGEST_VALIDATE_WORKERS),
+            ('write', write_stage, INGEST_WRITE_WORKERS),
+        ],
+        source_name='chunks', size_of=pipeline_size
+    )
+
+    # Lỗi không bắt được trong stage (item bị bỏ, không có checkpoint) cũng làm lần chạy thất bại
+    stage_errors = sum(stage['errors'] for stage in totals["stages"])
+    totals["ok"] = not totals["failed"] and not stage_errors
+    ingest_metrics.finish_cycle(cycle, totals)
+
+    elapsed = time.time() - started
+    rate = totals["fetched"] / elapsed if elapsed > 0 else 0
+    stage_note = f", {stage_errors} lỗi stage" if stage_errors else ""
+    print(f"-> Backfill xong: {totals['fetched']} events, {totals['chunks']} chunks, "
+          f"{len(totals['failed'])} lỗi{stage_note}, {totals['rejected']} dòng không hợp lệ, {elapsed:.1f}s ({rate:.0f} events/s)")
+    for chunk_start, chunk_end in totals["failed"]:
+        print(f"   Chunk lỗi: {chunk_start} -> {chunk_end}")
+    return totals
+
+def feature_to_row(item):
+    """
+    Chuyển 1 feature GeoJSON của USGS thành dict cột của bảng earthquakes
+    """
+    props = item['properties']
+    geom = item['geometry']
+
+    # Chuyển đổi timestamp (ms) sang datetime UTC (naive), cùng múi giờ với rollup và các query của API
+    # Lưu ý: USGS trả về milisecond, Python cần second
+    time_dt = utc_datetime(props['time']) if props['time'] else None
+    updated_dt = utc_datetime(props['updated']) if props['updated'] else None
+
+    geohash = encode(geom['coordinates'][1], geom['coordinates'][0])
+    return {
+        'id': item['id'],
+        'place': props.get('place'),
+        'magnitude': props.get('mag'),
+        'mag_type': props.get('magType'),
+        'time': time_dt,
+        'updated': updated_dt,
+        'url': props.get('url'),
+        'status': props.get('status'),
+        'tsunami': props.get('tsunami'),
+        # Geometry coordinates: [longitude, latitude, depth]
+        'longitude': geom['coordinates'][0],
+        'latitude': geom['coordinates'][1],
+        'depth': geom['coordinates'][2],
+        'geohash': geohash,
+        'geohash_4': geohash[:4] if geohash else None,
+        'geohash_2': geohash[:2] if geohash else None,
+    }
+
+def utc_datetime(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000.0, timezone.utc).replace(tzinfo=None)
+
+def epoch_ms_to_datetimes(values):
+    """
+    Chuyển mảng epoch ms (NaN = thiếu) sang datetime64[us] UTC, 1 phép tính cho cả mảng
+    """
+    values = np.asarray(values, dtype='float64')
+    result = np.full(values.shape, np.datetime64('NaT'), dtype='datetime64[us]')
+    valid = ~np.isnan(values)
+    if valid.any():
+        ms = values[valid]
+        micros = np.round(ms * 1000).astype('int64')
+        result[valid] = micros.astype('datetime64[us]')
+    return result
+
+def decode_features(features):
+    """
+    Decode 1 batch feature GeoJSON thành dạng cột (columnar):
+    id/text là list, số là mảng float64 (NaN = thiếu), thời gian là datetime64.
+    Dùng chung cho change detection và bulk writer, không tạo object ORM.
+    """
+    started = time.time()
+    props = [item['properties'] for item in features]
+    try:
+        coords = np.array([item['geometry']['coordinates'] for item in features], dtype='float64').reshape(-1, 3)
+    except ValueError:
+        # Có feature thiếu depth -> đệm cho đủ 3 phần tử
+        coords = np.array(
+            [(item['geometry']['coordinates'] + [None, None, None])[:3] for item in features],
+            dtype='float64'
+        ).reshape(-1, 3)
+    time_ms = np.array([p.get('time') for p in props], dtype='float64')
+    updated_ms = np.array([p.get('updated') for p in props], dtype='float64')
+
+    columns = {
+        'id': [item['id'] for item in features],
+        'place': [p.get('place') for p in props],
+        'magnitude': np.array([p.get('mag') for p in props], dtype='float64'),
+        'mag_type': [p.get('magType') for p in props],
+        'url': [p.get('url') for p in props],
+        'status': [p.get('status') for p in props],
+        'tsunami': [p.get('tsunami') for p in props],
+        # Geometry coordinates: [longitude, latitude, depth]
+        'longitude': coords[:, 0],
+        'latitude': coords[:, 1],
+        'depth': coords[:, 2],
+        'time_ms': time_ms,
+        'updated_ms': updated_ms,
+        'time': epoch_ms_to_datetimes(time_ms),
+        'updated': epoch_ms_to_datetimes(updated_ms),
+    }
+    ingest_metrics.record('decode_seconds', time.time() - started)
+    return columns
+
+def float_list(values):
+    # NaN -> None cho driver DB
+    return [None if v != v else v for v in values.tolist()]
+
+def select_columns(columns, mask):
+    # Chỉ giữ các dòng trong mask (bool array) của batch dạng cột
+    index = np.flatnonzero(mask)
+    pick = lambda values: [values[i] for i in index]
+    return {
+        key: (values[index] if isinstance(values, np.ndarray) else pick(values))
+        for key, values in columns.items()
+    }
+
+def validate_columns(columns):
+    """
+    Loại các dòng không ghi được: thiếu id / time, toạ độ ngoài khoảng hợp lệ.
+    Trả về (batch dạng cột chỉ gồm dòng hợp lệ, số dòng bị loại)
+    """
+    mask = np.array([bool(event_id) for event_id in columns['id']], dtype=bool)
+    mask &= ~np.isnat(columns['time'])
+    # NaN (thiếu toạ độ) vẫn hợp lệ, so sánh với NaN luôn False
+    mask &= ~(np.abs(columns['latitude']) > 90)
+    mask &= ~(np.abs(columns['longitude']) > 180)
+
+    rejected = int(len(mask) - mask.sum())
+    if rejected:
+        columns = select_columns(columns, mask)
+    return columns, rejected
+
+def columns_to_rows(columns, mask=None):
+    """
+    Chuyển batch dạng cột thành list dict cho executemany (chỉ các dòng trong mask)
+    """
+    if mask is not None:
+        columns = select_columns(columns, mask)
+
+    data = {
+        'id': columns['id'],
+        'place': columns['place'],
+        'magnitude': float_list(columns['magnitude']),
+        'mag_type': columns['mag_type'],
+        'time': columns['time'].tolist(),
+        'updated': columns['updated'].tolist(),
+        'url': columns['url'],
+        'status': columns['status'],
+        'tsunami': columns['tsunami'],
+        'longitude': float_list(columns['longitude']),
+        'latitude': float_list(columns['latitude']),
+        'depth': float_list(columns['depth']),
+        **geohash_columns(columns['latitude'], columns['longitude']),
+    }
+    keys = list(data.keys())
+    return [dict(zip(keys, values)) for values in zip(*data.values())]
+
+def upsert_batch(session, rows):
+    """
+    Ghi 1 batch bằng một câu INSERT nhiều dòng:
+    - MySQL: INSERT ... ON DUPLICATE KEY UPDATE
+    - SQLite: INSERT ... ON CONFLICT(id) DO UPDATE
+    - Dialect khác: INSERT các dòng mới + bulk UPDATE theo primary key
+    Trả về (list id insert, list id update, list time cũ của các event update).
+    """
+    # Gộp các feature trùng id trong cùng batch (giữ bản cuối cùng)
+    rows = list({row['id']: row for row in rows}.values())
+    if not rows:
+        return [], [], []
+
+    # 1 câu SELECT (id, time) đã lưu: đếm chính xác insert/update, và time cũ để tính lại
+    # rollup của giờ cũ khi USGS đổi time của event
+    stored_times = dict(session.query(Earthquake.id, Earthquake.time).filter(
+        Earthquake.id.in_([row['id'] for row in rows])))
+    existing = set(stored_times)
+
+    table = Earthquake.__table__
+    dialect = session.get_bind().dialect.name
+    moved = set()
+    if dialect != 'sqlite' and existing:
+        moved = remove_moved_rows(session, rows, stored_times)
+
+    # Truyền rows dạng executemany thay vì .values(rows): tránh compile 1 câu SQL
+    # hàng nghìn tham số mỗi batch, PyMySQL vẫn gộp thành INSERT nhiều dòng
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        stmt = stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in UPSERT_COLUMNS})
+        session.execute(stmt, rows)
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={col: stmt.excluded[col] for col in UPSERT_COLUMNS}
+        )
+        session.execute(stmt, rows)
+    else:
+        # Bulk UPDATE khớp theo PK (id, time): event đổi time đã bị xoá ở trên -> insert lại
+        new_rows = [row for row in rows if row['id'] not in existing or row['id'] in moved]
+        old_rows = [row for row in rows if row['id'] in existing and row['id'] not in moved]
+        if new_rows:
+            session.execute(table.insert(), new_rows)
+        if old_rows:
+            session.execute(update(Earthquake), old_rows)
+
+    inserted_ids = [row['id'] for row in rows if row['id'] not in existing]
+    updated_ids = [row['id'] for row in rows if row['id'] in existing]
+    return inserted_ids, updated_ids, [stored_times[quake_id] for quake_id in updated_ids]
+
+def mysql_datetime(dt):
+    # Giá trị MySQL DATETIME (không phần lẻ giây) sẽ lưu: làm tròn tới giây gần nhất
+    return (dt + timedelta(microseconds=500000)).replace(microsecond=0) if dt else None
+
+def remove_moved_rows(session, rows, stored_times):
+    """
+    Earthquake có PK (id, time): event đã có mà USGS đổi time sẽ không khớp ON DUPLICATE KEY /
+    UPDATE / merge theo PK -> xoá dòng cũ trước để id không bị trùng.
+    stored_times: map id -> time đang lưu của các event đã có
+    Trả về set id đã xoá.
+    """
+    # MySQL DATETIME làm tròn tới giây, dialect khác lưu nguyên giá trị
+    stored_value = mysql_datetime if session.get_bind().dialect.name == 'mysql' else (lambda dt: dt)
+    moved = [(row['id'], stored_times[row['id']]) for row in rows
+             if row['id'] in stored_times and stored_times[row['id']] != stored_value(row['time'])]
+    if moved:
+        session.execute(delete(Earthquake).where(tuple_(Earthquake.id, Earthquake.time).in_(moved)))
+    return {quake_id for quake_id, _ in moved}
+
+def updated_key(dt):
+    # MySQL DATETIME làm tròn tới giây nên chỉ so sánh ở mức giây
+    return int(dt.timestamp()) if dt else None
+
+def load_existing_updated(session, columns):
+    """
+    Load các cặp (id, updated) đã có trong DB cho khoảng thời gian của batch
+    bằng 1 câu query, trả về map id -> updated (epoch giây)
+    """
+    times = columns['time'][~np.isnat(columns['time'])]
+    if len(times) == 0:
+        return {}
+
+    query = session.query(Earthquake.id, Earthquake.updated).filter(
+        Earthquake.time >= times.min().item(),
+        Earthquake.time <= times.max().item()
+    )
+    return {quake_id: updated_key(updated) for quake_id, updated in query}
+
+def split_changed(columns, existing):
+    """
+    So sánh batch với map existing.
+    Trả về (mask các dòng cần ghi, số mới, số thay đổi, số không đổi).
+    """
+    is_new = np.array([quake_id not in existing for quake_id in columns['id']], dtype=bool)
+    old_keys = np.array([existing.get(quake_id) for quake_id in columns['id']], dtype='float64')
+    new_keys = np.floor(columns['updated_ms'] / 1000.0)
+
+    # Chỉ ghi khi bản mới hơn bản đã lưu (replay payload cũ không ghi đè dữ liệu mới hơn)
+    with np.errstate(invalid='ignore'):
+        changed = ~is_new & (np.isnan(old_keys) | np.isnan(new_keys) | (new_keys - old_keys >= 1))
+
+    to_write = is_new | changed
+    count_new = int(is_new.sum())
+    count_changed = int(changed.sum())
+    return to_write, count_new, count_changed, len(to_write) - count_new - count_changed
+
+def bulk_save_rows(rows, batch_size=None):
+    """
+    Ghi danh sách row theo từng batch, commit sau mỗi batch để không giữ
+    transaction dài trên bảng earthquakes. Mỗi batch ghi kèm 1 bản ghi change_outbox
+    trong cùng transaction. Trả về dict đếm inserted/updated.
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
     session = SessionLocal()
     count_new = 0
     count_update = 0
+    # max(updated) của các batch đã commit thành công, dùng để đẩy watermark
+    max_updated = None
+    ok = True
+
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            inserted_ids, updated_ids, old_times = upsert_batch(session, batch)
+            times = [row['time'] for row in batch if row['time']]
+            publish_change(session, OUTBOX_SOURCE, inserted_ids, updated_ids,
+                           min(times, default=None), max(times, default=None))
+            # Rollup chỉ tính lại cho các giờ có event thực sự được ghi, kể cả giờ cũ của event đổi time
+            changed = set(inserted_ids) | set(updated_ids)
+            refresh_rollups(session, [row['time'] for row in batch if row['id'] in changed] + old_times)
+            session.commit()
+            count_new += len(inserted_ids)
+            count_update += len(updated_ids)
+            batch_max = max((row['updated'] for row in batch if row['updated']), default=None)
+            if batch_max and (max_updated is None or batch_max > max_updated):
+                max_updated = batch_max
+    except SQLAlchemyError as e:
+        session.rollback()
+        ok = False
+        print(f"Lỗi Cơ sở dữ liệu: {e}")
+    finally:
+        session.close()
+
+    return {"inserted": count_new, "updated": count_update, "max_updated": max_updated, "ok": ok}
+
+def process_and_save(data, batch_size=None):
+    if not data or 'features' not in data:
+        return
+
+    if INGEST_WRITE_MODE == 'merge':
+        with ingest_metrics.timed('write_seconds'):
+            return merge_and_save(data)
 
     try:
         features = data['features']
-        for item in features:
-            props = item['properties']
-            geom = item['geometry']
-            
-            quake_id = item['id']
-            
-            # Chuyển đổi timestamp (ms) sang datetime
-            # Lưu ý: USGS trả về milisecond, Python cần second
-            time_dt = datetime.fromtimestamp(props['time'] / 1000.0) if props['time'] else None
-            updated_dt = datetime.fromtimestamp(props['updated'] / 1000.0) if props['updated'] else None
-            
-            # Tạo object Earthquake
-            earthquake = Earthquake(
-                id=quake_id,
-                place=props.get('place'),
-                magnitude=props.get('mag'),
-                mag_type=props.get('magType'),
-                time=time_dt,
-                updated=updated_dt,
-                url=props.get('url'),
-                status=props.get('status'),
-                tsunami=props.get('tsunami'),
-                # Geometry coordinates: [longitude, latitude, depth]
-                longitude=geom['coordinates'][0],
-                latitude=geom['coordinates'][1],
-                depth=geom['coordinates'][2]
-            )
+        columns, rejected = validate_columns(decode_features(features))
+    except Exception as e:
+        print(f"General Error: {e}")
+        return {"inserted": 0, "updated": 0, "unchanged": 0, "max_updated": None, "ok": False}
+
+    result = save_columns(columns, batch_size)
+    result["rejected"] = rejected
+    rejected_note = f", không hợp lệ: {rejected}" if rejected else ""
+    if not result['ok']:
+        print(f"❌ Lỗi khi ghi {len(features)} records "
+              f"(đã ghi trước lỗi - mới: {result['inserted']}, cập nhật: {result['updated']}).")
+        return result
+    print(f"-> Thành công xử lý {len(features)} records "
+          f"(mới: {result['inserted']}, cập nhật: {result['updated']}, không đổi: {result['unchanged']}{rejected_note}).")
+    return result
+
+def save_columns(columns, batch_size=None):
+    """
+    Ghi 1 batch dạng cột: bỏ qua event có updated giống bản đã lưu, ghi phần còn lại theo batch
+    """
+    with ingest_metrics.timed('write_seconds'):
+        session = SessionLocal()
+        try:
+            existing = load_existing_updated(session, columns)
+        except SQLAlchemyError as e:
+            print(f"Lỗi Cơ sở dữ liệu: {e}")
+            return {"inserted": 0, "updated": 0, "unchanged": 0, "max_updated": None, "ok": False}
+        finally:
+            session.close()
+
+        to_write, _, _, count_unchanged = split_changed(columns, existing)
+        result = bulk_save_rows(columns_to_rows(columns, to_write), batch_size)
+    result["unchanged"] = count_unchanged
+    return result
+
+def add_result(totals, result):
+    for key in ("inserted", "updated", "unchanged"):
+        totals[key] += result.get(key) or 0
+    if result.get('max_updated') and (totals['max_updated'] is None or result['max_updated'] > totals['max_updated']):
+        totals['max_updated'] = result['max_updated']
+    totals['ok'] = totals['ok'] and result.get('ok', False)
+
+def feature_batches(features, batch_size):
+    # Gom luồng feature thành các batch cố định cho pipeline
+    batch = []
+    for feature in features:
+        batch.append(feature)
+        if len(batch) >= batch_size:
+            yield {'features': batch, 'count': len(batch)}
+            batch = []
+    if batch:
+        yield {'features': batch, 'count': len(batch)}
+
+def save_feature_stream(features, batch_size=None):
+    """
+    Ghi 1 luồng feature (vd. từ stream_features) qua pipeline decode -> validate -> write:
+    đọc/parse batch kế tiếp trong lúc batch trước đang ghi, queue giới hạn nên
+    bộ nhớ chỉ giữ vài batch tại một thời điểm
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0, "max_updated": None, "ok": True, "fetched": 0}
+    totals_lock = threading.Lock()
+
+    def write_stage(item):
+        if item.get('error'):
+            print(f"Lỗi batch {item['count']} records: {item['error']}")
+            with totals_lock:
+                totals['ok'] = False
+                totals["fetched"] += item['count']
+            return
+        result = save_columns(item['columns'], batch_size)
+        with totals_lock:
+            add_result(totals, result)
+            totals["fetched"] += item['count']
+            totals["rejected"] += item.get('rejected', 0)
+        yield from ()
+
+    stages = run_pipeline(
+        feature_batches(features, batch_size),
+        [
+            ('decode', decode_stage, INGEST_DECODE_WORKERS),
+            ('validate', validate_stage, INGEST_VALIDATE_WORKERS),
+            ('write', write_stage, INGEST_WRITE_WORKERS),
+        ],
+        source_name='fetch', size_of=pipeline_size
+    )
+    # Lỗi đọc stream / decode / ghi -> không đẩy watermark
+    if any(stage['errors'] for stage in stages):
+        totals['ok'] = False
+    totals["stages"] = stages
 
+    rejected_note = f", không hợp lệ: {totals['rejected']}" if totals['rejected'] else ""
+    print(f"-> Stream: xử lý {totals['fetched']} records "
+          f"(mới: {totals['inserted']}, cập nhật: {totals['updated']}, không đổi: {totals['unchanged']}{rejected_note}).")
+    return totals
+
+def merge_and_save(data):
+    """
+    Cách ghi cũ: session.merge từng feature (SELECT rồi INSERT/UPDATE mỗi dòng)
+    """
+    session = SessionLocal()
+    max_updated = None
+    ok = False
+
+    try:
+        features = data['features']
+        # time đang lưu của các event sẽ bị ghi đè: USGS đổi time -> giờ cũ cũng phải tính lại rollup
+        stored_times = dict(session.query(Earthquake.id, Earthquake.time).filter(
+            Earthquake.id.in_([item['id'] for item in features])))
+        old_times = list(stored_times.values())
+        batch = [feature_to_row(item) for item in features]
+        # merge tìm theo PK (id, time): event đổi time phải xoá dòng cũ, không thì merge insert trùng id
+        remove_moved_rows(session, batch, stored_times)
+        rows = []
+        for row in batch:
             # Dùng merge: Nếu ID tồn tại -> Update, Nếu chưa -> Insert
             # Điều này xử lý tốt việc USGS cập nhật lại thông tin động đất cũ
-            session.merge(earthquake)
-            count_new += 1 # Ở đây đếm chung processed, tách insert/update cần check db trước hơi tốn resource
+            session.merge(Earthquake(**row))
+            rows.append(row)
+            if row['updated'] and (max_updated is None or row['updated'] > max_updated):
+                max_updated = row['updated']
 
+        # merge không phân biệt insert/update -> báo tất cả là updated
+        times = [row['time'] for row in rows if row['time']]
+        publish_change(session, OUTBOX_SOURCE, [], [row['id'] for row in rows],
+                       min(times, default=None), max(times, default=None))
+        # Session không autoflush: ghi các merge xuống DB trước khi tính rollup bằng SQL
+        session.flush()
+        refresh_rollups(session, times + old_times)
         session.commit()
+        ok = True
         print(f"-> Thành công xử lý {len(features)} records.")
         
     except SQLAlchemyError as e:
@@ -164,6 +1447,9 @@ def process_and_save(data):
     finally:
         session.close()
 
+    # merge không phân biệt được insert/update
+    return {"inserted": None, "updated": None, "unchanged": None, "max_updated": max_updated, "ok": ok}
+
 def load_jan_to_dec_2025():
     """
     Lấy toàn bộ dữ liệu từ 1/1/2025 đến 1/12/2025 (không giới hạn records)
@@ -173,6 +1459,16 @@ def load_jan_to_dec_2025():
     
     # Load toàn bộ khoảng thời gian một lần
     print("Fetching complete year data without limit...")
+    if INGEST_STREAMING:
+        params = {'format': 'geojson', 'starttime': "2025-01-01", 'endtime': "2025-12-01", 'minmagnitude': 1.0}
+        result = save_feature_stream(stream_features(FDSN_QUERY_URL, params))
+        if result['ok'] and result['fetched']:
+            print(f"✅ Successfully loaded {result['fetched']} records from 1/1/2025 to 1/12/2025")
+            return
+        print("❌ Stream lỗi, thử tải theo từng chunk...")
+        load_specific_year_data()
+        return
+
     data = fetch_custom_range_data("2025-01-01", "2025-12-01")
     
     if data and data.get('features'):
@@ -199,16 +1495,133 @@ def run_initial_load():
         print("✅ Đã tải dữ liệu lịch sử thành công!")
     else:
         print("❌ Không thể tải dữ liệu lịch sử")
+def load_watermark():
+    """
+    Đọc watermark (max Earthquake.updated đã lưu) và thời điểm full sync gần nhất
+    """
+    session = SessionLocal()
+    try:
+        watermark = get_ingest_state(session, WATERMARK_KEY)
+        last_full = get_ingest_state(session, LAST_FULL_SYNC_KEY)
+        watermark = datetime.fromisoformat(watermark) if watermark else None
+        if watermark is None and last_full:
+            # Full sync trước đó nhận 304 / không ghi gì -> lấy watermark từ dữ liệu đã lưu
+            watermark = session.query(func.max(Earthquake.updated)).scalar()
+        return watermark, datetime.fromisoformat(last_full) if last_full else None
+    finally:
+        session.close()
+
+def save_watermark(max_updated, full_sync=False):
+    session = SessionLocal()
+    try:
+        current = get_ingest_state(session, WATERMARK_KEY)
+        if max_updated and (not current or max_updated > datetime.fromisoformat(current)):
+            set_ingest_state(session, WATERMARK_KEY, max_updated.isoformat())
+        if full_sync:
+            set_ingest_state(session, LAST_FULL_SYNC_KEY, datetime.utcnow().isoformat())
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi lưu watermark: {e}")
+    finally:
+        session.close()
+
+def incremental_source(watermark):
+    """
+    Chọn nguồn nhỏ nhất đủ phủ khoảng thời gian từ watermark tới hiện tại.
+    Trả về (url, params); params = None với summary feed.
+    """
+    feed = SUMMARY_FEEDS.get(INGEST_INCREMENTAL_SOURCE)
+    if feed:
+        url, window = feed
+        if datetime.utcnow() - watermark < window - WATERMARK_OVERLAP:
+            return url, None
+    return FDSN_QUERY_URL, updated_since_params(watermark)
+
+def fetch_incremental(watermark):
+    url, params = incremental_source(watermark)
+    if params is None:
+        return fetch_summary_feed(url)
+    return fetch_updated_since(watermark)
+
+def run_ingest_cycle():
+    """
+    1 chu kỳ ingest: full all_month nếu chưa có watermark hoặc tới hạn reconcile,
+    ngược lại chỉ lấy các event thay đổi sau watermark
+    """
+    watermark, last_full = load_watermark()
+    full_sync = (
+        watermark is None or last_full is None
+        or (datetime.utcnow() - last_full).total_seconds() >= FULL_RECONCILE_INTERVAL
+    )
+
+    url, params = (USGS_API_URL, None) if full_sync else incremental_source(watermark)
+    cycle = ingest_metrics.start_cycle('full' if full_sync else 'incremental')
+    if INGEST_STREAMING and INGEST_WRITE_MODE != 'merge':
+        result = save_feature_stream(stream_features(url, params))
+    else:
+        data = fetch_usgs_data() if full_sync else fetch_incremental(watermark)
+        result = process_and_save(data) if data is not None else None
+    ingest_metrics.finish_cycle(cycle, result)
+
+    if result and result.get('ok'):
+        save_watermark(result.get('max_updated'), full_sync=full_sync)
+    else:
+        forget_validators(url)
+    cleanup_outbox()
+    ingest_metrics.cleanup_metrics()
+    if full_sync:
+        run_storage_maintenance()
+    return result
+
+def cleanup_outbox():
+    # Xoá các bản ghi outbox cũ hơn OUTBOX_RETENTION_DAYS (consumer đã đọc từ lâu)
+    session = SessionLocal()
+    try:
+        removed = prune_outbox(session, OUTBOX_RETENTION_DAYS)
+        session.commit()
+        if removed:
+            print(f"-> Đã xoá {removed} bản ghi change_outbox cũ")
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi dọn change_outbox: {e}")
+    finally:
+        session.close()
+
+def run_storage_maintenance(retention_months=None):
+    # Partition các tháng tới (MySQL) + chuyển các tháng quá EARTHQUAKE_RETENTION_MONTHS sang archive
+    try:
+        return earthquake_archive.run_retention(retention_months)
+    except (SQLAlchemyError, OSError, ValueError) as e:
+        print(f"Lỗi khi archive dữ liệu cũ: {e}")
+        return None
+
+def run_rollup_rebuild(start=None, end=None):
+    """
+    Tính lại bảng rollup giờ/ngày cho [start, end] (mặc định toàn bộ dữ liệu),
+    vd. sau khi sửa dữ liệu trực tiếp trong DB
+    """
+    init_db()
+    session = SessionLocal()
+    started = time.time()
+    try:
+        days = rebuild_rollups(session, start, end)
+        print(f"-> Rollup xong: {days} ngày trong {time.time() - started:.1f}s")
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi tính lại rollup: {e}")
+    finally:
+        session.close()
+
 def run_service():
     # Đảm bảo bảng đã được tạo trước khi chạy service
     init_db()
     print("Service Data Ingestion Started...")
     print("---------------------------------")
+    ingest_metrics.start_metrics_server()
 
     while True:
-        data = fetch_usgs_data()
-        if data:
-            process_and_save(data)
+        run_ingest_cycle()
         
         print(f"Sleeping for {SLEEP_TIME} seconds...")
         time.sleep(SLEEP_TIME)
@@ -228,25 +1641,69 @@ if __name__ == "__main__":
         elif command == 'year2025':
             # Load theo chunks monthly
             load_specific_year_data()
+        elif command == 'backfill':
+            # Backfill song song: python data_ingestion.py backfill 2020-01-01 2025-12-01 [chunk_days] [workers]
+            if len(sys.argv) >= 4:
+                start_date = datetime.fromisoformat(sys.argv[2])
+                end_date = datetime.fromisoformat(sys.argv[3])
+                chunk_days = float(sys.argv[4]) if len(sys.argv) >= 5 else None
+                workers = int(sys.argv[5]) if len(sys.argv) >= 6 else None
+                run_backfill(start_date, end_date, chunk_days, workers)
+            else:
+                print("Usage: python data_ingestion.py backfill YYYY-MM-DD YYYY-MM-DD [chunk_days] [workers]")
+        elif command == 'replay':
+            # Replay từ archive: python data_ingestion.py replay [YYYY-MM-DD] [YYYY-MM-DD]
+            start_date = sys.argv[2] if len(sys.argv) >= 3 else None
+            end_date = sys.argv[3] if len(sys.argv) >= 4 else None
+            replay_archive(start_date, end_date)
+        elif command == 'metrics':
+            # In số liệu ingest dạng Prometheus text: python data_ingestion.py metrics
+            init_db()
+            print(ingest_metrics.prometheus_text(), end='')
+        elif command == 'rollup':
+            # Tính lại rollup: python data_ingestion.py rollup [YYYY-MM-DD] [YYYY-MM-DD]
+            start_date = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) >= 3 else None
+            end_date = datetime.fromisoformat(sys.argv[3]) if len(sys.argv) >= 4 else None
+            run_rollup_rebuild(start_date, end_date)
+        elif command == 'retention':
+            # Archive các tháng cũ: python data_ingestion.py retention [số_tháng_giữ_lại]
+            init_db()
+            months = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+            if run_storage_maintenance(months) is None:
+                sys.exit(1)
+        elif command == 'import':
+            # Import catalog ComCat: python data_ingestion.py import catalog_2000.csv catalog_2001.parquet ...
+            if len(sys.argv) >= 3:
+                result = import_catalog(sys.argv[2:])
+                if not result["ok"]:
+                    sys.exit(1)
+            else:
+                print("Usage: python data_ingestion.py import FILE.csv|FILE.parquet [FILE ...]")
         elif command.startswith('custom'):
             # Custom range: python data_ingestion.py custom 2025-01-01 2025-12-01
             if len(sys.argv) >= 4:
                 start_date = sys.argv[2]
                 end_date = sys.argv[3]
                 print(f"Loading custom range: {start_date} to {end_date}")
-                init_db()
-                data = fetch_custom_range_data(start_date, end_date)
-                if data:
-                    process_and_save(data)
-                    print(f"✅ Loaded {len(data.get('features', []))} records")
+                # Chạy qua backfill để có checkpoint, chạy lại sẽ tiếp tục từ chỗ dừng
+                result = run_backfill(datetime.fromisoformat(start_date), datetime.fromisoformat(end_date))
+                if result["ok"]:
+                    print(f"✅ Loaded {result['fetched']} records")
                 else:
-                    print("❌ Không thể tải dữ liệu khoảng thời gian tùy chỉnh")
+                    print(f"❌ {len(result['failed'])} chunk lỗi, chạy lại lệnh để thử lại các chunk này")
             else:
                 print("Usage: python data_ingestion.py custom YYYY-MM-DD YYYY-MM-DD")
         else:
-            print("Commands: init, full2025, year2025, custom")
+            print("Commands: init, full2025, year2025, custom, backfill, replay, import, rollup, retention, metrics")
             print("  full2025 - Load complete 1/1 to 1/12/2025 without limit")
-            print("  year2025 - Load by monthly chunks (safer for large data)")
+            print("  year2025 - Load by chunks (safer for large data)")
+            print("  backfill START END [chunk_days] [workers] - Parallel chunked backfill")
+            print("  replay [START] [END] - Re-ingest from INGEST_ARCHIVE_DIR without network")
+            print("  import FILE [FILE ...] - Bulk load ComCat CSV/Parquet catalog files")
+            print("  rollup [START] [END] - Rebuild hourly/daily rollup tables")
+            print("  retention [MONTHS] - Archive months older than MONTHS (default EARTHQUAKE_RETENTION_MONTHS)")
+            print("  metrics - Print ingest metrics in Prometheus text format")
+            print("Multi-feed daemon (significant_hour/all_hour/all_day/all_month): python ingest_daemon.py")
     else:
         # Chạy service thường xuyên
         run_service()
@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import data_ingestion as ingestion
+import ingest_metrics
+
+# Daemon ingestion nhiều feed: mỗi summary feed có chu kỳ riêng, chạy song song bằng asyncio.
+# HTTP/DB vẫn là code đồng bộ của data_ingestion, chạy qua asyncio.to_thread và
+# dùng chung 1 requests.Session (1 connection pool) -> không cần thêm thư viện async.
+# Chạy: python ingest_daemon.py
+
+# "tên_feed:chu_kỳ_giây", phân tách bởi dấu phẩy
+INGEST_DAEMON_FEEDS = os.getenv(
+    "INGEST_DAEMON_FEEDS",
+    f"significant_hour:30,all_hour:60,all_day:600,all_month:{ingestion.FULL_RECONCILE_INTERVAL}"
+)
+# Feed dùng để reconcile toàn bộ (ghi last_full_sync như run_ingest_cycle)
+RECONCILE_FEED = "all_month"
+# Giới hạn bộ nhớ dedup (id -> updated); all_month ~ vài chục nghìn event
+DEDUP_MAX_ENTRIES = int(os.getenv("INGEST_DEDUP_MAX", "200000"))
+DEDUP_WINDOW = timedelta(days=35)
+
+def parse_feeds(spec):
+    feeds = []
+    for part in spec.split(','):
+        name, _, seconds = part.strip().partition(':')
+        if name:
+            feeds.append((name, float(seconds or ingestion.SLEEP_TIME)))
+    return feeds
+
+def is_complete_feed(name):
+    # Chỉ feed all_* chứa mọi event trong cửa sổ -> mới được đẩy watermark
+    return name.startswith('all_')
+
+def dedup_features(features, seen):
+    """
+    Bỏ các feature đã ghi với cùng giá trị updated (các feed chồng lấn nhau:
+    significant_hour ⊂ all_hour ⊂ all_day ⊂ all_month)
+    """
+    fresh = []
+    for feature in features:
+        known = seen.get(feature.get('id'))
+        if known is None or known[0] != (feature.get('properties') or {}).get('updated'):
+            fresh.append(feature)
+    return fresh
+
+def mark_seen(features, seen):
+    for feature in features:
+        if feature.get('id'):
+            props = feature.get('properties') or {}
+            seen[feature['id']] = (props.get('updated'), props.get('time') or 0)
+
+    if len(seen) > DEDUP_MAX_ENTRIES:
+        # Event cũ hơn cửa sổ all_month không còn xuất hiện lại trong feed
+        cutoff = (time.time() - DEDUP_WINDOW.total_seconds()) * 1000
+        for key in [key for key, (_, event_time) in seen.items() if event_time < cutoff]:
+            del seen[key]
+    if len(seen) > DEDUP_MAX_ENTRIES:
+        newest = sorted(seen.items(), key=lambda item: item[1][1], reverse=True)[:DEDUP_MAX_ENTRIES // 2]
+        seen.clear()
+        seen.update(newest)
+
+def new_feed_stats():
+    return {"polls": 0, "not_modified": 0, "fetched": 0, "duplicates": 0, "written": 0, "errors": 0}
+
+def save_progress(name, result):
+    if is_complete_feed(name):
+        ingestion.save_watermark(result.get('max_updated'), full_sync=(name == RECONCILE_FEED))
+    if name == RECONCILE_FEED:
+        ingestion.cleanup_outbox()
+        ingest_metrics.cleanup_metrics()
+        ingestion.run_storage_maintenance()
+
+async def poll_once(name, url, state):
+    # Mỗi lần poll là 1 chu kỳ trong ingest_metrics (task asyncio có context riêng)
+    cycle = ingest_metrics.start_cycle(name)
+    result = None
+    try:
+        result = await poll_feed_once(name, url, state)
+    finally:
+        await asyncio.to_thread(ingest_metrics.finish_cycle, cycle, result)
+
+async def poll_feed_once(name, url, state):
+    stats = state["stats"][name]
+    stats["polls"] += 1
+    started = time.time()
+
+    data = await asyncio.to_thread(ingestion.fetch_summary_feed, url)
+    if data is None:
+        stats["errors"] += 1
+        ingestion.forget_validators(url)
+        return None
+
+    features = data.get('features', [])
+    if not features:
+        # 304 (fetch_summary_feed trả list rỗng) hoặc feed rỗng
+        stats["not_modified"] += 1
+        return {"ok": True, "fetched": 0}
+
+    fresh = dedup_features(features, state["seen"])
+    stats["fetched"] += len(features)
+    stats["duplicates"] += len(features) - len(fresh)
+
+    result = {"ok": True, "max_updated": None}
+    if fresh:
+        # 1 writer tại một thời điểm: giữ thứ tự ghi, tránh lock SQLite
+        async with state["write_lock"]:
+            result = await asyncio.to_thread(ingestion.process_and_save, {'features': fresh})
+
+    if result and result.get('ok'):
+        mark_seen(fresh, state["seen"])
+        stats["written"] += len(fresh)
+        await asyncio.to_thread(save_progress, name, result)
+    else:
+        stats["errors"] += 1
+        ingestion.forget_validators(url)
+
+    print(f"[{datetime.now()}] {name}: {len(features)} features, {len(fresh)} mới/thay đổi sau dedup "
+          f"({time.time() - started:.2f}s)")
+    # Event bị dedup bỏ qua tính là không đổi
+    return dict(result, fetched=len(features),
+                unchanged=(result.get('unchanged') or 0) + len(features) - len(fresh))
+
+def initial_delay(name, interval):
+    if name != RECONCILE_FEED:
+        return 0
+    # Reconcile ngay nếu chưa từng full sync hoặc đã quá hạn, ngược lại chờ tới hạn
+    _, last_full = ingestion.load_watermark()
+    if last_full is None:
+        return 0
+    return max(0.0, interval - (datetime.utcnow() - last_full).total_seconds())
+
+async def poll_feed(name, interval, state):
+    url = ingestion.SUMMARY_FEED_URL.format(name)
+    delay = await asyncio.to_thread(initial_delay, name, interval)
+    print(f"-> {name}: mỗi {interval:.0f}s, lần đầu sau {delay:.0f}s")
+    next_run = time.monotonic() + delay
+
+    while True:
+        await asyncio.sleep(max(0.0, next_run - time.monotonic()))
+        # Lịch cố định theo interval (không trôi theo thời gian xử lý); bỏ qua lượt đã lỡ
+        next_run += interval
+        if next_run < time.monotonic():
+            next_run = time.monotonic() + interval
+        try:
+            await poll_once(name, url, state)
+        except Exception as e:
+            state["stats"][name]["errors"] += 1
+            print(f"Lỗi khi xử lý feed {name}: {e}")
+
+async def report_stats(state, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"[{datetime.now()}] Daemon stats (dedup cache {len(state['seen'])} ids):")
+        for name, stats in state["stats"].items():
+            print(f"   {name:<18} polls {stats['polls']:>5} 304/rỗng {stats['not_modified']:>5} "
+                  f"fetched {stats['fetched']:>8} trùng {stats['duplicates']:>8} "
+                  f"ghi {stats['written']:>7} lỗi {stats['errors']:>3}")
+
+async def run_daemon_async(feeds, report_interval=600):
+    state = {
+        "seen": {},
+        "write_lock": asyncio.Lock(),
+        "stats": {name: new_feed_stats() for name, _ in feeds},
+    }
+    tasks = [poll_feed(name, interval, state) for name, interval in feeds]
+    tasks.append(report_stats(state, report_interval))
+    await asyncio.gather(*tasks)
+
+def run_daemon(feeds=None):
+    ingestion.init_db()
+    feeds = feeds or parse_feeds(INGEST_DAEMON_FEEDS)
+    print("Service Data Ingestion Daemon Started...")
+    print(f"Feeds: {', '.join(f'{name} ({interval:.0f}s)' for name, interval in feeds)}")
+    print("---------------------------------")
+    ingest_metrics.start_metrics_server()
+    try:
+        asyncio.run(run_daemon_async(feeds))
+    except KeyboardInterrupt:
+        print("Daemon stopped.")
+
+if __name__ == "__main__":
+    # python ingest_daemon.py [feed:giây,feed:giây,...]
+    run_daemon(parse_feeds(sys.argv[1]) if len(sys.argv) >= 2 else None)
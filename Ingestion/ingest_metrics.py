@@ -0,0 +1,205 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from Data_API.database import SessionLocal, IngestMetric
+from Data_API.db_pool import pool_prometheus_text
+
+# Số liệu của từng chu kỳ ingest: ghi vào bảng ingest_metrics và xuất dạng Prometheus text.
+# Code fetch/parse/decode/write gọi record()/timed(); số liệu được cộng vào chu kỳ hiện tại
+# (ContextVar: asyncio.to_thread và các thread của ingest_pipeline mang theo context).
+
+# File Prometheus text (vd. cho node_exporter textfile collector), cập nhật sau mỗi chu kỳ
+INGEST_METRICS_FILE = os.getenv("INGEST_METRICS_FILE", "")
+# Port endpoint /metrics (0 = tắt)
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "0"))
+INGEST_METRICS_RETENTION_DAYS = int(os.getenv("INGEST_METRICS_RETENTION_DAYS", "30"))
+
+METRIC_PREFIX = "earthquake_ingest"
+TIMING_FIELDS = ['http_seconds', 'parse_seconds', 'decode_seconds', 'write_seconds']
+COUNTER_FIELDS = ['http_bytes', 'retries', 'rows_fetched', 'rows_new', 'rows_updated', 'rows_unchanged', 'rows_rejected']
+
+current_cycle = contextvars.ContextVar('ingest_cycle', default=None)
+metrics_lock = threading.Lock()
+
+def start_cycle(source):
+    """
+    Bắt đầu đo 1 chu kỳ; các record()/timed() sau đó (cùng context) cộng vào chu kỳ này
+    """
+    cycle = {field: 0 for field in TIMING_FIELDS + COUNTER_FIELDS}
+    cycle.update({"source": source, "started_at": datetime.utcnow(), "started": time.time()})
+    current_cycle.set(cycle)
+    return cycle
+
+def record(field, value):
+    cycle = current_cycle.get()
+    if cycle is not None:
+        with metrics_lock:
+            cycle[field] += value
+
+@contextmanager
+def timed(field):
+    started = time.time()
+    try:
+        yield
+    finally:
+        record(field, time.time() - started)
+
+def finish_cycle(cycle, result):
+    """
+    Kết thúc chu kỳ: lấy số dòng từ result của process_and_save / save_feature_stream,
+    ghi 1 dòng ingest_metrics và cập nhật file Prometheus (nếu cấu hình)
+    """
+    current_cycle.set(None)
+    result = result or {}
+    features = result.get('fetched')
+    if features is None:
+        features = sum(result.get(key) or 0 for key in ('inserted', 'updated', 'unchanged', 'rejected'))
+
+    duration = time.time() - cycle["started"]
+    metric = IngestMetric(
+        source=cycle["source"],
+        started_at=cycle["started_at"],
+        duration=duration,
+        ok=1 if result.get('ok') else 0,
+        rows_fetched=features,
+        rows_new=result.get('inserted') or 0,
+        rows_updated=result.get('updated') or 0,
+        rows_unchanged=result.get('unchanged') or 0,
+        rows_rejected=result.get('rejected') or 0,
+        http_bytes=cycle["http_bytes"],
+        retries=cycle["retries"],
+        **{field: cycle[field] for field in TIMING_FIELDS}
+    )
+
+    session = SessionLocal()
+    try:
+        session.add(metric)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi lưu ingest metrics: {e}")
+    finally:
+        session.close()
+
+    print(f"-> Metrics [{cycle['source']}]: {duration:.2f}s (http {cycle['http_seconds']:.2f}s, "
+          f"{cycle['http_bytes'] / 1024:.0f} KB, parse {cycle['parse_seconds']:.2f}s, "
+          f"decode {cycle['decode_seconds']:.2f}s, write {cycle['write_seconds']:.2f}s, retries {cycle['retries']})")
+    if INGEST_METRICS_FILE:
+        write_prometheus_file(INGEST_METRICS_FILE)
+
+def cleanup_metrics():
+    session = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=INGEST_METRICS_RETENTION_DAYS)
+        session.query(IngestMetric).filter(IngestMetric.started_at < cutoff).delete(synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Lỗi khi dọn ingest_metrics: {e}")
+    finally:
+        session.close()
+
+def prometheus_text():
+    """
+    Prometheus text format từ bảng ingest_metrics:
+    counter = tổng theo source, gauge = giá trị của chu kỳ gần nhất mỗi source
+    """
+    session = SessionLocal()
+    try:
+        sums = session.query(
+            IngestMetric.source,
+            func.count(IngestMetric.id),
+            func.sum(IngestMetric.ok),
+            *[func.sum(getattr(IngestMetric, field)) for field in COUNTER_FIELDS + TIMING_FIELDS]
+        ).group_by(IngestMetric.source).all()
+        latest_ids = session.query(func.max(IngestMetric.id)).group_by(IngestMetric.source)
+        latest = session.query(IngestMetric).filter(IngestMetric.id.in_(latest_ids)).all()
+    finally:
+        session.close()
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {float(value or 0)!r}")
+
+    metric("cycles_total", "counter", "Số chu kỳ ingest theo kết quả.",
+           [({"source": row[0], "status": "ok"}, row[2]) for row in sums]
+           + [({"source": row[0], "status": "error"}, row[1] - (row[2] or 0)) for row in sums])
+    sums_by_field = {field: [(row[0], row[3 + i]) for row in sums] for i, field in enumerate(COUNTER_FIELDS + TIMING_FIELDS)}
+    metric("rows_total", "counter", "Số event đã xử lý theo loại.",
+           [({"source": source, "kind": field[len('rows_'):]}, value)
+            for field in COUNTER_FIELDS if field.startswith('rows_') for source, value in sums_by_field[field]])
+    metric("http_bytes_total", "counter", "Số byte body HTTP đã tải.",
+           [({"source": source}, value) for source, value in sums_by_field['http_bytes']])
+    metric("http_retries_total", "counter", "Số lần retry HTTP.",
+           [({"source": source}, value) for source, value in sums_by_field['retries']])
+    metric("phase_seconds_total", "counter", "Tổng thời gian theo giai đoạn.",
+           [({"source": source, "phase": field[:-len('_seconds')]}, value)
+            for field in TIMING_FIELDS for source, value in sums_by_field[field]])
+    metric("last_cycle_seconds", "gauge", "Thời gian các giai đoạn của chu kỳ gần nhất.",
+           [({"source": m.source, "phase": phase}, getattr(m, field))
+            for m in latest for phase, field in [('total', 'duration')] + [(f[:-len('_seconds')], f) for f in TIMING_FIELDS]])
+    metric("last_cycle_rows", "gauge", "Số event của chu kỳ gần nhất theo loại.",
+           [({"source": m.source, "kind": field[len('rows_'):]}, getattr(m, field))
+            for m in latest for field in COUNTER_FIELDS if field.startswith('rows_')])
+    metric("last_cycle_timestamp_seconds", "gauge", "Thời điểm bắt đầu chu kỳ gần nhất (epoch UTC).",
+           [({"source": m.source}, (m.started_at - datetime(1970, 1, 1)).total_seconds()) for m in latest])
+    metric("last_cycle_success", "gauge", "1 nếu chu kỳ gần nhất thành công.",
+           [({"source": m.source}, m.ok) for m in latest])
+    # Kèm số liệu connection pool của process ingestion
+    return "\n".join(lines) + "\n" + pool_prometheus_text()
+
+def write_prometheus_file(path):
+    try:
+        text = prometheus_text()
+        # Ghi file tạm rồi rename để collector không đọc phải file ghi dở
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+    except (OSError, SQLAlchemyError) as e:
+        print(f"Lỗi khi ghi file metrics: {e}")
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            body = prometheus_text().encode()
+            status = 200
+        except SQLAlchemyError as e:
+            body = f"# error: {e}\n".encode()
+            status = 500
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port=None):
+    """
+    Chạy endpoint http://0.0.0.0:<port>/metrics ở thread nền (nếu INGEST_METRICS_PORT > 0)
+    """
+    port = INGEST_METRICS_PORT if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="ingest-metrics", daemon=True).start()
+    print(f"-> Metrics endpoint: http://0.0.0.0:{port}/metrics")
+    return server
@@ -0,0 +1,186 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+
+# Pipeline nhiều stage chạy bằng thread, nối với nhau bằng queue có giới hạn.
+# Stage sau chậm (vd. ghi DB) -> queue trước đầy -> put() bị block -> stage trước
+# (vd. fetch) tự chậm lại thay vì dồn dữ liệu không giới hạn trong RAM.
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+PIPELINE_REPORT_INTERVAL = float(os.getenv("PIPELINE_REPORT_INTERVAL", "10"))
+
+# Đánh dấu hết dữ liệu cho từng worker
+END = object()
+
+def new_stats(name, workers, input_queue):
+    return {
+        "name": name,
+        "workers": workers,
+        "queue": input_queue,     # queue đầu vào của stage (None với source)
+        "items_in": 0,
+        "items_out": 0,
+        "events": 0,              # số event đã xử lý (theo size_of của output, stage cuối theo input)
+        "busy": 0.0,              # tổng giây các worker thực sự làm việc
+        "blocked": 0.0,           # tổng giây chờ put() vì stage sau đầy (backpressure)
+        "errors": 0,
+        "max_depth": 0,
+        "lock": threading.Lock(),
+    }
+
+def put_item(target, item, stats, size_of):
+    size = size_of(item)
+    waited = time.time()
+    target.put(item)
+    waited = time.time() - waited
+    with stats["lock"]:
+        stats["blocked"] += waited
+        stats["items_out"] += 1
+        stats["events"] += size
+
+def stage_worker(func, inbox, outbox, stats, size_of, state, next_workers):
+    while True:
+        item = inbox.get()
+        if item is END:
+            break
+        with stats["lock"]:
+            stats["items_in"] += 1
+            if outbox is None:
+                stats["events"] += size_of(item)
+
+        started = time.time()
+        try:
+            outputs = func(item)
+            # func là generator: mỗi output được đẩy ngay sang stage sau,
+            # thời gian chờ queue không tính vào busy
+            while True:
+                try:
+                    output = next(outputs)
+                except StopIteration:
+                    break
+                busy = time.time() - started
+                with stats["lock"]:
+                    stats["busy"] += busy
+                if outbox is not None:
+                    put_item(outbox, output, stats, size_of)
+                started = time.time()
+        except Exception as e:
+            with stats["lock"]:
+                stats["errors"] += 1
+            print(f"Lỗi stage {stats['name']}: {e}")
+        with stats["lock"]:
+            stats["busy"] += time.time() - started
+
+    # Worker cuối cùng của stage báo hết dữ liệu cho stage sau
+    with state["lock"]:
+        state["alive"][stats["name"]] -= 1
+        last = state["alive"][stats["name"]] == 0
+    if last and outbox is not None:
+        for _ in range(next_workers):
+            outbox.put(END)
+
+def feed_source(source, outbox, stats, size_of, next_workers):
+    try:
+        iterator = iter(source)
+        while True:
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            with stats["lock"]:
+                stats["busy"] += time.time() - started
+                stats["items_in"] += 1
+            put_item(outbox, item, stats, size_of)
+    except Exception as e:
+        with stats["lock"]:
+            stats["errors"] += 1
+        print(f"Lỗi stage {stats['name']}: {e}")
+    finally:
+        for _ in range(next_workers):
+            outbox.put(END)
+
+def format_stats(all_stats, elapsed):
+    lines = []
+    for stats in all_stats:
+        q = stats["queue"]
+        depth = f"{q.qsize()}/{q.maxsize}" if q is not None else "-"
+        capacity = elapsed * stats["workers"]
+        busy = 100.0 * stats["busy"] / capacity if capacity > 0 else 0
+        rate = stats["events"] / elapsed if elapsed > 0 else 0
+        lines.append(
+            f"   {stats['name']:<10} x{stats['workers']:<3} queue {depth:>6} (max {stats['max_depth']:>3})"
+            f" in {stats['items_in']:>6} out {stats['items_out']:>6} {rate:>9.0f} ev/s"
+            f" busy {busy:>5.1f}% blocked {stats['blocked']:>7.1f}s lỗi {stats['errors']}"
+        )
+    return "\n".join(lines)
+
+def snapshot(all_stats, elapsed):
+    # Bản sao chỉ gồm số liệu (không lock/queue) để trả về cho caller
+    result = []
+    for stats in all_stats:
+        capacity = elapsed * stats["workers"]
+        result.append({
+            "name": stats["name"],
+            "workers": stats["workers"],
+            "items_in": stats["items_in"],
+            "items_out": stats["items_out"],
+            "events": stats["events"],
+            "events_per_second": stats["events"] / elapsed if elapsed > 0 else 0,
+            "busy_pct": 100.0 * stats["busy"] / capacity if capacity > 0 else 0,
+            "blocked_seconds": stats["blocked"],
+            "max_queue_depth": stats["max_depth"],
+            "errors": stats["errors"],
+        })
+    return result
+
+def run_pipeline(source, stages, source_name="source", queue_size=None, report_interval=None, size_of=None):
+    """
+    Chạy pipeline: source (iterable) -> stages[0] -> stages[1] -> ...
+    stages: list (tên, func, số worker); func(item) là generator yield 0..n item cho stage sau,
+    output của stage cuối bị bỏ qua (stage cuối tự ghi kết quả).
+    Trả về list số liệu từng stage (xem snapshot), đồng thời in định kỳ queue depth/throughput.
+    """
+    queue_size = queue_size or PIPELINE_QUEUE_SIZE
+    report_interval = PIPELINE_REPORT_INTERVAL if report_interval is None else report_interval
+    size_of = size_of or (lambda item: 1)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    source_stats = new_stats(source_name, 1, None)
+    stage_stats = [new_stats(name, workers, queues[i]) for i, (name, _, workers) in enumerate(stages)]
+    all_stats = [source_stats] + stage_stats
+    state = {"lock": threading.Lock(), "alive": {name: workers for name, _, workers in stages}}
+
+    # Mỗi thread chạy trong bản sao context của caller (vd. số liệu chu kỳ của ingest_metrics)
+    threads = [threading.Thread(
+        target=contextvars.copy_context().run, args=(feed_source, source, queues[0], source_stats, size_of, stages[0][2]),
+        name=f"pipeline-{source_name}", daemon=True
+    )]
+    for i, (name, func, workers) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        next_workers = stages[i + 1][2] if i + 1 < len(stages) else 0
+        for n in range(workers):
+            threads.append(threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(stage_worker, func, queues[i], outbox, stage_stats[i], size_of, state, next_workers),
+                name=f"pipeline-{name}-{n}", daemon=True
+            ))
+
+    started = time.time()
+    last_report = started
+    for thread in threads:
+        thread.start()
+
+    # Thread chính chỉ theo dõi: lấy mẫu độ sâu queue và in báo cáo định kỳ
+    while any(thread.is_alive() for thread in threads):
+        threads[-1].join(0.2)
+        for stats in stage_stats:
+            stats["max_depth"] = max(stats["max_depth"], stats["queue"].qsize())
+        if report_interval and time.time() - last_report >= report_interval:
+            last_report = time.time()
+            print(f"-> Pipeline ({time.time() - started:.0f}s):\n{format_stats(all_stats, last_report - started)}")
+
+    elapsed = time.time() - started
+    print(f"-> Pipeline xong sau {elapsed:.1f}s:\n{format_stats(all_stats, elapsed)}")
+    return snapshot(all_stats, elapsed)
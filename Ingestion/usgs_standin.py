@@ -0,0 +1,230 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import random
+import hashlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Server giả lập USGS (summary feed + FDSN query) để đo hiệu năng ingestion không cần mạng.
+# Chạy: python usgs_standin.py [port] [events_per_day] [delay_giây] [tỉ_lệ_lỗi_5xx]
+# Rồi trỏ ingestion tới: USGS_BASE_URL=http://127.0.0.1:<port>
+
+DEFAULT_PORT = 8089
+EVENTS_PER_DAY = 400
+FDSN_MAX_EVENTS = 20000
+SUMMARY_PATH = "/earthquakes/feed/v1.0/summary/"
+QUERY_PATH = "/fdsnws/event/1/query"
+SUMMARY_WINDOWS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(days=7),
+    'month': timedelta(days=30),
+}
+# Mốc thời gian của event số 0 (dữ liệu giả lập liên tục từ mốc này)
+EPOCH_START = datetime(2000, 1, 1)
+
+# Cấu hình runtime (đổi qua dòng lệnh)
+settings = {
+    'events_per_day': EVENTS_PER_DAY,
+    'delay': 0.0,          # giây chờ trước mỗi response (giả lập USGS chậm)
+    'error_rate': 0.0,     # xác suất trả 503
+    'archive_dir': os.getenv("INGEST_ARCHIVE_DIR", ""),  # phục vụ summary feed từ archive nếu có
+}
+def interval_ms():
+    return 86400000.0 / settings['events_per_day']
+
+def to_epoch_ms(dt):
+    return int((dt - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+def event_at(index):
+    """
+    Event giả lập thứ index: luôn sinh ra cùng dữ liệu cho cùng index
+    """
+    time_ms = to_epoch_ms(EPOCH_START) + int(index * interval_ms())
+    rnd = random.Random(index)
+    # Phân bố magnitude lệch về các trận nhỏ giống catalog thật
+    magnitude = round(min(9.0, 0.5 + rnd.expovariate(1.0)), 2)
+    return {
+        "type": "Feature",
+        "properties": {
+            "mag": magnitude,
+            "place": f"{rnd.randint(1, 200)} km of Standin Region {index % 97}",
+            "time": time_ms,
+            "updated": time_ms + 60000 + (index % 7) * 1000,
+            "url": f"https://example.invalid/event/sx{index:010d}",
+            "status": "reviewed" if index % 3 else "automatic",
+            "tsunami": 1 if magnitude >= 7.0 else 0,
+            "magType": "ml" if magnitude < 4 else "mb",
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [round(rnd.uniform(-180, 180), 4), round(rnd.uniform(-80, 80), 4), round(rnd.uniform(0, 300), 2)]
+        },
+        "id": f"sx{index:010d}"
+    }
+
+def events_between(start, end, min_magnitude=None):
+    """
+    Các event có time trong [start, end), mới nhất trước (giống orderby=time của FDSN)
+    """
+    base = to_epoch_ms(EPOCH_START)
+    first = max(0, int((to_epoch_ms(start) - base) / interval_ms()) - 1)
+    last = int((to_epoch_ms(end) - base) / interval_ms()) + 1
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+
+    features = []
+    for index in range(last, first - 1, -1):
+        feature = event_at(index)
+        props = feature['properties']
+        if not (start_ms <= props['time'] < end_ms):
+            continue
+        if min_magnitude is not None and props['mag'] < min_magnitude:
+            continue
+        features.append(feature)
+    return features
+
+def feature_collection(features, title):
+    return {
+        "type": "FeatureCollection",
+        "metadata": {
+            "generated": to_epoch_ms(datetime.utcnow()),
+            "title": title,
+            "status": 200,
+            "count": len(features)
+        },
+        "features": features
+    }
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', ''))
+
+def latest_archived_payload(label):
+    if not settings['archive_dir']:
+        return None
+    files = sorted(glob.glob(os.path.join(settings['archive_dir'], '*', '*', '*', f'*_{label}.geojson.gz')))
+    if not files:
+        return None
+    with gzip.open(files[-1], 'rb') as f:
+        return f.read()
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 1024
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if settings['delay']:
+            time.sleep(settings['delay'])
+
+        if settings['error_rate'] and random.random() < settings['error_rate']:
+            self.send_body(503, b"Service Unavailable (standin)", "text/plain")
+            return
+
+        url = urlparse(self.path)
+        if url.path.startswith(SUMMARY_PATH):
+            self.handle_summary(url.path[len(SUMMARY_PATH):])
+        elif url.path == QUERY_PATH:
+            self.handle_query(parse_qs(url.query))
+        else:
+            self.send_body(404, b"Not found", "text/plain")
+
+    def handle_summary(self, name):
+        # vd. all_month.geojson, significant_hour.geojson
+        label = name.replace('.geojson', '')
+        level, _, window_name = label.partition('_')
+        window = SUMMARY_WINDOWS.get(window_name)
+        if window is None:
+            self.send_body(404, b"Unknown feed", "text/plain")
+            return
+
+        archived = latest_archived_payload(label)
+        if archived is not None:
+            body = archived
+        else:
+            # Feed USGS được sinh lại mỗi phút -> ETag theo phút hiện tại
+            now = datetime.utcnow().replace(second=0, microsecond=0)
+            min_magnitude = {'significant': 6.0, '4.5': 4.5, '2.5': 2.5, '1.0': 1.0}.get(level)
+            features = events_between(now - window, now, min_magnitude)
+            body = json.dumps(feature_collection(features, f"Standin {label}")).encode()
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(200, body, headers={"ETag": etag})
+
+    def handle_query(self, query):
+        param = lambda key: query.get(key, [None])[0]
+        try:
+            end = parse_time(param('endtime')) if param('endtime') else datetime.utcnow()
+            start = parse_time(param('starttime')) if param('starttime') else end - timedelta(days=30)
+            min_magnitude = float(param('minmagnitude')) if param('minmagnitude') else None
+            limit = int(param('limit')) if param('limit') else None
+            updated_after = parse_time(param('updatedafter')) if param('updatedafter') else None
+        except ValueError as e:
+            self.send_body(400, f"Bad Request: {e}".encode(), "text/plain")
+            return
+
+        if updated_after is not None:
+            # updated = time + 60..66s nên chỉ cần sinh các event gần updatedafter
+            start = max(start, updated_after - timedelta(seconds=67))
+        features = events_between(start, end, min_magnitude)
+        if updated_after is not None:
+            updated_ms = to_epoch_ms(updated_after)
+            features = [f for f in features if f['properties']['updated'] > updated_ms]
+
+        if limit is None and len(features) > FDSN_MAX_EVENTS:
+            message = f"Error 400: Bad Request\n\n{len(features)} matching events exceeds search limit of {FDSN_MAX_EVENTS}. Modify the search to match fewer events."
+            self.send_body(400, message.encode(), "text/plain")
+            return
+        if limit is not None:
+            features = features[:min(limit, FDSN_MAX_EVENTS)]
+
+        if not features:
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(200, json.dumps(feature_collection(features, "Standin query")).encode())
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_PORT
+    if len(sys.argv) >= 3:
+        settings['events_per_day'] = float(sys.argv[2])
+    if len(sys.argv) >= 4:
+        settings['delay'] = float(sys.argv[3])
+    if len(sys.argv) >= 5:
+        settings['error_rate'] = float(sys.argv[4])
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    print(f"USGS stand-in listening on http://127.0.0.1:{port} "
+          f"({settings['events_per_day']:.0f} events/day, delay {settings['delay']}s, "
+          f"error rate {settings['error_rate']:.0%})")
+    print(f"Dùng: USGS_BASE_URL=http://127.0.0.1:{port} python data_ingestion.py ...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+from datetime import timezone
+
+import pytest
+
+# DB SQLite tạm cho cả lần chạy test: phải đặt trước khi import Data_API.database
+TEST_DB_DIR = tempfile.mkdtemp(prefix="earthquake_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Ingestion'))
+
+from Data_API.database import init_db
+
+init_db()
+
+
+def epoch_ms(dt):
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def feature(quake_id, time, updated, mag=2.5, coordinates=(120.0, 10.0, 15.0)):
+    # 1 feature GeoJSON dạng USGS; time/updated là datetime UTC
+    return {
+        'id': quake_id,
+        'properties': {'mag': mag, 'place': 'Test', 'time': epoch_ms(time), 'updated': epoch_ms(updated),
+                       'url': None, 'status': 'reviewed', 'tsunami': 0, 'magType': 'ml'},
+        'geometry': {'coordinates': list(coordinates)},
+    }
+
+@pytest.fixture
+def make_feature():
+    return feature
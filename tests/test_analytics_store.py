@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import data_ingestion as ingestion
+from Data_API import analytics_store
+from Data_API.database import SessionLocal, Earthquake, publish_reset
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(analytics_store, 'ANALYTICS_ENGINE', 'duckdb')
+    monkeypatch.setattr(analytics_store, 'ANALYTICS_DUCKDB_DIR', str(tmp_path))
+    monkeypatch.setattr(analytics_store, 'ANALYTICS_CHECK_INTERVAL', 3600)
+    monkeypatch.setattr(analytics_store, 'stores', {})
+    yield
+    for opened in analytics_store.stores.values():
+        opened["con"].close()
+
+def read_ids(session):
+    df = analytics_store.read_frame(select(Earthquake.id), session, 'test')
+    return set(df['id'])
+
+def test_store_follows_outbox(store, make_feature):
+    session = SessionLocal()
+    try:
+        read_ids(session)
+        ingestion.process_and_save({'features': [make_feature('duck1', datetime(2025, 9, 1), datetime(2025, 9, 1, 1))]})
+        session.rollback()
+        assert 'duck1' in read_ids(session)
+
+        # Xoá toàn bộ dữ liệu: bản ghi reset trong outbox, không cần so số dòng
+        session.query(Earthquake).delete()
+        publish_reset(session)
+        session.commit()
+        assert read_ids(session) == set()
+    finally:
+        session.close()
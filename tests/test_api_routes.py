@@ -0,0 +1,34 @@
+import asyncio
+
+from fastapi.dependencies.utils import get_dependant
+
+from Data_API import api_server
+from Data_API.database import SessionLocal
+
+
+class RunSyncSession:
+    # Thay AsyncSession (cần greenlet + driver async): run_sync gọi hàm với session sync
+    def __init__(self, session):
+        self.session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return fn(self.session, *args, **kwargs)
+
+def test_async_endpoint_has_same_query_params():
+    endpoint = api_server.async_endpoint(api_server.get_time_series)
+    sync_params = {param.name: param.field_info.metadata for param in get_dependant(
+        path="/api/time-series", call=api_server.get_time_series).query_params}
+    async_dependant = get_dependant(path="/api/time-series", call=endpoint)
+    assert {param.name: param.field_info.metadata for param in async_dependant.query_params} == sync_params
+    assert [dep.call for dep in async_dependant.dependencies] == [api_server.get_async_db]
+
+def test_async_endpoint_runs_sync_code():
+    endpoint = api_server.async_endpoint(api_server.get_earthquakes)
+    params = dict(start_date=None, end_date=None, min_magnitude=0.0, limit=5, min_lat=None, max_lat=None,
+                  min_lon=None, max_lon=None, lat=None, lon=None, radius_km=None)
+    session = SessionLocal()
+    try:
+        expected = api_server.get_earthquakes(**params, db=session)
+        assert asyncio.run(endpoint(**params, db=RunSyncSession(session))) == expected
+    finally:
+        session.close()
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pandas as pd
+
+import data_ingestion as ingestion
+from Data_API import earthquake_archive as archive
+from Data_API.database import SessionLocal, Earthquake, partition_name
+
+
+def month_ids(session, month):
+    return sorted(row[0] for row in session.query(Earthquake.id).filter(
+        Earthquake.time >= month, Earthquake.time < archive.add_months(month, 1)))
+
+def test_drop_partition_falls_back_when_month_changed(monkeypatch, make_feature):
+    month = datetime(2023, 5, 1)
+    ingestion.merge_and_save({'features': [
+        make_feature('arch1', datetime(2023, 5, 2), datetime(2023, 5, 2, 1)),
+        make_feature('arch2', datetime(2023, 5, 3), datetime(2023, 5, 3, 1)),
+    ]})
+    session = SessionLocal()
+    try:
+        hot = pd.read_sql(session.query(Earthquake).filter(Earthquake.id.in_(['arch1', 'arch2'])).statement,
+                          session.bind)
+        # Sau lúc đọc: 1 event mới vào tháng và arch2 được USGS cập nhật
+        ingestion.merge_and_save({'features': [
+            make_feature('arch3', datetime(2023, 5, 4), datetime(2023, 5, 4, 1)),
+            make_feature('arch2', datetime(2023, 5, 3), datetime(2023, 6, 1)),
+        ]})
+
+        dropped = []
+        monkeypatch.setattr(archive, 'earthquake_partitions', lambda conn: [partition_name(month)])
+        monkeypatch.setattr(session.connection(), 'exec_driver_sql', dropped.append)
+        archive.delete_archived_rows(session, month, hot)
+
+        assert dropped == []
+        assert month_ids(session, month) == ['arch2', 'arch3']
+    finally:
+        session.close()
+
+def test_drop_partition_when_month_unchanged(monkeypatch, make_feature):
+    month = datetime(2023, 7, 1)
+    ingestion.merge_and_save({'features': [make_feature('arch4', datetime(2023, 7, 2), datetime(2023, 7, 2, 1))]})
+    session = SessionLocal()
+    try:
+        hot = pd.read_sql(session.query(Earthquake).filter(Earthquake.id == 'arch4').statement, session.bind)
+
+        dropped = []
+        monkeypatch.setattr(archive, 'earthquake_partitions', lambda conn: [partition_name(month)])
+        monkeypatch.setattr(session.connection(), 'exec_driver_sql', dropped.append)
+        archive.delete_archived_rows(session, month, hot)
+
+        assert dropped == [f"ALTER TABLE earthquakes DROP PARTITION {partition_name(month)}"]
+    finally:
+        session.close()
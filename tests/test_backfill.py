@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, Earthquake
+
+
+@pytest.fixture
+def fdsn(monkeypatch, make_feature):
+    """
+    FDSN giả cho backfill: trả các event có time trong [start, end), tối đa FDSN_MAX_EVENTS (=2).
+    fdsn['fail']: các start của chunk trả lỗi; fdsn['calls']: các khoảng đã tải
+    """
+    state = {'events': [], 'fail': set(), 'calls': []}
+    lock = threading.Lock()
+
+    def fetch_range_chunk(start, end, min_magnitude=None):
+        with lock:
+            state['calls'].append((start, end))
+        if start in state['fail']:
+            return None, False
+        features = [make_feature(quake_id, time, time + timedelta(hours=1))
+                    for quake_id, time in state['events'] if start <= time < end]
+        return {'features': features[:ingestion.FDSN_MAX_EVENTS]}, len(features) >= ingestion.FDSN_MAX_EVENTS
+
+    monkeypatch.setattr(ingestion, 'fetch_range_chunk', fetch_range_chunk)
+    monkeypatch.setattr(ingestion, 'FDSN_MAX_EVENTS', 2)
+    return state
+
+def stored_ids(prefix):
+    session = SessionLocal()
+    try:
+        return sorted(row[0] for row in session.query(Earthquake.id).filter(Earthquake.id.like(f"{prefix}%")))
+    finally:
+        session.close()
+
+def test_backfill_splits_capped_chunks(fdsn):
+    start = datetime(2024, 1, 1)
+    fdsn['events'] = [(f"bf{i}", start + timedelta(hours=6 * i)) for i in range(6)]
+
+    totals = ingestion.run_backfill(start, start + timedelta(days=2), chunk_days=1, workers=2)
+
+    assert totals['ok'] and totals['fetched'] == 6
+    assert stored_ids('bf') == [f"bf{i}" for i in range(6)]
+    # Chunk 1 ngày có 4 event chạm giới hạn -> tải lại 2 nửa 12 giờ
+    assert (start, start + timedelta(hours=12)) in fdsn['calls']
+
+def test_backfill_resumes_from_checkpoints(fdsn):
+    start = datetime(2022, 2, 1)
+    fdsn['events'] = [(f"cp{i}", start + timedelta(days=i, hours=1)) for i in range(3)]
+    fdsn['fail'] = {start + timedelta(days=1)}
+
+    first = ingestion.run_backfill(start, start + timedelta(days=3), chunk_days=1, workers=1)
+    assert not first['ok'] and first['failed'] == [(start + timedelta(days=1), start + timedelta(days=2))]
+    assert stored_ids('cp') == ['cp0', 'cp2']
+
+    # Chạy lại cùng lệnh: chỉ tải lại chunk lỗi
+    fdsn['fail'] = set()
+    fdsn['calls'].clear()
+    second = ingestion.run_backfill(start, start + timedelta(days=3), chunk_days=1, workers=1)
+    assert second['ok'] and second['skipped'] == 2
+    assert fdsn['calls'] == [(start + timedelta(days=1), start + timedelta(days=2))]
+    assert stored_ids('cp') == ['cp0', 'cp1', 'cp2']
@@ -0,0 +1,17 @@
+import importlib.util
+
+import pytest
+
+from Data_API import db_async
+
+
+@pytest.mark.skipif(importlib.util.find_spec("aiosqlite") is not None, reason="aiosqlite đã được cài")
+def test_missing_async_driver_falls_back_to_sync(monkeypatch):
+    # Có greenlet (create_async_engine dùng được) nhưng thiếu aiosqlite -> endpoint sync, không lỗi lúc import
+    monkeypatch.setenv("API_ASYNC_DB", "1")
+    monkeypatch.setattr(db_async, 'create_async_engine', object())
+    assert db_async.async_db_enabled() is False
+
+def test_async_db_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("API_ASYNC_DB", raising=False)
+    assert db_async.async_db_enabled() is False
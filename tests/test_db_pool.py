@@ -0,0 +1,48 @@
+from sqlalchemy import create_engine
+
+from Data_API import db_pool
+
+
+def make_pool_engine(tmp_path, name, role=None, pool_size=2, max_overflow=3):
+    url = f"sqlite:///{tmp_path / 'pool.db'}"
+    options = dict(db_pool.engine_options(url), pool_size=pool_size, max_overflow=max_overflow)
+    engine = create_engine(url, **options)
+    db_pool.instrument_engine(engine, role=role, name=name)
+    return engine
+
+def test_overflow_connects_counted(tmp_path):
+    engine = make_pool_engine(tmp_path, 'test_overflow')
+    connections = [engine.connect() for _ in range(4)]
+    try:
+        status = db_pool.pool_status(engine)
+        assert (status["connects"], status["overflow_connects"], status["overflow"]) == (4, 2, 2)
+    finally:
+        for connection in connections:
+            connection.close()
+        engine.dispose()
+
+def test_api_role_has_no_statement_timeout(monkeypatch):
+    # /api/clustering và /api/correlation chạy lâu: không cắt query của API mặc định
+    monkeypatch.delenv("DB_STATEMENT_TIMEOUT", raising=False)
+    assert db_pool.pool_settings('api')['statement_timeout'] == 0
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT", "30")
+    assert db_pool.pool_settings('api')['statement_timeout'] == 30
+
+def test_stats_kept_per_engine_and_role(tmp_path):
+    primary = make_pool_engine(tmp_path, 'test_primary', role='api')
+    replica = make_pool_engine(tmp_path, 'test_replica', role='batch')
+    try:
+        with primary.connect(), primary.connect():
+            pass
+        with replica.connect():
+            pass
+        assert db_pool.pool_status(primary, 'api')["checkouts"] == 2
+        assert db_pool.pool_status(replica, 'batch')["checkouts"] == 1
+
+        text = db_pool.pool_prometheus_text()
+        assert 'earthquake_db_pool_checkout_wait_seconds_count{role="api",engine="test_primary"} 2' in text
+        assert 'earthquake_db_pool_checkout_wait_seconds_count{role="batch",engine="test_replica"} 1' in text
+        assert text.count("# TYPE earthquake_db_pool_connects_total counter") == 1
+    finally:
+        primary.dispose()
+        replica.dispose()
@@ -0,0 +1,27 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import data_ingestion as ingestion
+
+
+@pytest.fixture
+def non_utc_host(monkeypatch):
+    # Máy chạy ingestion không ở UTC: thời gian lưu vẫn phải là UTC
+    monkeypatch.setenv("TZ", "Asia/Ho_Chi_Minh")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_event_times_stored_as_utc(non_utc_host, make_feature):
+    event_time, updated = datetime(2025, 7, 1, 23, 30), datetime(2025, 7, 2, 0, 15)
+    item = make_feature('utc1', event_time, updated)
+
+    row = ingestion.feature_to_row(item)
+    assert (row['time'], row['updated']) == (event_time, updated)
+
+    columns = ingestion.decode_features([item])
+    assert columns['time'][0].astype(datetime) == event_time
+    assert columns['updated'][0].astype(datetime) == updated
@@ -0,0 +1,38 @@
+import requests
+
+import data_ingestion as ingestion
+
+FEED_URL = "http://usgs.test/earthquakes/feed/v1.0/summary/all_hour.geojson"
+
+
+class FakeSession:
+    def __init__(self, body):
+        self.body = body
+        self.headers = []
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False):
+        self.headers.append(headers)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.body
+        response.headers['ETag'] = '"v1"'
+        return response
+
+def test_validators_kept_only_after_successful_parse(monkeypatch):
+    ingestion.forget_validators(FEED_URL)
+    session = FakeSession(b'{"type": "FeatureCollection", "features": [')
+    monkeypatch.setattr(ingestion, 'get_http_session', lambda: session)
+
+    # Body bị cắt: không lưu ETag, lần sau vẫn tải đầy đủ
+    assert ingestion.fetch_summary_feed(FEED_URL) is None
+    assert FEED_URL not in ingestion.feed_validators
+
+    session.body = b'{"type": "FeatureCollection", "features": []}'
+    assert ingestion.fetch_summary_feed(FEED_URL) == {"type": "FeatureCollection", "features": []}
+    assert session.headers[-1] == {}
+    assert ingestion.feed_validators[FEED_URL] == {'If-None-Match': '"v1"'}
+
+    ingestion.fetch_summary_feed(FEED_URL)
+    assert session.headers[-1] == {'If-None-Match': '"v1"'}
+    ingestion.forget_validators(FEED_URL)
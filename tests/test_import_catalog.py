@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, select, func
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, Earthquake
+
+CSV_HEADER = "time,latitude,longitude,depth,mag,magType,id,updated,place,status"
+
+
+def write_catalog(path, rows):
+    path.write_text("\n".join([CSV_HEADER] + rows) + "\n")
+    return str(path)
+
+def test_import_uses_its_own_staging_table(tmp_path):
+    # Bảng staging của 1 lần import khác đang chạy: không bị xoá, không bị merge vào earthquakes
+    other = ingestion.new_staging_table()
+    other.create(ingestion.import_engine)
+    try:
+        with ingestion.import_engine.begin() as conn:
+            conn.execute(other.insert().values(id='otherrun1', time=None, updated=None))
+
+        path = write_catalog(tmp_path / "catalog.csv", [
+            "2024-03-01T10:00:00.000Z,10.0,120.0,15.0,3.1,ml,import1,2024-03-01T11:00:00.000Z,Test,reviewed",
+        ])
+        result = ingestion.import_catalog([path])
+
+        assert result['ok'] and result['inserted'] == 1
+        with ingestion.import_engine.connect() as conn:
+            assert conn.execute(select(func.count()).select_from(other)).scalar() == 1
+        session = SessionLocal()
+        try:
+            assert session.query(Earthquake).filter(Earthquake.id == 'import1').count() == 1
+            assert session.query(Earthquake).filter(Earthquake.id == 'otherrun1').count() == 0
+        finally:
+            session.close()
+        # Bảng staging của lần import này đã được xoá
+        staging = [name for name in inspect(ingestion.import_engine).get_table_names()
+                   if name.startswith(ingestion.IMPORT_STAGING_TABLE)]
+        assert staging == [other.name]
+    finally:
+        other.drop(ingestion.import_engine, checkfirst=True)
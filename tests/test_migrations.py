@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine, inspect
+
+from Data_API.database import Base, MIGRATIONS, SchemaMigration, migrate_initial_schema
+
+
+def test_fresh_db_goes_through_every_migration(tmp_path):
+    # DB mới: 001 chỉ tạo schema ban đầu, các migration sau mới thêm cột/index/bảng
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with fresh.begin() as conn:
+        migrate_initial_schema(conn)
+    columns = {column['name'] for column in inspect(fresh).get_columns('earthquakes')}
+    assert 'geohash' not in columns
+    assert not inspect(fresh).has_table('earthquake_rollup_hourly')
+
+    for version, _, func_migrate in MIGRATIONS[1:]:
+        with fresh.begin() as conn:
+            func_migrate(conn)
+
+    # Kết quả phải khớp model (schema_migrations do migrate() tạo)
+    db = inspect(fresh)
+    for table in Base.metadata.sorted_tables:
+        if table.name == SchemaMigration.__tablename__:
+            continue
+        assert {column['name'] for column in db.get_columns(table.name)} == set(table.c.keys()), table.name
+        assert {index['name'] for index in db.get_indexes(table.name)} == {index.name for index in table.indexes}, table.name
+    fresh.dispose()
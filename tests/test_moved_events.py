@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, Earthquake
+
+
+def stored_times(quake_id):
+    session = SessionLocal()
+    try:
+        return [row[0] for row in session.query(Earthquake.time).filter(Earthquake.id == quake_id)]
+    finally:
+        session.close()
+
+def test_merge_replaces_moved_event(make_feature):
+    # PK (id, time): USGS đổi time của event -> vẫn chỉ còn 1 dòng, mang time mới
+    event_time, updated = datetime(2025, 8, 1, 10, 0), datetime(2025, 8, 1, 10, 30)
+    moved_time = event_time + timedelta(minutes=3)
+
+    assert ingestion.merge_and_save({'features': [make_feature('moved1', event_time, updated)]})['ok']
+    assert ingestion.merge_and_save({'features': [
+        make_feature('moved1', moved_time, updated + timedelta(hours=1))]})['ok']
+
+    assert stored_times('moved1') == [moved_time]
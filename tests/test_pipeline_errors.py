@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, BackfillCheckpoint
+
+
+def bad_feature(make_feature, quake_id):
+    item = make_feature(quake_id, datetime(2024, 2, 1, 12), datetime(2024, 2, 1, 13))
+    item['geometry'] = None
+    return item
+
+def test_decode_error_marks_chunk_failed(monkeypatch, make_feature):
+    # Chunk decode lỗi phải tới được write (checkpoint 'failed') và làm lần backfill thất bại
+    start, end = datetime(2024, 2, 1), datetime(2024, 2, 2)
+    monkeypatch.setattr(ingestion, 'fetch_chunk_timed',
+                        lambda chunk_start, chunk_end: ({'features': [bad_feature(make_feature, 'baddecode1')]}, False, 0.0))
+
+    result = ingestion.run_backfill(start, end, chunk_days=1, workers=1)
+
+    assert not result['ok']
+    assert result['failed'] == [(start, end)]
+    session = SessionLocal()
+    try:
+        checkpoint = session.query(BackfillCheckpoint).filter(BackfillCheckpoint.range_start == start).one()
+    finally:
+        session.close()
+    assert checkpoint.status == 'failed'
+    assert checkpoint.error.startswith('decode failed')
+
+def test_stream_decode_error_is_not_ok(make_feature):
+    result = ingestion.save_feature_stream(iter([bad_feature(make_feature, 'baddecode2')]))
+    assert not result['ok']
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import data_ingestion as ingestion
+from Data_API import database
+
+
+@pytest.fixture
+def replica(monkeypatch, tmp_path):
+    # Replica SQLite giả lập (như lệnh sync-replica), cập nhật bằng database.sync_replica
+    replica_engine = database.make_engine(f"sqlite:///{tmp_path / 'replica.db'}", 'test_replica')
+    monkeypatch.setattr(database, 'replica_engine', replica_engine)
+    monkeypatch.setattr(database, 'ReadSessionLocal', sessionmaker(autocommit=False, autoflush=False, bind=replica_engine))
+    monkeypatch.setattr(database, 'REPLICA_LAG_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(database, 'REPLICA_CATCHUP_TIMEOUT', 0)
+    monkeypatch.setattr(database, 'replica_state', {"checked": None, "fresh": True, "lag": 0.0})
+    assert database.sync_replica()
+    yield replica_engine
+    replica_engine.dispose()
+
+def read_bind():
+    session = database.read_session()
+    try:
+        return session.get_bind()
+    finally:
+        session.close()
+
+def test_reads_go_to_fresh_replica(replica):
+    assert read_bind() is replica
+
+def test_lagging_replica_falls_back_to_primary(replica, monkeypatch, make_feature):
+    monkeypatch.setattr(database, 'REPLICA_MAX_LAG', 1e-9)
+    ingestion.process_and_save({'features': [make_feature('rep1', datetime(2025, 4, 1), datetime(2025, 4, 1, 1))]})
+    assert read_bind() is database.engine
+
+    database.sync_replica()
+    assert read_bind() is replica
+
+def test_reads_after_change_wait_for_replica(replica, make_feature):
+    ingestion.process_and_save({'features': [make_feature('rep2', datetime(2025, 4, 2), datetime(2025, 4, 2, 1))]})
+    session = database.SessionLocal()
+    try:
+        change_id = database.latest_change_id(session)
+    finally:
+        session.close()
+
+    # Replica chưa có batch vừa đánh thức -> đọc từ DB chính trong khối này
+    with database.reads_after_change(change_id):
+        assert read_bind() is database.engine
+    database.sync_replica()
+    with database.reads_after_change(change_id):
+        assert read_bind() is replica
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import data_ingestion as ingestion
+from Data_API import response_cache
+from Data_API.database import SessionLocal, IngestState, get_data_version, bump_data_version, DATA_VERSION_KEY
+
+
+def data_version_row():
+    session = SessionLocal()
+    try:
+        state = session.get(IngestState, DATA_VERSION_KEY)
+        return state.value if state else None
+    finally:
+        session.close()
+
+def test_ingest_batch_changes_version_without_updating_counter(make_feature):
+    session = SessionLocal()
+    try:
+        before = get_data_version(session)
+        counter = data_version_row()
+        ingestion.process_and_save({'features': [make_feature('cache1', datetime(2025, 10, 1), datetime(2025, 10, 1, 1))]})
+        session.rollback()
+        # Batch ingestion chỉ thêm dòng outbox: không UPDATE dòng data_version dùng chung
+        assert get_data_version(session) != before
+        assert data_version_row() == counter
+    finally:
+        session.close()
+
+def test_cached_response_recomputed_after_write(monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_VERSION_INTERVAL', 0)
+    response_cache.clear_cache()
+    calls = []
+
+    @response_cache.cached_response
+    def endpoint(days: int = 7, db=None):
+        calls.append(days)
+        return {"days": days}
+
+    session = SessionLocal()
+    try:
+        assert endpoint(days=7, db=session) == endpoint(days=7, db=session)
+        assert calls == [7]
+        bump_data_version(session)
+        session.commit()
+        endpoint(days=7, db=session)
+        assert calls == [7, 7]
+    finally:
+        session.close()
+        response_cache.clear_cache()
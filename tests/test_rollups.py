@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, Earthquake, EarthquakeRollupDaily
+
+
+def daily_counts(session, quake_id):
+    # Số event của quake_id theo từng ngày, lấy từ rollup (các test dùng ngày riêng nên không lẫn nhau)
+    day = session.query(Earthquake.time).filter(Earthquake.id == quake_id).scalar()
+    return {row.bucket_start.date(): row.event_count
+            for row in session.query(EarthquakeRollupDaily).filter(EarthquakeRollupDaily.event_count > 0)
+            if abs((row.bucket_start.date() - day.date()).days) <= 10}
+
+def write_feed(features):
+    ingestion.process_and_save({'features': features})
+
+def write_merge(features):
+    ingestion.merge_and_save({'features': features})
+
+def write_import(features, tmp_path=None):
+    path = tmp_path / f"{features[0]['id']}_{features[0]['properties']['updated']}.csv"
+    lines = ["time,latitude,longitude,depth,mag,magType,id,updated,place,status"]
+    for item in features:
+        props, (lon, lat, depth) = item['properties'], item['geometry']['coordinates']
+        as_iso = lambda ms: datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        lines.append(f"{as_iso(props['time'])},{lat},{lon},{depth},{props['mag']},{props['magType']},"
+                     f"{item['id']},{as_iso(props['updated'])},{props['place']},{props['status']}")
+    path.write_text("\n".join(lines) + "\n")
+    ingestion.import_catalog([str(path)])
+
+@pytest.mark.parametrize("writer, month", [(write_feed, 1), (write_merge, 3), (write_import, 5)])
+def test_rollup_follows_event_moved_in_time(writer, month, tmp_path, make_feature):
+    # USGS đổi time của event: rollup của ngày cũ phải bỏ event, ngày mới đếm event
+    quake_id = f"moved{month}"
+    old_time, new_time = datetime(2025, month, 1, 12), datetime(2025, month, 5, 12)
+    write = (lambda items: writer(items, tmp_path)) if writer is write_import else writer
+
+    write([make_feature(quake_id, old_time, datetime(2025, month, 1, 13))])
+    write([make_feature(quake_id, new_time, datetime(2025, month, 5, 13))])
+
+    session = SessionLocal()
+    try:
+        assert session.query(Earthquake).filter(Earthquake.id == quake_id).count() == 1
+        stored = session.query(Earthquake.time).filter(Earthquake.id == quake_id).scalar()
+        counts = daily_counts(session, quake_id)
+    finally:
+        session.close()
+    assert counts == {stored.date(): 1}
+    assert stored.date() == new_time.date()
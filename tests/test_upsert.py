@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, Earthquake
+
+
+def stored(quake_id):
+    session = SessionLocal()
+    try:
+        return session.query(Earthquake.magnitude, Earthquake.updated).filter(Earthquake.id == quake_id).all()
+    finally:
+        session.close()
+
+def test_process_and_save_inserts_then_updates(make_feature):
+    event_time, updated = datetime(2025, 2, 1, 8, 0), datetime(2025, 2, 1, 8, 30)
+    first = ingestion.process_and_save({'features': [
+        make_feature('ups1', event_time, updated, mag=3.0),
+        make_feature('ups2', event_time, updated, mag=4.0),
+    ]})
+    assert (first['ok'], first['inserted'], first['updated']) == (True, 2, 0)
+
+    # Cùng id trong 1 batch: giữ bản cuối
+    later = updated + timedelta(hours=2)
+    second = ingestion.process_and_save({'features': [
+        make_feature('ups1', event_time, later, mag=3.5),
+        make_feature('ups3', event_time, updated),
+        make_feature('ups3', event_time, later, mag=5.0),
+    ]})
+    assert (second['ok'], second['inserted'], second['updated']) == (True, 1, 1)
+    assert second['max_updated'] == later
+
+    assert stored('ups1') == [(3.5, later)]
+    assert stored('ups2') == [(4.0, updated)]
+    assert stored('ups3') == [(5.0, later)]
+
+def test_unchanged_events_not_rewritten(make_feature):
+    event_time, updated = datetime(2025, 2, 2, 8, 0), datetime(2025, 2, 2, 8, 30)
+    ingestion.process_and_save({'features': [make_feature('same1', event_time, updated),
+                                             make_feature('same2', event_time, updated)]})
+
+    # Poll lại: same1 không đổi updated -> bỏ qua, same2 có bản mới -> ghi
+    result = ingestion.process_and_save({'features': [
+        make_feature('same1', event_time, updated, mag=9.9),
+        make_feature('same2', event_time, updated + timedelta(minutes=5), mag=2.9),
+    ]})
+    assert (result['inserted'], result['updated'], result['unchanged']) == (0, 1, 1)
+    assert stored('same1')[0][0] == 2.5
+    assert stored('same2')[0][0] == 2.9
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_ingestion as ingestion
+from Data_API.database import SessionLocal, IngestState, get_ingest_state
+
+
+@pytest.fixture
+def fresh_watermark(monkeypatch):
+    session = SessionLocal()
+    try:
+        session.query(IngestState).filter(IngestState.key.in_(
+            [ingestion.WATERMARK_KEY, ingestion.LAST_FULL_SYNC_KEY])).delete(synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    monkeypatch.setattr(ingestion, 'INGEST_STREAMING', False)
+    monkeypatch.setattr(ingestion, 'run_storage_maintenance', lambda: None)
+
+def saved_watermark():
+    session = SessionLocal()
+    try:
+        return datetime.fromisoformat(get_ingest_state(session, ingestion.WATERMARK_KEY))
+    finally:
+        session.close()
+
+def test_cycles_advance_watermark(fresh_watermark, monkeypatch, make_feature):
+    now = datetime.utcnow().replace(microsecond=0)
+    first_updated = now - timedelta(hours=2)
+    calls = []
+
+    def full_feed():
+        calls.append('full')
+        return {'features': [make_feature('wm1', now - timedelta(hours=3), first_updated)]}
+
+    def incremental(watermark):
+        calls.append(watermark)
+        # Event cũ hơn watermark (cửa sổ chồng lấn) không kéo watermark lùi lại
+        return {'features': [make_feature('wm2', now - timedelta(hours=5), first_updated - timedelta(hours=1))]}
+
+    monkeypatch.setattr(ingestion, 'fetch_usgs_data', full_feed)
+    monkeypatch.setattr(ingestion, 'fetch_incremental', incremental)
+
+    # Chưa có watermark -> full sync; lần sau chỉ lấy phần thay đổi sau watermark
+    assert ingestion.run_ingest_cycle()['ok']
+    assert saved_watermark() == first_updated
+    assert ingestion.run_ingest_cycle()['ok']
+    assert calls == ['full', first_updated]
+    assert saved_watermark() == first_updated
+
+def test_updated_since_params_overlap():
+    params = ingestion.updated_since_params(datetime(2025, 3, 1, 12, 0, 0))
+    assert params['updatedafter'] == '2025-03-01T11:59:00'